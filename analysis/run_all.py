@@ -13,6 +13,8 @@ def main():
     qlog = shared / "raw" / "qlearning_agent_log.csv"
     if qlog.exists():
         steps.append([sys.executable, "qlearning_analysis.py"])
+    if (shared / "raw" / "qlearning_shadow_log.csv").exists():
+        steps.append([sys.executable, "shadow_analysis.py"])
 
     for cmd in steps:
         print("Running:", " ".join(cmd))
@@ -0,0 +1,71 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+import matplotlib.pyplot as plt
+
+
+def main():
+    shared = Path(os.environ.get("SHARED_DIR", "/shared"))
+    raw_dir = shared / "raw"
+    out_dir = shared / "results"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    log_path = raw_dir / "qlearning_shadow_log.csv"
+    if not log_path.exists():
+        print("Shadow log not found:", log_path)
+        return
+
+    df = pd.read_csv(log_path)
+    if df.empty:
+        print("Shadow log is empty:", log_path)
+        return
+
+    for c in ["ts", "primary_state", "shadow_state", "primary_port", "shadow_port", "agree", "explored",
+              "reward", "counterfactual_reward"]:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+    df = df.sort_values("ts")
+    df["dpid"] = df["key"].astype(str).str.split(":", n=1).str[0]
+
+    # Per shadow: how often it would have acted like the primary, and the
+    # reward its decisions would have earned where the primary's logged
+    # outcomes cover them, next to the primary's reward on the same rows.
+    rows = []
+    for (shadow, dpid), g in [((s, "all"), g) for s, g in df.groupby("shadow")] + list(df.groupby(["shadow", "dpid"])):
+        scored = g.dropna(subset=["counterfactual_reward"])
+        cf = float(scored["counterfactual_reward"].mean()) if not scored.empty else None
+        primary = float(scored["reward"].mean()) if not scored.empty else None
+        rows.append({
+            "shadow": shadow,
+            "dpid": dpid,
+            "decisions": len(g),
+            "agreement": float(g["agree"].mean()),
+            "explored": float(g["explored"].mean()),
+            "coverage": len(scored) / len(g),
+            "counterfactual_reward": cf,
+            "primary_reward_scored": primary,
+            "reward_delta": (cf - primary) if cf is not None else None,
+        })
+    summary = pd.DataFrame(rows)
+    summary.to_csv(out_dir / "shadow_summary.csv", index=False)
+
+    # Agreement with the primary over time
+    plt.figure()
+    for shadow, g in df.groupby("shadow"):
+        plt.plot(g["ts"] - df["ts"].min(), g["agree"].rolling(window=200, min_periods=1).mean(),
+                 linewidth=1, label=shadow)
+    plt.title("Shadow Agreement with Primary (MA200)")
+    plt.xlabel("Time (s)")
+    plt.ylabel("Agreement rate")
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(out_dir / "shadow_agreement.png")
+    plt.close()
+
+    print(summary[summary["dpid"] == "all"].to_string(index=False))
+    print("Saved shadow analysis outputs to", out_dir)
+
+
+if __name__ == "__main__":
+    main()
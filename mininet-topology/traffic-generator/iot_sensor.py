@@ -1,10 +1,12 @@
 import argparse, socket, time, os, csv, struct
 
+from qos_feed import QoSFeed, local_ip_towards, prefix_of
+
 CRIT_UDP = int(os.environ.get("CRIT_UDP", "5001"))
 TEL_UDP  = int(os.environ.get("TEL_UDP", "5002"))
 BULK_TCP = int(os.environ.get("BULK_TCP", "5003"))
 
-def udp_client(server_ip, port, label, rate_pps, duration_s, out_writer):
+def udp_client(server_ip, port, label, rate_pps, duration_s, out_writer, feed=None, prefixes=()):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.settimeout(0.2)
 
@@ -18,6 +20,12 @@ def udp_client(server_ip, port, label, rate_pps, duration_s, out_writer):
     next_send = start
     interval = 1.0 / max(1e-6, rate_pps)
 
+    # per-second counters for the agent's QoS feed
+    sec_start = start
+    sec_sent = 0
+    sec_recv = 0
+    sec_rtt = 0.0
+
     while time.time() - start < duration_s:
         now = time.time()
         if now >= next_send:
@@ -28,6 +36,7 @@ def udp_client(server_ip, port, label, rate_pps, duration_s, out_writer):
                 sock.sendto(payload, (server_ip, port))
                 pending[seq] = tns
                 sent += 1
+                sec_sent += 1
             except Exception:
                 pass
             next_send += interval
@@ -39,11 +48,19 @@ def udp_client(server_ip, port, label, rate_pps, duration_s, out_writer):
                 if rseq in pending:
                     rtt_ms = (time.time_ns() - pending.pop(rseq)) / 1e6
                     rtts.append(rtt_ms)
+                    sec_recv += 1
+                    sec_rtt += rtt_ms
         except socket.timeout:
             pass
         except Exception:
             pass
 
+        if feed is not None and time.time() - sec_start >= 1.0:
+            feed.send(label, prefixes, sent=sec_sent, received=sec_recv, rtt_ms_sum=round(sec_rtt, 3))
+            sec_start = time.time()
+            sec_sent = sec_recv = 0
+            sec_rtt = 0.0
+
         if len(pending) > 2000:
             for k in list(pending.keys())[:500]:
                 pending.pop(k, None)
@@ -54,7 +71,7 @@ def udp_client(server_ip, port, label, rate_pps, duration_s, out_writer):
     bps = (sent * 12 * 8) / max(1e-6, duration_s)
     out_writer.writerow([time.time(), label, avg_rtt, lost, sent, bps])
 
-def tcp_bulk(server_ip, port, duration_s, out_writer, target_mbps=None):
+def tcp_bulk(server_ip, port, duration_s, out_writer, target_mbps=None, feed=None, prefixes=()):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.settimeout(2.0)
     try:
@@ -66,12 +83,21 @@ def tcp_bulk(server_ip, port, duration_s, out_writer, target_mbps=None):
     payload = b"x" * 65536
     start = time.time()
     sent_bytes = 0
+    sec_start = start
+    sec_bytes = 0
     while time.time() - start < duration_s:
         try:
             s.sendall(payload)
             sent_bytes += len(payload)
+            sec_bytes += len(payload)
         except Exception:
             break
+        now = time.time()
+        if feed is not None and now - sec_start >= 1.0:
+            feed.send("bulk", prefixes, bulk_mbps=round(sec_bytes * 8 / ((now - sec_start) * 1e6), 3),
+                      target_mbps=target_mbps)
+            sec_start = now
+            sec_bytes = 0
         if target_mbps:
             elapsed = time.time() - start
             if elapsed > 0:
@@ -95,6 +121,12 @@ def main():
     ap.add_argument("--out", required=True)
     args = ap.parse_args()
 
+    # Destination prefixes the agent's flow keys use for this traffic: the
+    # server's (requests) and ours (echo replies).
+    feed = QoSFeed(args.name)
+    own_ip = local_ip_towards(args.server, CRIT_UDP)
+    prefixes = [prefix_of(args.server)] + ([prefix_of(own_ip)] if own_ip else [])
+
     total = int(os.environ.get("RUN_SECONDS", "90"))
     window = 10
     loops = total // window
@@ -122,7 +154,9 @@ def main():
                 "telemetry",
                 rate_pps=20,
                 duration_s=window,
-                out_writer=w
+                out_writer=w,
+                feed=feed,
+                prefixes=prefixes
             )
 
             # Critical – luôn tồn tại
@@ -133,7 +167,9 @@ def main():
                 "critical",
                 rate_pps=crit_rate,
                 duration_s=window,
-                out_writer=w
+                out_writer=w,
+                feed=feed,
+                prefixes=prefixes
             )
 
             # Bulk traffic – nguồn gây congestion
@@ -143,7 +179,9 @@ def main():
                     BULK_TCP,
                     duration_s=window,
                     out_writer=w,
-                    target_mbps=1.0
+                    target_mbps=1.0,
+                    feed=feed,
+                    prefixes=prefixes
                 )
             elif phase == "congestion":
                 tcp_bulk(
@@ -151,7 +189,9 @@ def main():
                     BULK_TCP,
                     duration_s=window,
                     out_writer=w,
-                    target_mbps=8.0
+                    target_mbps=8.0,
+                    feed=feed,
+                    prefixes=prefixes
                 )
             else:  # recovery
                 tcp_bulk(
@@ -159,7 +199,9 @@ def main():
                     BULK_TCP,
                     duration_s=window,
                     out_writer=w,
-                    target_mbps=2.0
+                    target_mbps=2.0,
+                    feed=feed,
+                    prefixes=prefixes
                 )
 
             f.flush()
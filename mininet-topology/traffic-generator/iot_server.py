@@ -1,6 +1,8 @@
 import argparse, socket, threading, time, csv, os
 from threading import Lock
 
+from qos_feed import QoSFeed, prefix_of
+
 CRIT_UDP = int(os.environ.get("CRIT_UDP", "5001"))
 TEL_UDP  = int(os.environ.get("TEL_UDP", "5002"))
 BULK_TCP = int(os.environ.get("BULK_TCP", "5003"))
@@ -43,7 +45,7 @@ def tcp_sink_server(bind_ip, port, counters, lock: Lock):
         except Exception:
             pass
 
-def writer(out_path, counters, lock: Lock):
+def writer(out_path, counters, lock: Lock, feed=None, prefixes=("",)):
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
 
     # previous snapshot for rate calculation
@@ -94,6 +96,12 @@ def writer(out_path, counters, lock: Lock):
 
             f.flush()
 
+            # Same per-second counters to the agent's QoS feed
+            if feed is not None:
+                feed.send("critical", prefixes, rx_pkts=c_rx, tx_pkts=c_tx, rx_pps=round(c_rx_pps, 2), tx_pps=round(c_tx_pps, 2))
+                feed.send("telemetry", prefixes, rx_pkts=t_rx, tx_pkts=t_tx, rx_pps=round(t_rx_pps, 2), tx_pps=round(t_tx_pps, 2))
+                feed.send("bulk", prefixes, bulk_conns=b_conn, bulk_bytes=b_bytes, bulk_mbps=round(bulk_mbps, 3))
+
             prev["ts"] = ts
             prev["critical_rx"] = c_rx
             prev["critical_tx"] = c_tx
@@ -121,7 +129,9 @@ def main():
     threading.Thread(target=tcp_sink_server, args=(args.bind, BULK_TCP, counters, lock), daemon=True).start()
 
     print(f"[SERVER] bind={args.bind} UDP:{CRIT_UDP}/{TEL_UDP} TCP:{BULK_TCP} out={args.out}")
-    writer(args.out, counters, lock)
+    # Bound to a wildcard the server serves every prefix: report under "".
+    prefixes = ("",) if args.bind in ("0.0.0.0", "") else (prefix_of(args.bind),)
+    writer(args.out, counters, lock, feed=QoSFeed("server"), prefixes=prefixes)
 
 if __name__ == "__main__":
     main()
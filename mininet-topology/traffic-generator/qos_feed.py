@@ -0,0 +1,43 @@
+import json, os, socket, time
+
+# Unix datagram socket of the Q-learning agent (QL_QOS_FEED_SOCKET there),
+# in the shared volume so every Mininet host can reach it. Empty disables.
+FEED_SOCKET = os.environ.get("QOS_FEED_SOCKET", "/shared/run/qos_feed.sock")
+
+
+def prefix_of(ip):
+    return ".".join(str(ip).split(".")[:3])
+
+
+def local_ip_towards(server_ip, port):
+    # The source address the kernel picks for server_ip; nothing is sent.
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((server_ip, port))
+        return s.getsockname()[0]
+    except Exception:
+        return None
+    finally:
+        s.close()
+
+
+class QoSFeed:
+    """Fire-and-forget per-second reports; a missing agent is ignored."""
+
+    def __init__(self, src, path=FEED_SOCKET):
+        self.src = src
+        self.path = path
+        self.sock = None
+        if path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+
+    def send(self, label, prefixes, **fields):
+        if self.sock is None:
+            return
+        msg = {"src": self.src, "ts": time.time(), "class": label, "prefixes": list(prefixes)}
+        msg.update(fields)
+        try:
+            self.sock.sendto(json.dumps(msg).encode(), self.path)
+        except OSError:
+            pass
@@ -1,109 +1,38 @@
+import atexit
+import multiprocessing
 import os
 import json
 import time
 import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-import csv
 from pathlib import Path
 
 import numpy as np
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 
+from qlearning_core import (
+    LOG_HEADER,
+    DecisionLog,
+    QAgent,
+    QoSModel,
+    ReplayBuffer,
+    ReplayTrainer,
+    SharedArena,
+    SpillStore,
+    TileCoder,
+    decision_row,
+    dump_state,
+    flow_key,
+    load_checkpoint,
+    load_state,
+    save_checkpoint,
+)
 
-class QoSModel:
-    def __init__(self, congestion_threshold: float):
-        self.th = float(congestion_threshold)
-
-    def get_state(self, load_bps: float, drops: int) -> int:
-        try:
-            load = float(load_bps)
-        except Exception:
-            load = 0.0
-        try:
-            d = int(drops)
-        except Exception:
-            d = 0
-        if d > 0:
-            return 2
-        if load < 0.5 * self.th:
-            return 0
-        if load < 1.0 * self.th:
-            return 1
-        return 2
-
-    def get_reward(self, load_bps: float, drops: int) -> float:
-        try:
-            load = float(load_bps)
-        except Exception:
-            load = 0.0
-        try:
-            d = int(drops)
-        except Exception:
-            d = 0
-
-        if d > 0:
-            return -50.0
-        if load < 0.5 * self.th:
-            return 20.0
-        if load < 1.0 * self.th:
-            return 10.0
-        return -5.0
-
-
-class QAgent:
-    def __init__(
-        self,
-        lr: float = 0.1,
-        gamma: float = 0.9,
-        epsilon: float = 1.0,
-        epsilon_min: float = 0.05,
-        epsilon_decay: float = 0.995,
-    ):
-        self.lr = float(lr)
-        self.gamma = float(gamma)
-        self.epsilon = float(epsilon)
-        self.epsilon_min = float(epsilon_min)
-        self.epsilon_decay = float(epsilon_decay)
-
-        self._lock = threading.Lock()
-
-        self._q_tables = {}
-        self._actions = {}
-        self._last = {}
-        self._step = 0
-
-    def _ensure_key(self, key: str, action_ports):
-        ports = [int(p) for p in action_ports]
-        if key not in self._q_tables:
-            self._q_tables[key] = np.zeros((3, len(ports)), dtype=np.float64)
-            self._actions[key] = ports
-            self._last[key] = None
-            return
-
-        if self._actions[key] != ports:
-            old_ports = self._actions[key]
-            old_q = self._q_tables[key]
-            new_q = np.zeros((3, len(ports)), dtype=np.float64)
-            for new_i, p in enumerate(ports):
-                if p in old_ports:
-                    old_i = old_ports.index(p)
-                    new_q[:, new_i] = old_q[:, old_i]
-            self._q_tables[key] = new_q
-            self._actions[key] = ports
-            self._last[key] = None
-
-    def choose_action(self, key: str, state: int) -> int:
-        if np.random.random() < self.epsilon:
-            return int(np.random.randint(0, self._q_tables[key].shape[1]))
-        return int(np.argmax(self._q_tables[key][state]))
-
-    def learn(self, key: str, s: int, a: int, r: float, s_next: int):
-        predict = self._q_tables[key][s][a]
-        target = float(r) + self.gamma * float(np.max(self._q_tables[key][s_next]))
-        self._q_tables[key][s][a] = predict + self.lr * (target - predict)
-
-        if self.epsilon > self.epsilon_min:
-            self.epsilon *= self.epsilon_decay
+from metrics import RateMeter, Registry, TimedLock
+from policy import PolicyPublisher
+from qos_signals import QoSFeedReceiver, QoSSignals, qos_reward
+from shadow import LOG_HEADER as SHADOW_LOG_HEADER, Shadow, ShadowRunner, parse_shadows
 
 
 @dataclass(frozen=True)
@@ -113,65 +42,627 @@ class ObservationKey:
     qid: int | None
 
 
+class Observation:
+    __slots__ = ("ts", "load_bps", "drops")
+
+    def __init__(self, ts: float, load_bps: float, drops: int):
+        self.ts = ts
+        self.load_bps = load_bps
+        self.drops = drops
+
+
 class StateStore:
-    def __init__(self):
-        self._lock = threading.Lock()
-        self._metrics = {}
+    """Latest observation per (dpid, port, qid).
+
+    Samples older than ``ttl_s`` are ignored and pruned, and at most
+    ``max_keys`` keys are kept: the least recently updated one is evicted
+    first. ``_metrics`` is ordered by last update, so both sweeps only touch
+    the front of it.
+    """
+
+    def __init__(self, lock=None, ttl_s: float = 0.0, max_keys: int = 0):
+        self._lock = lock if lock is not None else threading.Lock()
+        self.ttl_s = float(ttl_s)
+        self.max_keys = int(max_keys)
+        self._metrics = OrderedDict()
+        self._by_dpid = {}
+        # Bumped whenever any observation of the dpid is added, replaced or
+        # removed, so derived switch state can be cached per generation.
+        self._generation = {}
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._metrics)
+
+    def _bump(self, dpid: int):
+        self._generation[dpid] = self._generation.get(dpid, 0) + 1
+
+    def _remove(self, key: ObservationKey):
+        del self._metrics[key]
+        self._bump(key.dpid)
+        ports = self._by_dpid[key.dpid]
+        ports.discard(key)
+        if not ports:
+            del self._by_dpid[key.dpid]
+
+    def _prune(self, now: float):
+        if self.ttl_s > 0:
+            while self._metrics:
+                key, obs = next(iter(self._metrics.items()))
+                if now - obs.ts <= self.ttl_s:
+                    break
+                self._remove(key)
+                self.evicted += 1
+        if self.max_keys > 0:
+            while len(self._metrics) > self.max_keys:
+                self._remove(next(iter(self._metrics)))
+                self.evicted += 1
 
     def update(self, key: ObservationKey, load_bps: float, drops: int):
+        now = time.time()
         with self._lock:
-            self._metrics[key] = {
-                "ts": time.time(),
-                "load_bps": float(load_bps),
-                "drops": int(drops),
+            if key in self._metrics:
+                self._metrics.move_to_end(key)
+            else:
+                self._by_dpid.setdefault(key.dpid, set()).add(key)
+            self._metrics[key] = Observation(now, float(load_bps), int(drops))
+            self._bump(key.dpid)
+            self._prune(now)
+
+    def generation(self, dpid: int) -> int:
+        return self._generation.get(int(dpid), 0)
+
+    def switch_view(self, dpid: int) -> tuple[int, list]:
+        """Generation and live observations of ``dpid``, read together."""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            items = [(k, self._metrics[k]) for k in self._by_dpid.get(int(dpid), ())]
+            return self.generation(dpid), items
+
+    def switch_snapshot(self, dpid: int):
+        return self.switch_view(dpid)[1]
+
+    def drop_switches(self, dpids):
+        with self._lock:
+            for dpid in {int(d) for d in dpids}:
+                for k in list(self._by_dpid.get(dpid, ())):
+                    self._remove(k)
+
+
+class SharedStateStore:
+    """StateStore kept in shared memory so every worker sees each observation.
+
+    Observation keys occupy fixed slots. When all are taken, the slot with the
+    oldest sample is handed to the new key. Each process caches key -> slot,
+    checks the cached slot still holds its key and rebuilds the cache from
+    the slot table when it does not.
+    """
+
+    def __init__(self, lock, capacity: int = 4096, ttl_s: float = 0.0):
+        self._lock = lock
+        self.ttl_s = float(ttl_s)
+        arena = SharedArena(
+            {
+                # (dpid, port, qid) with qid -1 for None.
+                "keys": ((int(capacity), 3), np.int64),
+                # (ts, load_bps, drops); ts 0 marks an empty slot.
+                "values": ((int(capacity), 3), np.float64),
+                # [slots in use, evictions].
+                "count": ((2,), np.int64),
+                # Observation generation per dpid bucket; a collision only
+                # costs an extra recomputation.
+                "generation": ((1024,), np.int64),
             }
+        )
+        self._keys = arena.arrays["keys"]
+        self._values = arena.arrays["values"]
+        self._count = arena.arrays["count"]
+        self._generation = arena.arrays["generation"]
+        self._slots = {}
+
+    @property
+    def evicted(self) -> int:
+        return int(self._count[1])
+
+    def __len__(self) -> int:
+        n = int(self._count[0])
+        return int(np.count_nonzero(self._live(self._values[:n, 0], time.time())))
+
+    def _live(self, ts: np.ndarray, now: float) -> np.ndarray:
+        if self.ttl_s > 0:
+            return (ts > 0) & (now - ts <= self.ttl_s)
+        return ts > 0
+
+    def _sync(self):
+        n = int(self._count[0])
+        self._slots = {tuple(k): i for i, k in enumerate(self._keys[:n].tolist())}
+
+    def update(self, key: ObservationKey, load_bps: float, drops: int):
+        k = (int(key.dpid), int(key.port), -1 if key.qid is None else int(key.qid))
+        now = time.time()
+        with self._lock:
+            slot = self._slots.get(k)
+            if slot is None or tuple(self._keys[slot].tolist()) != k:
+                self._sync()
+                slot = self._slots.get(k)
+            if slot is None:
+                slot = int(self._count[0])
+                if slot < len(self._keys):
+                    self._count[0] = slot + 1
+                else:
+                    # Empty slots have ts 0, so they are reused before any
+                    # live sample is evicted.
+                    slot = int(np.argmin(self._values[:, 0]))
+                    if self._values[slot, 0] > 0:
+                        self._count[1] += 1
+                    evicted = self._slots.pop(tuple(self._keys[slot].tolist()), None)
+                    if evicted is not None:
+                        self._generation[evicted[0] % len(self._generation)] += 1
+                self._keys[slot] = k
+                self._slots[k] = slot
+            self._values[slot] = (now, float(load_bps), int(drops))
+            self._generation[k[0] % len(self._generation)] += 1
+
+    def generation(self, dpid: int) -> int:
+        return int(self._generation[int(dpid) % len(self._generation)])
+
+    def switch_view(self, dpid: int) -> tuple[int, list]:
+        """Generation and live observations of ``dpid``, read together."""
+        now = time.time()
+        with self._lock:
+            n = int(self._count[0])
+            rows = np.flatnonzero((self._keys[:n, 0] == int(dpid)) & self._live(self._values[:n, 0], now))
+            keys = self._keys[rows].tolist()
+            values = self._values[rows].tolist()
+            generation = self.generation(dpid)
+        return generation, [
+            (ObservationKey(dpid=d, port=p, qid=(None if q < 0 else q)), Observation(ts, load, int(drops)))
+            for (d, p, q), (ts, load, drops) in zip(keys, values)
+        ]
 
     def switch_snapshot(self, dpid: int):
+        return self.switch_view(dpid)[1]
+
+    def drop_switches(self, dpids):
         with self._lock:
-            items = [
-                (k, v)
-                for k, v in self._metrics.items()
-                if k.dpid == int(dpid)
-            ]
-        return items
+            n = int(self._count[0])
+            self._values[:n][np.isin(self._keys[:n, 0], list(dpids))] = 0.0
+            for dpid in dpids:
+                self._generation[int(dpid) % len(self._generation)] += 1
+
+
+class InFlightLimiter:
+    """Non-blocking cap on concurrent requests in one process."""
+
+    def __init__(self, limit: int):
+        self.limit = int(limit)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.limit > 0 and self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
 
+METRICS = Registry()
+
+# AGENT_WORKERS > 1 runs several gunicorn workers forked from a preloaded
+# master. Q-tables and observations then live in shared memory with a fixed
+# capacity, and every lock must be a process-shared one created before fork.
+WORKERS = max(1, int(os.environ.get("AGENT_WORKERS", "1")))
+SHARED = WORKERS > 1
+_MP = multiprocessing.get_context("fork")
+
+
+def _timed_lock(name: str) -> TimedLock:
+    wait, hold = _LOCK_TIMERS[name]
+    return TimedLock(wait, hold, lock=(_MP.Lock() if SHARED else None))
+
+
+_LOCK_TIMERS = {name: METRICS.lock_timer(name) for name in ("key", "counter", "index", "weights", "store")}
 
 THRESHOLD_BPS = float(os.environ.get("CONGESTION_THRESHOLD_BPS", "200000"))
 MODEL = QoSModel(congestion_threshold=THRESHOLD_BPS)
-AGENT = QAgent(
+# QL_REWARD_MODE picks what the learner optimizes: "switch" (default) is
+# QoSModel's reward from switch load and drops; "qos" scores the traffic
+# generators' critical RTT, UDP loss and bulk throughput for the flow's
+# destination prefix (see qos_signals.py), falling back to "switch" while
+# there is no fresh report; "blend" mixes the two with QL_QOS_WEIGHT on the
+# QoS score. Reports arrive on the Unix datagram socket QL_QOS_FEED_SOCKET,
+# received once per agent like ticks (in the master with AGENT_WORKERS > 1).
+REWARD_MODE = os.environ.get("QL_REWARD_MODE", "switch")
+if REWARD_MODE not in ("switch", "qos", "blend"):
+    raise ValueError(f"QL_REWARD_MODE must be switch, qos or blend, not {REWARD_MODE!r}")
+QOS_WEIGHT = float(os.environ.get("QL_QOS_WEIGHT", "0.5"))
+QOS_RTT_TARGET_MS = float(os.environ.get("QL_QOS_RTT_TARGET_MS", "20"))
+QOS_LOSS_MAX = float(os.environ.get("QL_QOS_LOSS_MAX", "0.05"))
+QOS_SIGNALS = QoSSignals(
+    window_s=float(os.environ.get("QL_QOS_WINDOW_S", "10")),
+    ttl_s=float(os.environ.get("QL_QOS_TTL_S", "30")),
+    shared=SHARED,
+)
+QOS_FEED_SOCKET = os.environ.get("QL_QOS_FEED_SOCKET", "")
+QOS_FEED = QoSFeedReceiver(Path(QOS_FEED_SOCKET), QOS_SIGNALS) if QOS_FEED_SOCKET else None
+
+
+def _reward(dst_prefix: str, max_load: float, total_drops: int) -> float:
+    r = MODEL.get_reward(load_bps=max_load, drops=total_drops)
+    if REWARD_MODE == "switch":
+        return r
+    q = qos_reward(QOS_SIGNALS.get(dst_prefix), QOS_RTT_TARGET_MS, QOS_LOSS_MAX)
+    if q is None:
+        return r
+    if REWARD_MODE == "qos":
+        return q
+    return (1.0 - QOS_WEIGHT) * r + QOS_WEIGHT * q
+
+
+# At most QL_KEY_LIMIT flow keys (0 = unbounded) stay in memory; beyond that
+# the least recently used (QL_EVICTION=lru) or least visited (lfu) ones are
+# evicted. With QL_SPILL_PATH set, evicted tables are kept in an SQLite file
+# there and reloaded when their key comes back.
+KEY_LIMIT = int(os.environ.get("QL_KEY_LIMIT", "0"))
+SPILL_PATH = os.environ.get("QL_SPILL_PATH", "")
+# Learning settings; shadow agents (QL_SHADOWS) start from the same ones.
+LEARNING = dict(
     lr=float(os.environ.get("QL_LR", "0.1")),
     gamma=float(os.environ.get("QL_GAMMA", "0.9")),
     epsilon=float(os.environ.get("QL_EPSILON", "1.0")),
     epsilon_min=float(os.environ.get("QL_EPSILON_MIN", "0.05")),
     epsilon_decay=float(os.environ.get("QL_EPSILON_DECAY", "0.995")),
+    learner=os.environ.get("QL_LEARNER", "q"),
+    sweep_steps=int(os.environ.get("QL_SWEEP_STEPS", "5")),
+    sweep_theta=float(os.environ.get("QL_SWEEP_THETA", "0.001")),
+    exploration=os.environ.get("QL_EXPLORATION", "epsilon"),
+    ucb_c=float(os.environ.get("QL_UCB_C", "10")),
+    temperature=float(os.environ.get("QL_TEMPERATURE", "10")),
+    temperature_min=float(os.environ.get("QL_TEMPERATURE_MIN", "0.1")),
+    temperature_decay=float(os.environ.get("QL_TEMPERATURE_DECAY", "0.995")),
 )
-STORE = StateStore()
+# QL_LEARNER=linear replaces the per-key tables by one tile-coded linear
+# model (QL_TILINGS tilings) of the switch and candidate-port metrics.
+LINEAR = LEARNING["learner"] == "linear"
+TILE_CODER = (
+    TileCoder(
+        QoSModel.FEATURE_LOWS,
+        QoSModel.FEATURE_HIGHS,
+        QoSModel.FEATURE_BINS,
+        tilings=int(os.environ.get("QL_TILINGS", "8")),
+    )
+    if LINEAR
+    else None
+)
+AGENT = QAgent(
+    **LEARNING,
+    tile_coder=TILE_CODER,
+    lock_factory=_timed_lock,
+    shared=SHARED,
+    initial_keys=int(os.environ.get("QL_MAX_KEYS", "65536")) if SHARED else 64,
+    initial_actions=int(os.environ.get("QL_MAX_ACTIONS", "8")) if SHARED else 4,
+    max_keys=KEY_LIMIT,
+    eviction=os.environ.get("QL_EVICTION", "lru"),
+    spill=(SpillStore(Path(SPILL_PATH)) if SPILL_PATH else None),
+)
+# Observations older than QL_OBS_TTL_S (0 = never) no longer count towards
+# the switch state; at most QL_MAX_OBSERVATIONS (dpid, port, qid) keys are kept.
+OBS_TTL_S = float(os.environ.get("QL_OBS_TTL_S", "30"))
+MAX_OBSERVATIONS = int(os.environ.get("QL_MAX_OBSERVATIONS", "4096"))
+if SHARED:
+    STORE = SharedStateStore(_timed_lock("store"), capacity=MAX_OBSERVATIONS, ttl_s=OBS_TTL_S)
+else:
+    STORE = StateStore(lock=_timed_lock("store"), ttl_s=OBS_TTL_S, max_keys=MAX_OBSERVATIONS)
+
+# QL_LEARN_MODE=tick learns once every QL_TICK_S from aggregated switch state
+# for the keys decided within the last QL_TICK_ACTIVE_S; /act then only
+# records the action in effect. The default ("act") learns on every /act.
+LEARN_ON_TICK = os.environ.get("QL_LEARN_MODE", "act") == "tick"
+TICK_S = float(os.environ.get("QL_TICK_S", "2"))
+TICK_ACTIVE_S = float(os.environ.get("QL_TICK_ACTIVE_S", "20"))
+
+REPLAY_SIZE = int(os.environ.get("QL_REPLAY_SIZE", "0"))
+if LINEAR and (LEARN_ON_TICK or REPLAY_SIZE > 0):
+    raise ValueError("QL_LEARNER=linear learns on /act only; unset QL_LEARN_MODE=tick and QL_REPLAY_SIZE")
+TRAINER = None
+if REPLAY_SIZE > 0:
+    AGENT.replay = ReplayBuffer(REPLAY_SIZE)
+    TRAINER = ReplayTrainer(
+        AGENT,
+        AGENT.replay,
+        batch_size=int(os.environ.get("QL_REPLAY_BATCH", "64")),
+        rate_hz=float(os.environ.get("QL_REPLAY_HZ", "20")),
+    )
 
 LOG_PATH = Path(os.environ.get("QL_LOG_PATH", "/shared/raw/qlearning_agent_log.csv"))
 LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-_log_lock = threading.Lock()
-_log_initialized = False
+
+CHECKPOINT_PATH = Path(os.environ.get("QL_CHECKPOINT_PATH", "/shared/checkpoints/qlearning_agent.npz"))
+CHECKPOINT_INTERVAL_S = float(os.environ.get("QL_CHECKPOINT_INTERVAL_S", "30"))
+RESTORE_FROM = os.environ.get("QL_RESTORE_FROM", "")
 
 app = Flask(__name__)
 
 
-def _flow_key(dpid: int, dst_prefix: str) -> str:
-    return f"{int(dpid)}:{dst_prefix}"
+def _restore():
+    if not RESTORE_FROM:
+        return
+    try:
+        t0 = time.time()
+        n = load_checkpoint(AGENT, Path(RESTORE_FROM))
+        print(f"[AGENT] restored {n} keys from {RESTORE_FROM} in {time.time() - t0:.3f}s (step={AGENT._step}, epsilon={AGENT.epsilon:.4f})")
+    except FileNotFoundError:
+        print(f"[AGENT] no checkpoint at {RESTORE_FROM}; starting cold")
+    except Exception as e:
+        print(f"[AGENT] failed to restore {RESTORE_FROM}: {e}; starting cold")
 
 
-def _compute_switch_state(dpid: int) -> tuple[int, float, int]:
-    snap = STORE.switch_snapshot(dpid)
-    if not snap:
-        return 0, 0.0, 0
+def _checkpoint_loop():
+    while True:
+        time.sleep(CHECKPOINT_INTERVAL_S)
+        try:
+            save_checkpoint(AGENT, CHECKPOINT_PATH)
+        except Exception as e:
+            print(f"[AGENT] checkpoint failed: {e}")
+
+
+_restore()
+
+
+# dpid -> (store generation, expires_at, (state, max_load, total_drops),
+# {port: (load, drops)}).
+_SWITCH_STATE = {}
+SWITCH_STATE_HITS = METRICS.counter(
+    "agent_switch_state_cache_total", "Switch state lookups by cache result.", {"result": "hit"}
+)
+SWITCH_STATE_MISSES = METRICS.counter(
+    "agent_switch_state_cache_total", "Switch state lookups by cache result.", {"result": "miss"}
+)
 
+
+def _compute_switch_state(dpid: int) -> tuple[int, float, int, int]:
+    """(state, max_load, total_drops, generation) of a switch.
+
+    The result is reused until the switch gets a new observation (its store
+    generation changes) or its oldest sample reaches the TTL.
+    """
+    dpid = int(dpid)
+    cached = _SWITCH_STATE.get(dpid)
+    if cached is not None and cached[0] == STORE.generation(dpid) and time.time() < cached[1]:
+        SWITCH_STATE_HITS.inc()
+        return (*cached[2], cached[0])
+
+    generation, snap = STORE.switch_view(dpid)
     max_load = 0.0
     total_drops = 0
-    for _, v in snap:
-        max_load = max(max_load, float(v.get("load_bps", 0.0)))
-        total_drops += int(v.get("drops", 0))
+    expires_at = float("inf")
+    ports = {}
+    for k, v in snap:
+        max_load = max(max_load, v.load_bps)
+        total_drops += v.drops
+        if OBS_TTL_S > 0:
+            expires_at = min(expires_at, v.ts + OBS_TTL_S)
+        if LINEAR:
+            # A port's load is its busiest entry (the port total or a
+            # queue); its drops are summed over its queues.
+            load, drops = ports.get(k.port, (0.0, 0))
+            ports[k.port] = (max(load, v.load_bps), drops + v.drops)
+
+    state = MODEL.get_state(load_bps=max_load, drops=total_drops) if snap else 0
+    _SWITCH_STATE[dpid] = (generation, expires_at, (state, max_load, total_drops), ports)
+    SWITCH_STATE_MISSES.inc()
+    return state, max_load, total_drops, generation
+
+
+def _candidate_features(dpid: int, candidates: list) -> np.ndarray:
+    """Linear-learner inputs of each candidate port (QoSModel.get_features);
+    ports with no live observation count as idle."""
+    _, max_load, total_drops, _ = _compute_switch_state(dpid)
+    ports = _SWITCH_STATE[int(dpid)][3]
+    seen = [ports.get(int(c), (0.0, 0)) for c in candidates]
+    return MODEL.get_features(max_load, total_drops, [p[0] for p in seen], [p[1] for p in seen])
+
+
+DECISION_LOG = DecisionLog(
+    LOG_PATH,
+    LOG_HEADER,
+    max_queue=int(os.environ.get("QL_LOG_QUEUE_SIZE", "10000")),
+)
+atexit.register(DECISION_LOG.flush)
+# Admission control for /act and /act_batch, off by default: a shed request
+# is a lost TD update and a missing log row. A request is not decided when
+# it already waited more than QL_MAX_QUEUE_MS (default 0 = no limit) since
+# the caller's X-Request-Sent timestamp, or when QL_MAX_IN_FLIGHT requests
+# (default 0 = no limit) are being decided in this process. It is answered at once from the key's current greedy port,
+# without learning, or with 429 when there is none, so the controller falls
+# back to its static port instead of waiting for a timeout. Shed answers skip
+# learning and logging but not the HTTP round trip, so they only shorten the
+# tail when deciding costs more than answering (see the README).
+ADMISSION = InFlightLimiter(int(os.environ.get("QL_MAX_IN_FLIGHT", "0")))
+MAX_QUEUE_S = float(os.environ.get("QL_MAX_QUEUE_MS", "0")) / 1000.0
+SHED_GREEDY = METRICS.counter("agent_shed_total", "Requests answered without deciding.", {"result": "greedy"})
+SHED_DEFAULT = METRICS.counter("agent_shed_total", "Requests answered without deciding.", {"result": "default"})
+
+
+def _admit() -> bool:
+    """True when this request may be decided; the caller then leaves ADMISSION."""
+    sent = request.headers.get("X-Request-Sent", type=float)
+    if sent is not None and MAX_QUEUE_S > 0 and time.time() - sent > MAX_QUEUE_S:
+        return False
+    return ADMISSION.try_enter()
+
+DECISIONS = RateMeter(window_s=10)
+DECISIONS_TOTAL = METRICS.counter("agent_decisions_total", "Decisions served by /act and /act_batch.")
+EXPLORED_TOTAL = METRICS.counter(
+    "agent_exploratory_decisions_total", "Decisions that differed from the greedy action."
+)
+
+
+# QL_SHADOWS="name:opt=value,...;name2:..." runs candidate configurations
+# (see shadow.py) next to the primary agent on the same decision stream. They
+# never answer requests and run in a child process of the agent. GET /shadow
+# compares them with the primary.
+SHADOW_SPECS = parse_shadows(os.environ.get("QL_SHADOWS", ""))
+SHADOWS = None
+if SHADOW_SPECS and SHARED:
+    # Each worker would fork its own evaluator and see only the requests it
+    # serves, so a key's consecutive decisions land in different shadows.
+    raise ValueError(
+        f"QL_SHADOWS needs a single process: each of the AGENT_WORKERS={WORKERS} workers would pair "
+        "non-consecutive decisions of a flow; unset QL_SHADOWS or set AGENT_WORKERS=1"
+    )
+if SHADOW_SPECS:
+    _shadows = []
+    for _name, _opts in SHADOW_SPECS:
+        _opts = dict(_opts)
+        _threshold = _opts.pop("threshold", THRESHOLD_BPS)
+        if {**LEARNING, **_opts}["learner"] == "linear":
+            raise ValueError(f"shadow {_name}: shadows get no per-port features; set another learner")
+        _agent = QAgent(**{**LEARNING, **_opts}, max_keys=KEY_LIMIT, eviction=os.environ.get("QL_EVICTION", "lru"))
+        _shadows.append(Shadow(_name, _agent, QoSModel(congestion_threshold=_threshold)))
+    _shadow_log = DecisionLog(
+        Path(os.environ.get("QL_SHADOW_LOG_PATH", "/shared/raw/qlearning_shadow_log.csv")),
+        SHADOW_LOG_HEADER,
+        max_queue=int(os.environ.get("QL_LOG_QUEUE_SIZE", "10000")),
+    )
+    SHADOWS = ShadowRunner(
+        _shadows, log=_shadow_log, max_queue=int(os.environ.get("QL_SHADOW_QUEUE_SIZE", "10000"))
+    )
+
+
+def _write_log_rows(rows: list):
+    DECISION_LOG.submit(rows)
+
+
+def _decision_json(decision, dpid: int, dst_prefix: str, generation: int) -> dict:
+    return {
+        "dpid": dpid,
+        "dst_prefix": dst_prefix,
+        "state": decision.state,
+        "action": decision.action,
+        "out_port": decision.out_port,
+        "epsilon": float(decision.epsilon),
+        "step": decision.step,
+        "explored": decision.explored,
+        "generation": generation,
+        "admitted": True,
+    }
+
+
+def start_background():
+    """Fork the shadow evaluator, then start the per-process threads:
+    decision log writer and replay trainer.
+
+    Threads do not survive fork, so with AGENT_WORKERS > 1 gunicorn's
+    post_fork hook calls this in each worker instead of at import.
+    """
+    # Forked before any thread of this process runs: a thread holding a
+    # lock at fork time would leave it locked forever in the child.
+    if SHADOWS is not None:
+        SHADOWS.start()
+    DECISION_LOG.start()
+    if TRAINER is not None:
+        TRAINER.start()
+
 
-    state = MODEL.get_state(load_bps=max_load, drops=total_drops)
-    return state, max_load, total_drops
+if not SHARED:
+    start_background()
+
+# Once-per-agent threads (with AGENT_WORKERS > 1 in the gunicorn master),
+# started after the shadow evaluator was forked.
+if QOS_FEED is not None:
+    QOS_FEED.start()
+if CHECKPOINT_INTERVAL_S > 0:
+    threading.Thread(target=_checkpoint_loop, name="checkpoint", daemon=True).start()
+
+
+TICK_UPDATES = METRICS.counter("agent_tick_updates_total", "TD updates applied by learning ticks.")
+TICK_DURATION = METRICS.histogram("agent_tick_duration_seconds", "Time spent in one learning tick.")
+
+
+def _learn_tick() -> int:
+    rows, gens, keys = AGENT.active_rows(time.time() - TICK_ACTIVE_S)
+    if not keys:
+        return 0
+    dpids = np.array([int(k.split(":", 1)[0]) for k in keys], dtype=np.int64)
+    switches, inverse = np.unique(dpids, return_inverse=True)
+    per_switch = [_compute_switch_state(d) for d in switches.tolist()]
+    s_next = np.array([p[0] for p in per_switch], dtype=np.int64)[inverse]
+    if REWARD_MODE == "switch":
+        r = MODEL.get_rewards([p[1] for p in per_switch], [p[2] for p in per_switch])[inverse]
+    else:
+        r = np.array([
+            _reward(k.split(":", 1)[1], per_switch[j][1], per_switch[j][2])
+            for k, j in zip(keys, inverse.tolist())
+        ])
+    return AGENT.learn_tick(rows, gens, s_next, r)
+
+
+def _tick_loop():
+    next_at = time.monotonic()
+    while True:
+        next_at += TICK_S
+        time.sleep(max(0.0, next_at - time.monotonic()))
+        t0 = time.perf_counter()
+        try:
+            TICK_UPDATES.inc(_learn_tick())
+        except Exception as e:
+            print(f"[AGENT] learning tick failed: {e}")
+        TICK_DURATION.observe(time.perf_counter() - t0)
+
+
+# Like checkpoints, ticks run once per agent: with AGENT_WORKERS > 1 in the
+# gunicorn master, on the shared tables.
+if LEARN_ON_TICK:
+    threading.Thread(target=_tick_loop, name="learn-tick", daemon=True).start()
+
+
+# The greedy policy is checked every QL_POLICY_CHECK_S (0 = off, the default:
+# only controllers with QLEARNING_POLICY_SYNC=1 read it) and a new version is
+# published for GET /policy when at least QL_POLICY_MIN_CHANGE of its
+# (key, state) entries changed, or any changed QL_POLICY_MAX_AGE_S after the
+# previous version. Checks run in the master like ticks.
+POLICY_CHECK_S = float(os.environ.get("QL_POLICY_CHECK_S", "0"))
+POLICY_MAX_WAIT_S = 25.0
+POLICY = PolicyPublisher(
+    AGENT,
+    min_change=float(os.environ.get("QL_POLICY_MIN_CHANGE", "0.01")),
+    max_age_s=float(os.environ.get("QL_POLICY_MAX_AGE_S", "30")),
+    shared=SHARED,
+    max_bytes=int(os.environ.get("QL_POLICY_MAX_BYTES", str(8 << 20))),
+)
+
+
+def _policy_loop():
+    while True:
+        try:
+            POLICY.check()
+        except Exception as e:
+            print(f"[AGENT] policy check failed: {e}")
+        time.sleep(POLICY_CHECK_S)
+
+
+if POLICY_CHECK_S > 0:
+    threading.Thread(target=_policy_loop, name="policy", daemon=True).start()
+
+
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def _record_latency(response):
+    hist = ROUTE_LATENCY.get(request.endpoint)
+    if hist is not None:
+        hist.observe(time.perf_counter() - g.t0)
+    return response
 
 
 @app.get("/health")
@@ -190,8 +681,8 @@ def observe():
     drops = int(body.get("drops", 0))
 
     STORE.update(ObservationKey(dpid=dpid, port=port, qid=qid), load_bps=load_bps, drops=drops)
-    state, max_load, total_drops = _compute_switch_state(dpid)
-    return jsonify({"state": state, "max_load_bps": max_load, "total_drops": total_drops})
+    state, max_load, total_drops, generation = _compute_switch_state(dpid)
+    return jsonify({"state": state, "max_load_bps": max_load, "total_drops": total_drops, "generation": generation})
 
 
 @app.post("/act")
@@ -203,132 +694,389 @@ def act():
     if not isinstance(candidates, list) or not candidates:
         return jsonify({"error": "candidates required"}), 400
 
-    state, max_load, total_drops = _compute_switch_state(dpid)
-    key = _flow_key(dpid, dst_prefix)
+    if not _admit():
+        return _shed_act(dpid, dst_prefix, candidates)
+    try:
+        return _act(dpid, dst_prefix, candidates)
+    finally:
+        ADMISSION.leave()
 
-    reward = None
 
-    with AGENT._lock:
-        AGENT._ensure_key(key, candidates)
-        action_idx = AGENT.choose_action(key, state)
-        out_port = int(AGENT._actions[key][action_idx])
+def _shed_act(dpid: int, dst_prefix: str, candidates: list):
+    state, _, _, generation = _compute_switch_state(dpid)
+    (out_port,) = AGENT.greedy_ports([flow_key(dpid, dst_prefix)], [state], [candidates])
+    if out_port is None:
+        SHED_DEFAULT.inc()
+        return jsonify({"error": "agent saturated", "use_default": True}), 429
+    SHED_GREEDY.inc()
+    return jsonify(
+        {
+            "dpid": dpid,
+            "dst_prefix": dst_prefix,
+            "state": state,
+            "out_port": out_port,
+            "generation": generation,
+            "admitted": False,
+        }
+    )
 
-        prev = AGENT._last.get(key)
-        if prev is not None:
-            s_prev, a_prev = prev
-            r = MODEL.get_reward(load_bps=max_load, drops=total_drops)
-            reward = float(r)
-            AGENT.learn(key, s=s_prev, a=a_prev, r=r, s_next=state)
 
-        AGENT._last[key] = (state, action_idx)
-        AGENT._step += 1
-        step = AGENT._step
+def _act(dpid: int, dst_prefix: str, candidates: list):
+    state, max_load, total_drops, generation = _compute_switch_state(dpid)
+    key = flow_key(dpid, dst_prefix)
+    r = _reward(dst_prefix, max_load, total_drops)
+
+    try:
+        decision = AGENT.act(
+            key,
+            candidates,
+            state=state,
+            reward=r,
+            learn=not LEARN_ON_TICK,
+            features=(_candidate_features(dpid, candidates) if LINEAR else None),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    DECISIONS.mark()
+    DECISIONS_TOTAL.inc()
+    if decision.explored:
+        EXPLORED_TOTAL.inc()
+    _write_log_rows([decision_row(decision, dpid, dst_prefix, max_load, total_drops)])
+    if SHADOWS is not None:
+        SHADOWS.submit([(key, candidates, max_load, total_drops, state, decision.out_port, r)])
+    return jsonify(_decision_json(decision, dpid, dst_prefix, generation))
 
-        q_snapshot = None
+
+@app.post("/act_batch")
+def act_batch():
+    body = request.get_json(force=True, silent=True) or {}
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items required"}), 400
+
+    parsed = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            dpid, dst_prefix, candidates = item.get("dpid"), item.get("dst_prefix"), item.get("candidates")
+        elif isinstance(item, list) and len(item) == 3:
+            dpid, dst_prefix, candidates = item
+        else:
+            return jsonify({"error": f"item {i}: expected (dpid, dst_prefix, candidates)"}), 400
+        if not isinstance(candidates, list) or not candidates:
+            return jsonify({"error": f"item {i}: candidates required"}), 400
         try:
-            q_snapshot = AGENT._q_tables[key][state].tolist()
-        except Exception:
-            q_snapshot = None
+            dpid = int(dpid)
+        except (TypeError, ValueError):
+            return jsonify({"error": f"item {i}: dpid must be an integer"}), 400
+        parsed.append((dpid, str(dst_prefix), candidates))
+
+    if not _admit():
+        return _shed_act_batch(parsed)
+    try:
+        return _act_batch(parsed)
+    finally:
+        ADMISSION.leave()
+
 
-        eps = float(AGENT.epsilon)
+def _shed_act_batch(parsed: list):
+    """Greedy out_port per item (null where there is none); 429 if no item
+    has one."""
+    switch_state = {dpid: _compute_switch_state(dpid) for dpid in {p[0] for p in parsed}}
+    states = [switch_state[dpid][0] for dpid, _, _ in parsed]
+    ports = AGENT.greedy_ports(
+        [flow_key(dpid, dst_prefix) for dpid, dst_prefix, _ in parsed], states, [p[2] for p in parsed]
+    )
+    answered = sum(p is not None for p in ports)
+    SHED_GREEDY.inc(answered)
+    SHED_DEFAULT.inc(len(ports) - answered)
+    if not answered:
+        return jsonify({"error": "agent saturated", "use_default": True}), 429
+    return jsonify(
+        {
+            "decisions": [
+                {
+                    "dpid": dpid,
+                    "dst_prefix": dst_prefix,
+                    "state": state,
+                    "out_port": out_port,
+                    "generation": switch_state[dpid][3],
+                    "admitted": False,
+                }
+                for (dpid, dst_prefix, _), state, out_port in zip(parsed, states, ports)
+            ]
+        }
+    )
+
+
+def _act_batch(parsed: list):
+    switch_state = {dpid: _compute_switch_state(dpid) for dpid in {p[0] for p in parsed}}
+    keys = [flow_key(dpid, dst_prefix) for dpid, dst_prefix, _ in parsed]
+    states = [switch_state[dpid][0] for dpid, _, _ in parsed]
+    rewards = [
+        _reward(dst_prefix, switch_state[dpid][1], switch_state[dpid][2])
+        for dpid, dst_prefix, _ in parsed
+    ]
 
-    global _log_initialized
     try:
-        with _log_lock:
-            if not _log_initialized or not LOG_PATH.exists():
-                with LOG_PATH.open("a", newline="") as f:
-                    w = csv.writer(f)
-                    w.writerow(
-                        [
-                            "ts",
-                            "step",
-                            "dpid",
-                            "dst_prefix",
-                            "state",
-                            "action",
-                            "out_port",
-                            "epsilon",
-                            "max_load_bps",
-                            "total_drops",
-                            "reward",
-                            "q_values",
-                        ]
-                    )
-                _log_initialized = True
-
-            with LOG_PATH.open("a", newline="") as f:
-                w = csv.writer(f)
-                w.writerow(
-                    [
-                        float(time.time()),
-                        int(step),
-                        int(dpid),
-                        str(dst_prefix),
-                        int(state),
-                        int(action_idx),
-                        int(out_port),
-                        float(eps),
-                        float(max_load),
-                        int(total_drops),
-                        ("" if reward is None else float(reward)),
-                        ("" if q_snapshot is None else json.dumps(q_snapshot)),
-                    ]
-                )
-    except Exception:
-        pass
+        decisions = AGENT.act_batch(
+            keys,
+            [p[2] for p in parsed],
+            states=states,
+            rewards=rewards,
+            learn=not LEARN_ON_TICK,
+            features=([_candidate_features(dpid, c) for dpid, _, c in parsed] if LINEAR else None),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    DECISIONS.mark(len(decisions))
+    DECISIONS_TOTAL.inc(len(decisions))
+    EXPLORED_TOTAL.inc(sum(d.explored for d in decisions))
+
+    rows = []
+    out = []
+    for (dpid, dst_prefix, _), decision in zip(parsed, decisions):
+        _, max_load, total_drops, generation = switch_state[dpid]
+        rows.append(decision_row(decision, dpid, dst_prefix, max_load, total_drops))
+        out.append(_decision_json(decision, dpid, dst_prefix, generation))
+    _write_log_rows(rows)
+    if SHADOWS is not None:
+        SHADOWS.submit([
+            (key, p[2], switch_state[p[0]][1], switch_state[p[0]][2], d.state, d.out_port, r)
+            for key, p, d, r in zip(keys, parsed, decisions, rewards)
+        ])
+    return jsonify({"decisions": out})
+
 
+@app.get("/policy")
+def policy():
+    """Greedy out_port per flow key and state, as
+    ``{"version", "ts", "keys": ["dpid:dst_prefix", ...], "ports": [[p0, p1, p2], ...]}``.
+
+    ``since=<version>`` long-polls: the reply waits up to ``wait=`` seconds
+    for a different version and is a bodiless 304 if none appeared.
+    """
+    since = request.args.get("since", type=int)
+    if since is not None:
+        wait_s = min(max(0.0, request.args.get("wait", 20.0, type=float)), POLICY_MAX_WAIT_S)
+        if POLICY.wait(since, wait_s) == since:
+            return Response(status=304, headers={"X-Policy-Version": str(since)})
+    version, blob = POLICY.read()
+    if not version:
+        if POLICY_CHECK_S <= 0:
+            return jsonify({"error": "policy publishing is off (QL_POLICY_CHECK_S=0)"}), 503
+        return jsonify({"error": "no policy published yet"}), 503
+    return Response(blob, mimetype="application/json", headers={"X-Policy-Version": str(version)})
+
+
+@app.get("/qos_signals")
+def qos_signals():
+    """Current QoS feed signals per destination prefix and the reward mode."""
     return jsonify(
         {
-            "dpid": dpid,
-            "dst_prefix": dst_prefix,
-            "state": state,
-            "action": action_idx,
-            "out_port": out_port,
-            "epsilon": float(eps),
-            "step": step,
+            "mode": REWARD_MODE,
+            "weight": QOS_WEIGHT,
+            "applied": QOS_SIGNALS.applied,
+            "rejected": QOS_SIGNALS.rejected,
+            "signals": QOS_SIGNALS.snapshot(),
         }
     )
 
 
+@app.get("/shadow")
+def shadow():
+    """Agreement rate and counterfactual reward of each QL_SHADOWS entry."""
+    if SHADOWS is None:
+        return jsonify({"error": "no shadows configured (QL_SHADOWS)"}), 404
+    return jsonify(SHADOWS.report())
+
+
+def _switch_keys(dpids) -> list:
+    prefixes = tuple(flow_key(d, "") for d in dpids)
+    return [k for k in AGENT.keys() if k.startswith(prefixes)]
+
+
+@app.get("/shard/export")
+def shard_export():
+    dpids = request.args.getlist("dpid", type=int)
+    if not dpids:
+        return jsonify({"error": "dpid required"}), 400
+    state = AGENT.export_state(keys=_switch_keys(dpids))
+    return Response(dump_state(state), mimetype="application/octet-stream")
+
+
+@app.post("/shard/import")
+def shard_import():
+    try:
+        state = load_state(request.get_data())
+    except Exception as e:
+        return jsonify({"error": f"invalid state: {e}"}), 400
+    try:
+        n = AGENT.merge_state(state)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"imported": n})
+
+
+@app.post("/shard/drop")
+def shard_drop():
+    body = request.get_json(force=True, silent=True) or {}
+    dpids = [int(d) for d in body.get("dpids") or []]
+    removed = AGENT.remove_keys(_switch_keys(dpids))
+    STORE.drop_switches(dpids)
+    return jsonify({"removed": removed})
+
+
 @app.get("/debug/summary")
 def debug_summary():
-    with AGENT._lock:
-        keys = sorted(list(AGENT._q_tables.keys()))
-        return jsonify(
-            {
-                "step": int(AGENT._step),
-                "epsilon": float(AGENT.epsilon),
-                "keys": keys,
-            }
+    return jsonify(
+        {
+            "step": AGENT._step,
+            "epsilon": AGENT.epsilon,
+            "keys": sorted(AGENT.keys()),
+        }
+    )
+
+
+def _stream_tables(head: dict, tables: dict, chunk: int = 256):
+    """Yield ``head`` with a ``tables`` object appended, ``chunk`` keys at a time."""
+    yield json.dumps(head)[:-1] + ', "tables": {'
+    items = list(tables.items())
+    for i in range(0, len(items), chunk):
+        yield ("," if i else "") + ",".join(
+            json.dumps(k) + ": " + json.dumps({"actions": list(actions), "q": q.tolist()})
+            for k, (actions, q) in items[i : i + chunk]
         )
+    yield "}}"
 
 
 @app.get("/debug/qtable")
 def debug_qtable():
+    """One key (``key=``), or the keys starting with ``prefix=`` sorted and
+    paged by ``offset=``/``limit=`` (0 = all). ``format=npz`` or
+    ``Accept: application/octet-stream`` returns the page in checkpoint format.
+
+    Rows are copied through the agent's seqlocks before anything is encoded,
+    so learners are never blocked and no table is half-updated.
+    """
     key = request.args.get("key")
-    with AGENT._lock:
-        if key:
-            if key not in AGENT._q_tables:
-                return jsonify({"error": "key not found"}), 404
-            return jsonify(
-                {
-                    "key": key,
-                    "actions": AGENT._actions.get(key, []),
-                    "q": AGENT._q_tables[key].tolist(),
-                    "epsilon": float(AGENT.epsilon),
-                    "step": int(AGENT._step),
-                }
-            )
-        out = {}
-        for k, q in AGENT._q_tables.items():
-            out[k] = {
-                "actions": AGENT._actions.get(k, []),
+    if key:
+        tables, step, eps = AGENT.snapshot(keys=[key])
+        if key not in tables:
+            return jsonify({"error": "key not found"}), 404
+        actions, q = tables[key]
+        return jsonify(
+            {
+                "key": key,
+                "actions": list(actions),
                 "q": q.tolist(),
+                "epsilon": eps,
+                "step": step,
             }
-        return jsonify({"epsilon": float(AGENT.epsilon), "step": int(AGENT._step), "tables": out})
+        )
+
+    prefix = request.args.get("prefix", "")
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = max(0, request.args.get("limit", 0, type=int))
+    keys = sorted(k for k in AGENT.keys() if k.startswith(prefix))
+    page = keys[offset : (offset + limit) if limit else None]
+
+    wants = request.accept_mimetypes.best_match(["application/json", "application/octet-stream"])
+    if request.args.get("format") == "npz" or wants == "application/octet-stream":
+        return Response(
+            dump_state(AGENT.export_state(keys=page)),
+            mimetype="application/octet-stream",
+            headers={"Content-Disposition": "attachment; filename=qtable.npz"},
+        )
+
+    tables, step, eps = AGENT.snapshot(keys=page)
+    end = offset + len(page)
+    head = {
+        "epsilon": eps,
+        "step": step,
+        "total": len(keys),
+        "offset": offset,
+        "next_offset": end if end < len(keys) else None,
+    }
+    return Response(_stream_tables(head, tables), mimetype="application/json")
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+ROUTE_LATENCY = {
+    rule.endpoint: METRICS.histogram(
+        "agent_request_duration_seconds",
+        "Request latency by route.",
+        {"route": rule.rule},
+    )
+    for rule in app.url_map.iter_rules()
+    if rule.endpoint != "static"
+}
+METRICS.gauge("agent_log_queue_depth", "Decision log rows waiting to be written.", DECISION_LOG.depth)
+METRICS.counter(
+    "agent_log_rows_dropped_total",
+    "Decision log rows dropped (queue full or write error).",
+    fn=lambda: DECISION_LOG.dropped,
+)
+METRICS.counter("agent_log_rows_written_total", "Decision log rows written.", fn=lambda: DECISION_LOG.written)
+if SHADOWS is not None:
+    METRICS.gauge("agent_shadow_queue_depth", "Decision batches waiting for shadow evaluation.", SHADOWS.depth)
+    METRICS.counter(
+        "agent_shadow_events_dropped_total",
+        "Decisions not shadow-evaluated (queue full or evaluation error).",
+        fn=lambda: SHADOWS.dropped + SHADOWS.report()["failed"],
+    )
+    for _name, _ in SHADOW_SPECS:
+        METRICS.counter(
+            "agent_shadow_decisions_total", "Shadow decisions made.", {"shadow": _name},
+            fn=lambda n=_name: SHADOWS.report()["shadows"].get(n, {}).get("decisions", 0),
+        )
+        METRICS.gauge(
+            "agent_shadow_agreement", "Share of shadow decisions matching the primary's.",
+            lambda n=_name: SHADOWS.report()["shadows"].get(n, {}).get("agreement") or 0.0,
+            {"shadow": _name},
+        )
+METRICS.counter(
+    "agent_qos_feed_datagrams_total", "QoS feed datagrams by result.", {"result": "applied"},
+    fn=lambda: QOS_SIGNALS.applied,
+)
+METRICS.counter(
+    "agent_qos_feed_datagrams_total", "QoS feed datagrams by result.", {"result": "rejected"},
+    fn=lambda: QOS_SIGNALS.rejected,
+)
+METRICS.gauge("agent_observations", "Live (dpid, port, qid) observations.", lambda: len(STORE))
+METRICS.counter(
+    "agent_observations_evicted_total",
+    "Observations dropped for age or to stay under QL_MAX_OBSERVATIONS.",
+    fn=lambda: STORE.evicted,
+)
+METRICS.gauge("agent_keys", "Flow keys with a Q-table.", lambda: len(AGENT))
+METRICS.counter(
+    "agent_keys_evicted_total", "Flow keys evicted to stay under QL_KEY_LIMIT.", fn=lambda: AGENT.evicted
+)
+METRICS.counter(
+    "agent_keys_reloaded_total", "Evicted flow keys reloaded from QL_SPILL_PATH.", fn=lambda: AGENT.reloaded
+)
+METRICS.gauge("agent_qtable_bytes", "Bytes allocated for the Q-tables and their per-row state.", AGENT.nbytes)
+METRICS.gauge("agent_in_flight", "/act and /act_batch requests being decided.", lambda: ADMISSION.in_flight)
+METRICS.gauge("agent_decisions_per_second", "Decisions per second over the last 10 s.", DECISIONS.rate)
+METRICS.gauge("agent_epsilon", "Current exploration rate.", lambda: AGENT.epsilon)
+METRICS.gauge("agent_policy_version", "Version of the greedy policy served by /policy.", lambda: POLICY.version)
+METRICS.gauge("agent_policy_bytes", "Size of the encoded greedy policy.", lambda: POLICY.nbytes)
 
 
 if __name__ == "__main__":
     host = os.environ.get("HOST", "0.0.0.0")
     port = int(os.environ.get("PORT", "5000"))
-    app.run(host=host, port=port, debug=False)
+    if SHARED:
+        print(f"[AGENT] AGENT_WORKERS={WORKERS} needs gunicorn; the dev server runs a single process")
+        start_background()
+    app.run(host=host, port=port, debug=False, threaded=True)
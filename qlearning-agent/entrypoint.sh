@@ -0,0 +1,9 @@
+#!/bin/bash
+set -e
+
+# AGENT_SERVER=gunicorn (default in the image) serves through gunicorn's
+# threaded worker; AGENT_SERVER=dev keeps Flask's development server.
+if [ "${AGENT_SERVER:-gunicorn}" = "dev" ]; then
+    exec python -u app.py
+fi
+exec gunicorn -c gunicorn.conf.py app:app
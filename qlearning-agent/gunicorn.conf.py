@@ -0,0 +1,36 @@
+# Gunicorn settings for the Q-learning agent (AGENT_SERVER=gunicorn).
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+
+# One worker by default; concurrency comes from its thread pool. With
+# AGENT_WORKERS > 1 the app is loaded once in the master, which allocates the
+# Q-tables and observations in shared memory, and the workers inherit them
+# through fork.
+workers = max(1, int(os.environ.get("AGENT_WORKERS", "1")))
+worker_class = "gthread"
+threads = int(os.environ.get("AGENT_THREADS", "16"))
+preload_app = workers > 1
+
+# Keep-alive lets the controller's requests.Session reuse one connection.
+keepalive = int(os.environ.get("AGENT_KEEPALIVE_S", "75"))
+
+# Backpressure: at most AGENT_MAX_CONNECTIONS open client connections per
+# worker and AGENT_BACKLOG pending ones in the kernel queue; beyond that new
+# connections wait in (or are refused by) the listen queue instead of piling
+# up work inside the agent.
+worker_connections = int(os.environ.get("AGENT_MAX_CONNECTIONS", "256"))
+backlog = int(os.environ.get("AGENT_BACKLOG", "128"))
+
+timeout = int(os.environ.get("AGENT_WORKER_TIMEOUT_S", "30"))
+graceful_timeout = 5
+accesslog = None
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    # Threads started in the master do not exist in a forked worker.
+    if preload_app:
+        import app
+
+        app.start_background()
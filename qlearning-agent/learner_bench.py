@@ -0,0 +1,164 @@
+"""Convergence benchmark for the agent's learners (QL_LEARNER) and
+exploration strategies (QL_EXPLORATION).
+
+Simulates ``--keys`` flows, each with its own random 3-state MDP over
+``--candidates`` ports, and drives a ``QAgent`` with the same decision loop
+as ``/act_batch``: the reward of the previous decision is the app's reward
+for the state the flow arrives in, plus Gaussian noise. Every
+``--check-every`` steps the greedy policy is read back and compared with
+the optimal one (value iteration on the true MDPs).
+
+A key's policy counts as stable once its greedy action in every state has
+not changed for ``--window`` steps. For each learner and seed the benchmark
+reports the share of stable keys, the median and 90th percentile of the
+step at which they last changed, the share of (key, state) entries matching
+the optimal policy at the end, the share of decisions that were not
+greedy, and the mean reward collected (lower means more loss during
+exploration).
+
+    python learner_bench.py --learners q,double,sweep --seeds 1,2,3 --steps 3000
+    python learner_bench.py --explorations epsilon,key_epsilon,ucb,boltzmann
+"""
+
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+from qlearning_core import N_STATES, QAgent
+
+FIELDS = [
+    "learner",
+    "exploration",
+    "seed",
+    "keys",
+    "candidates",
+    "steps",
+    "stable_keys",
+    "median_stable_step",
+    "p90_stable_step",
+    "optimal_at_end",
+    "explored",
+    "mean_reward",
+]
+
+# Reward for arriving in each state, as QoSModel.get_reward: no drops and
+# low load, no drops and medium load, drops.
+STATE_REWARD = np.array([20.0, 10.0, -50.0])
+
+
+def make_mdps(rng: np.random.Generator, n_keys: int, n_actions: int) -> np.ndarray:
+    """Transition probabilities ``(n_keys, N_STATES, n_actions, N_STATES)``."""
+    return rng.dirichlet(np.full(N_STATES, 0.7), size=(n_keys, N_STATES, n_actions))
+
+
+def optimal_policy(p: np.ndarray, gamma: float, iters: int = 500) -> np.ndarray:
+    expected_r = p @ STATE_REWARD
+    v = np.zeros(p.shape[:2])
+    for _ in range(iters):
+        q = expected_r + gamma * np.einsum("ksat,kt->ksa", p, v)
+        v = q.max(axis=2)
+    return q.argmax(axis=2)
+
+
+def run(learner: str, exploration: str, seed: int, args) -> dict:
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    p = make_mdps(rng, args.keys, args.candidates)
+    optimal = optimal_policy(p, args.gamma)
+    cdf = p.cumsum(axis=3)
+
+    agent = QAgent(
+        lr=args.lr,
+        gamma=args.gamma,
+        epsilon=1.0,
+        epsilon_min=args.epsilon_min,
+        epsilon_decay=args.epsilon_decay,
+        initial_keys=args.keys,
+        initial_actions=args.candidates,
+        learner=learner,
+        exploration=exploration,
+    )
+    keys = [f"1:{i}" for i in range(args.keys)]
+    candidates = [list(range(1, args.candidates + 1))] * args.keys
+    idx = np.arange(args.keys)
+    states = rng.integers(0, N_STATES, args.keys)
+    rewards = np.zeros(args.keys)
+
+    last_greedy = None
+    last_change = np.zeros(args.keys, dtype=np.int64)
+    total_reward = 0.0
+    explored = 0
+    for step in range(1, args.steps + 1):
+        decisions = agent.act_batch(keys, candidates, states.tolist(), rewards.tolist())
+        actions = np.array([d.action for d in decisions])
+        explored += sum(d.explored for d in decisions)
+        u = rng.random(args.keys)[:, None]
+        states = (u > cdf[idx, states, actions]).sum(axis=1).clip(0, N_STATES - 1)
+        rewards = STATE_REWARD[states] + rng.normal(0.0, args.noise, args.keys)
+        total_reward += float(rewards.sum())
+
+        if step % args.check_every == 0:
+            _, ports = agent.greedy_policy(keys)
+            greedy = ports - 1
+            if last_greedy is not None:
+                last_change[(greedy != last_greedy).any(axis=1)] = step
+            last_greedy = greedy
+
+    stable = args.steps - last_change >= args.window
+    settled = last_change[stable]
+    return {
+        "learner": learner,
+        "exploration": exploration,
+        "seed": seed,
+        "keys": args.keys,
+        "candidates": args.candidates,
+        "steps": args.steps,
+        "stable_keys": round(float(stable.mean()), 4),
+        "median_stable_step": int(np.median(settled)) if len(settled) else "",
+        "p90_stable_step": int(np.percentile(settled, 90)) if len(settled) else "",
+        "optimal_at_end": round(float((last_greedy == optimal).mean()), 4),
+        "explored": round(explored / (args.steps * args.keys), 4),
+        "mean_reward": round(total_reward / (args.steps * args.keys), 3),
+    }
+
+
+def _list(cast):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--learners", type=_list(str), default=["q"])
+    ap.add_argument("--explorations", type=_list(str), default=["epsilon"])
+    ap.add_argument("--seeds", type=_list(int), default=[1, 2, 3])
+    ap.add_argument("--keys", type=int, default=200, help="simulated flow keys")
+    ap.add_argument("--candidates", type=int, default=3, help="candidate ports per key")
+    ap.add_argument("--steps", type=int, default=3000, help="decisions per key")
+    ap.add_argument("--lr", type=float, default=0.1)
+    ap.add_argument("--gamma", type=float, default=0.9)
+    ap.add_argument("--epsilon-decay", type=float, default=0.995)
+    ap.add_argument("--epsilon-min", type=float, default=0.05)
+    ap.add_argument("--noise", type=float, default=10.0, help="reward noise (std)")
+    ap.add_argument("--check-every", type=int, default=10, help="steps between greedy-policy reads")
+    ap.add_argument("--window", type=int, default=500, help="unchanged steps that count as stable")
+    ap.add_argument("--out", default="-", help="CSV path, '-' for stdout")
+    args = ap.parse_args()
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        w = csv.DictWriter(out, fieldnames=FIELDS)
+        w.writeheader()
+        for learner in args.learners:
+            for exploration in args.explorations:
+                for seed in args.seeds:
+                    w.writerow(run(learner, exploration, seed, args))
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
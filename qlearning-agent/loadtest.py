@@ -0,0 +1,308 @@
+"""Load test for the Q-learning agent.
+
+Replays a controller-like mix of ``/observe`` (port/queue stats) and ``/act``
+(packet-in decisions) against an agent and reports throughput, latency
+percentiles, the share of requests slower than the controller's
+``QLEARNING_AGENT_TIMEOUT_S`` and the share shed by admission control
+(``QL_MAX_IN_FLIGHT``). Every comma-separated value of ``--concurrency``,
+``--dpids``, ``--prefixes`` and ``--candidates`` is combined into a grid, one
+CSV row per run and route.
+
+Without ``--url`` a local agent is started on a free port, so no Docker or
+Mininet is needed:
+
+    python loadtest.py --concurrency 1,8,32 --prefixes 10,1000 --out bench.csv
+"""
+
+import argparse
+import csv
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+
+FIELDS = [
+    "server",
+    "concurrency",
+    "dpids",
+    "prefixes",
+    "candidates",
+    "observe_ratio",
+    "route",
+    "requests",
+    "duration_s",
+    "throughput_rps",
+    "p50_ms",
+    "p95_ms",
+    "p99_ms",
+    "p999_ms",
+    "max_ms",
+    "timeout_rate",
+    "error_rate",
+    "shed_rate",
+]
+
+
+def _int_list(s: str) -> list[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_agent(server: str, workdir: Path) -> tuple[subprocess.Popen, str]:
+    """Start a throwaway agent (``dev`` or ``gunicorn``) and wait for /health."""
+    here = Path(__file__).resolve().parent
+    port = _free_port()
+    env = dict(
+        os.environ,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        QL_LOG_PATH=str(workdir / "qlearning_agent_log.csv"),
+        QL_CHECKPOINT_PATH=str(workdir / "qlearning_agent.npz"),
+        QL_CHECKPOINT_INTERVAL_S="0",
+    )
+    if server == "gunicorn":
+        cmd = ["gunicorn", "-c", str(here / "gunicorn.conf.py"), "app:app"]
+    else:
+        cmd = [sys.executable, str(here / "app.py")]
+    proc = subprocess.Popen(cmd, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"agent exited with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=0.5)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("agent did not become healthy")
+
+
+class Workload:
+    """Request generator shaped like ryu_qlearning.py traffic."""
+
+    def __init__(self, n_dpids: int, n_prefixes: int, n_candidates: int, observe_ratio: float, seed: int):
+        self.rng = random.Random(seed)
+        self.dpids = [256 * (i + 1) for i in range(n_dpids)]
+        self.prefixes = [f"10.{i // 256}.{i % 256}" for i in range(n_prefixes)]
+        self.candidates = list(range(1, n_candidates + 1))
+        self.observe_ratio = float(observe_ratio)
+
+    def next(self) -> tuple[str, bytes]:
+        rng = self.rng
+        dpid = rng.choice(self.dpids)
+        if rng.random() < self.observe_ratio:
+            port = rng.choice(self.candidates)
+            qid = rng.choice([None, 0, 1])
+            drops = rng.choice([0] * 19 + [rng.randint(1, 20)])
+            body = {"dpid": dpid, "port": port, "qid": qid, "load_bps": rng.uniform(0, 4e5), "drops": drops}
+            return "/observe", json.dumps(body).encode()
+        body = {"dpid": dpid, "dst_prefix": rng.choice(self.prefixes), "candidates": self.candidates}
+        return "/act", json.dumps(body).encode()
+
+
+def _worker(url, workload, timeout_s, stop_at, warmup_until, results, lock):
+    u = urlparse(url)
+    headers = {"Content-Type": "application/json"}
+    lat = {"/observe": [], "/act": []}
+    timeouts = {"/observe": 0, "/act": 0}
+    errors = {"/observe": 0, "/act": 0}
+    shed = {"/observe": 0, "/act": 0}
+
+    # The client waits longer than the controller would, so slow answers are
+    # still measured and counted as timeouts instead of being cut off.
+    conn = http.client.HTTPConnection(u.hostname, u.port, timeout=max(5.0, 10 * timeout_s))
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            break
+        route, body = workload.next()
+        t0 = time.perf_counter()
+        try:
+            conn.request("POST", route, body, {**headers, "X-Request-Sent": repr(time.time())})
+            resp = conn.getresponse()
+            data = resp.read()
+            # A saturated agent answers at once with its greedy port
+            # ("admitted": false) or 429, which the controller turns into
+            # its static port: both count as answered, and as shed.
+            ok = resp.status in (200, 429)
+            was_shed = resp.status == 429 or b'"admitted":false' in data.replace(b" ", b"")
+        except (OSError, http.client.HTTPException):
+            ok = was_shed = False
+            conn.close()
+            conn = http.client.HTTPConnection(u.hostname, u.port, timeout=max(5.0, 10 * timeout_s))
+        dt = time.perf_counter() - t0
+        if t0 < warmup_until:
+            continue
+        if not ok:
+            errors[route] += 1
+            continue
+        lat[route].append(dt)
+        shed[route] += was_shed
+        if dt > timeout_s:
+            timeouts[route] += 1
+    conn.close()
+
+    with lock:
+        for route in lat:
+            results["lat"][route].extend(lat[route])
+            results["timeouts"][route] += timeouts[route]
+            results["errors"][route] += errors[route]
+            results["shed"][route] += shed[route]
+
+
+def run_once(url, concurrency, n_dpids, n_prefixes, n_candidates, observe_ratio, duration_s, warmup_s, timeout_s, seed):
+    results = {
+        "lat": {"/observe": [], "/act": []},
+        "timeouts": {"/observe": 0, "/act": 0},
+        "errors": {"/observe": 0, "/act": 0},
+        "shed": {"/observe": 0, "/act": 0},
+    }
+    lock = threading.Lock()
+    start = time.perf_counter()
+    warmup_until = start + warmup_s
+    stop_at = warmup_until + duration_s
+    threads = [
+        threading.Thread(
+            target=_worker,
+            args=(
+                url,
+                Workload(n_dpids, n_prefixes, n_candidates, observe_ratio, seed + i),
+                timeout_s,
+                stop_at,
+                warmup_until,
+                results,
+                lock,
+            ),
+            daemon=True,
+        )
+        for i in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    rows = []
+    for route in ["all", "/observe", "/act"]:
+        routes = ["/observe", "/act"] if route == "all" else [route]
+        lat_ms = np.concatenate([np.asarray(results["lat"][r], dtype=np.float64) for r in routes]) * 1000.0
+        timeouts = sum(results["timeouts"][r] for r in routes)
+        errors = sum(results["errors"][r] for r in routes)
+        shed = sum(results["shed"][r] for r in routes)
+        total = len(lat_ms) + errors
+        if total == 0:
+            continue
+        if len(lat_ms):
+            p50, p95, p99, p999 = np.percentile(lat_ms, [50, 95, 99, 99.9])
+            mx = float(lat_ms.max())
+        else:
+            p50 = p95 = p99 = p999 = mx = float("nan")
+        rows.append(
+            {
+                "concurrency": concurrency,
+                "dpids": n_dpids,
+                "prefixes": n_prefixes,
+                "candidates": n_candidates,
+                "observe_ratio": observe_ratio,
+                "route": route,
+                "requests": total,
+                "duration_s": round(duration_s, 3),
+                "throughput_rps": round(len(lat_ms) / duration_s, 1),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "p999_ms": round(float(p999), 3),
+                "max_ms": round(mx, 3),
+                "timeout_rate": round((timeouts + errors) / total, 5),
+                "error_rate": round(errors / total, 5),
+                "shed_rate": round(shed / total, 5),
+            }
+        )
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--url", default="", help="agent base URL; empty starts a local agent")
+    ap.add_argument("--server", choices=["gunicorn", "dev"], default="gunicorn", help="server for the local agent")
+    ap.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    ap.add_argument("--dpids", type=_int_list, default=[3])
+    ap.add_argument("--prefixes", type=_int_list, default=[8, 256])
+    ap.add_argument("--candidates", type=_int_list, default=[2])
+    ap.add_argument("--observe-ratio", type=float, default=0.2, help="share of /observe in the mix")
+    ap.add_argument("--duration", type=float, default=10.0, help="measured seconds per run")
+    ap.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each run")
+    ap.add_argument(
+        "--timeout",
+        type=float,
+        default=float(os.environ.get("QLEARNING_AGENT_TIMEOUT_S", "0.3")),
+        help="latency counted as a controller timeout (seconds)",
+    )
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="-", help="CSV path, '-' for stdout")
+    args = ap.parse_args()
+
+    proc = None
+    tmp = None
+    url = args.url.rstrip("/")
+    server = "external"
+    if not url:
+        tmp = tempfile.TemporaryDirectory(prefix="ql-loadtest-")
+        proc, url = spawn_agent(args.server, Path(tmp.name))
+        server = args.server
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        w = csv.DictWriter(out, fieldnames=FIELDS)
+        w.writeheader()
+        grid = itertools.product(args.dpids, args.prefixes, args.candidates, args.concurrency)
+        for n_dpids, n_prefixes, n_candidates, concurrency in grid:
+            rows = run_once(
+                url,
+                concurrency,
+                n_dpids,
+                n_prefixes,
+                n_candidates,
+                args.observe_ratio,
+                args.duration,
+                args.warmup,
+                args.timeout,
+                args.seed,
+            )
+            for row in rows:
+                w.writerow({"server": server, **row})
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if tmp is not None:
+            tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Minimal Prometheus text-format metrics for the agent.
+
+Every metric is allocated up front with fixed buckets, so recording is a
+bisect plus a few integer additions under a private lock: cheap enough to
+leave on under production load without pulling in a client library.
+"""
+
+import bisect
+import threading
+import time
+
+# Seconds; tuned for sub-millisecond lock waits up to controller timeouts.
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.3, 1.0,
+)
+
+
+def _fmt_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(float(b) for b in buckets)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def render(self, name: str, labels: dict) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        acc = 0
+        for bound, c in zip(self.bounds, counts):
+            acc += c
+            lines.append(f"{name}_bucket{_fmt_labels({**labels, 'le': repr(bound)})} {acc}")
+        acc += counts[-1]
+        lines.append(f"{name}_bucket{_fmt_labels({**labels, 'le': '+Inf'})} {acc}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {acc}")
+        return lines
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+
+class RateMeter:
+    """Events per second over a sliding window of one-second slots."""
+
+    def __init__(self, window_s: int = 10):
+        self.window = max(1, int(window_s))
+        self._slots = [0] * (self.window + 1)
+        self._slot_sec = [0] * (self.window + 1)
+        self._lock = threading.Lock()
+
+    def mark(self, n: int = 1):
+        sec = int(time.monotonic())
+        i = sec % len(self._slots)
+        with self._lock:
+            if self._slot_sec[i] != sec:
+                self._slot_sec[i] = sec
+                self._slots[i] = 0
+            self._slots[i] += n
+
+    def rate(self) -> float:
+        now = int(time.monotonic())
+        with self._lock:
+            # Only completed seconds count; the current one is still filling.
+            total = sum(c for c, s in zip(self._slots, self._slot_sec) if now - self.window <= s < now)
+        return total / self.window
+
+
+class TimedLock:
+    """Lock wrapper recording acquire wait and hold time into histograms."""
+
+    __slots__ = ("_lock", "_wait", "_hold", "_acquired_at")
+
+    def __init__(self, wait: Histogram, hold: Histogram, lock=None):
+        self._lock = lock if lock is not None else threading.Lock()
+        self._wait = wait
+        self._hold = hold
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        t0 = time.perf_counter()
+        # multiprocessing locks spell "no timeout" as None rather than -1.
+        ok = self._lock.acquire(blocking) if timeout < 0 else self._lock.acquire(blocking, timeout)
+        if ok:
+            t1 = time.perf_counter()
+            self._acquired_at = t1
+            self._wait.observe(t1 - t0)
+        return ok
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold.observe(held)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name: str, help_text: str, labels: dict | None = None, buckets=LATENCY_BUCKETS) -> Histogram:
+        h = Histogram(buckets)
+        self._metrics.append((name, "histogram", help_text, labels or {}, h))
+        return h
+
+    def counter(self, name: str, help_text: str, labels: dict | None = None, fn=None) -> Counter | None:
+        """Counter owned by the registry, or one read from ``fn()`` at scrape time."""
+        c = fn if fn is not None else Counter()
+        self._metrics.append((name, "counter", help_text, labels or {}, c))
+        return None if fn is not None else c
+
+    def gauge(self, name: str, help_text: str, fn, labels: dict | None = None):
+        """Gauge evaluated at scrape time by calling ``fn()``."""
+        self._metrics.append((name, "gauge", help_text, labels or {}, fn))
+
+    def lock_timer(self, lock_name: str) -> tuple[Histogram, Histogram]:
+        labels = {"lock": lock_name}
+        wait = self.histogram("agent_lock_wait_seconds", "Time spent waiting to acquire a lock.", labels)
+        hold = self.histogram("agent_lock_hold_seconds", "Time a lock was held.", labels)
+        return wait, hold
+
+    def render(self) -> str:
+        # Series of one metric name must be contiguous in the exposition.
+        by_name = {}
+        for entry in self._metrics:
+            by_name.setdefault(entry[0], []).append(entry)
+
+        lines = []
+        for name, entries in by_name.items():
+            _, kind, help_text, _, _ = entries[0]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for _, _, _, labels, m in entries:
+                if kind == "histogram":
+                    lines.extend(m.render(name, labels))
+                    continue
+                try:
+                    value = m.value if isinstance(m, Counter) else float(m())
+                except Exception:
+                    value = float("nan")
+                lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,345 @@
+"""Offline Q-learning from logged agent decisions.
+
+Streams one or more ``qlearning_agent_log.csv`` files in fixed-size chunks,
+rebuilds the (key, s, a, r, s') transitions the live agent learned from and
+replays them with NumPy, then writes a checkpoint the agent can restore with
+``QL_RESTORE_FROM``. Memory is bounded by the chunk size plus the Q-tables;
+files are re-read once per epoch instead of being held in memory.
+
+A logged row carries the reward of the *previous* decision of the same key,
+so each row with a reward closes the transition (prev state, prev action,
+reward, this state). Actions are identified by ``out_port``, which stays
+valid when the controller's candidate list changed during the run.
+
+Several workers append to the same log in batches, so rows are not in
+decision order. A log whose ``step`` column goes backwards is first copied
+sorted by step (an external merge of ``--chunk-rows`` runs), so each key's
+decisions pair up in the order they were made.
+
+    python offline_train.py /shared/raw/qlearning_agent_log.csv \\
+        --out /shared/checkpoints/offline.npz --method fqi --epochs 20
+"""
+
+import argparse
+import csv
+import heapq
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from qlearning_core import N_STATES, read_checkpoint, write_checkpoint
+
+
+class OfflineTrainer:
+    def __init__(self, gamma: float = 0.9, lr: float = 0.1, chunk_rows: int = 50_000):
+        self.gamma = float(gamma)
+        self.lr = float(lr)
+        self.chunk_rows = max(1, int(chunk_rows))
+
+        self.keys = []
+        self._key_index = {}
+        # Sorted (key_id << 32 | port) codes and the column each one owns.
+        self._pair_codes = np.zeros(0, dtype=np.int64)
+        self._pair_cols = np.zeros(0, dtype=np.int64)
+        self._n_cols = np.zeros(0, dtype=np.int64)
+        self.ports = np.full((0, 1), -1, dtype=np.int32)
+        self.q = np.zeros((0, N_STATES, 1), dtype=np.float64)
+
+        self.rows_read = 0
+        self.transitions = 0
+        self.last_epsilon = None
+        self.last_step = 0
+
+    def _grow(self, n_keys: int, n_cols: int):
+        rows, _, cols = self.q.shape
+        if n_keys <= rows and n_cols <= cols:
+            return
+        new_rows = max(rows, 1)
+        while new_rows < n_keys:
+            new_rows *= 2
+        new_cols = max(cols, 1)
+        while new_cols < n_cols:
+            new_cols *= 2
+        q = np.zeros((new_rows, N_STATES, new_cols), dtype=np.float64)
+        q[:rows, :, :cols] = self.q
+        ports = np.full((new_rows, new_cols), -1, dtype=np.int32)
+        ports[:rows, :cols] = self.ports
+        n = np.zeros(new_rows, dtype=np.int64)
+        n[: len(self._n_cols)] = self._n_cols
+        self.q, self.ports, self._n_cols = q, ports, n
+
+    def _key_ids(self, dpids, prefixes) -> np.ndarray:
+        out = np.empty(len(dpids), dtype=np.int64)
+        index = self._key_index
+        for i, (dpid, prefix) in enumerate(zip(dpids, prefixes)):
+            key = f"{dpid}:{prefix}"
+            kid = index.get(key)
+            if kid is None:
+                kid = len(self.keys)
+                index[key] = kid
+                self.keys.append(key)
+            out[i] = kid
+        return out
+
+    def _columns(self, kid: np.ndarray, port: np.ndarray) -> np.ndarray:
+        codes = (kid << 32) | (port & 0xFFFFFFFF)
+        uniq = np.unique(codes)
+        if len(self._pair_codes):
+            pos = np.minimum(np.searchsorted(self._pair_codes, uniq), len(self._pair_codes) - 1)
+            known = self._pair_codes[pos] == uniq
+        else:
+            known = np.zeros(len(uniq), dtype=bool)
+        new = uniq[~known]
+        if len(new):
+            self._grow(len(self.keys), 1)
+            new_kid = new >> 32
+            new_cols = np.empty(len(new), dtype=np.int64)
+            # New pairs of the same key get consecutive columns.
+            for i, k in enumerate(new_kid.tolist()):
+                new_cols[i] = self._n_cols[k]
+                self._n_cols[k] += 1
+            self._grow(len(self.keys), int(self._n_cols.max()))
+            self.ports[new_kid, new_cols] = (new & 0xFFFFFFFF).astype(np.int32)
+
+            codes_all = np.concatenate([self._pair_codes, new])
+            cols_all = np.concatenate([self._pair_cols, new_cols])
+            order = np.argsort(codes_all, kind="stable")
+            self._pair_codes, self._pair_cols = codes_all[order], cols_all[order]
+        return self._pair_cols[np.searchsorted(self._pair_codes, codes)]
+
+    def _read_chunks(self, paths):
+        for file_no, path in enumerate(paths):
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                col = {name: i for i, name in enumerate(header)}
+                buf = []
+                for row in reader:
+                    if not row or row[0] == "ts":
+                        continue
+                    buf.append(row)
+                    if len(buf) >= self.chunk_rows:
+                        yield file_no, col, buf
+                        buf = []
+                if buf:
+                    yield file_no, col, buf
+
+    def _sorted_runs(self, path: Path, workdir: Path):
+        """``(header, step column, run paths)`` of ``path`` split into
+        step-sorted runs of ``chunk_rows``, or None when it is in order."""
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return None
+            step = header.index("step")
+            last, ordered = None, True
+            for row in reader:
+                if row and row[0] != "ts":
+                    if last is not None and int(row[step]) < last:
+                        ordered = False
+                        break
+                    last = int(row[step])
+            if ordered:
+                return None
+
+        runs = []
+        for _, _, rows in self._read_chunks([path]):
+            rows.sort(key=lambda row: int(row[step]))
+            run = workdir / f"{path.stem}.run{len(runs)}.csv"
+            with open(run, "w", newline="") as f:
+                csv.writer(f).writerows(rows)
+            runs.append(run)
+        return header, step, runs
+
+    def sort_by_step(self, paths, workdir: Path) -> list:
+        """``paths`` with every log that is out of step order replaced by a
+        sorted copy in ``workdir``."""
+        out = []
+        for i, path in enumerate(paths):
+            path = Path(path)
+            sorted_runs = self._sorted_runs(path, workdir)
+            if sorted_runs is None:
+                out.append(path)
+                continue
+            header, step, runs = sorted_runs
+            files = [open(run, newline="") for run in runs]
+            target = workdir / f"{i}_{path.name}"
+            try:
+                with open(target, "w", newline="") as f:
+                    w = csv.writer(f)
+                    w.writerow(header)
+                    # heapq.merge is stable across runs, so equal steps keep file order.
+                    w.writerows(heapq.merge(*(csv.reader(r) for r in files), key=lambda row: int(row[step])))
+            finally:
+                for r in files:
+                    r.close()
+                for run in runs:
+                    run.unlink()
+            out.append(target)
+        return out
+
+    def iter_transitions(self, paths):
+        """Yield ``(key_id, s, a, r, s_next)`` arrays, one tuple per chunk."""
+        carry_s = np.full(0, -1, dtype=np.int64)
+        carry_a = np.full(0, -1, dtype=np.int64)
+        current = None
+        self.rows_read = 0
+        for file_no, col, rows in self._read_chunks(paths):
+            if file_no != current:
+                # Transitions never span two runs.
+                carry_s[:] = -1
+                carry_a[:] = -1
+                current = file_no
+
+            cols = list(zip(*rows))
+            kid = self._key_ids(cols[col["dpid"]], cols[col["dst_prefix"]])
+            state = np.asarray(cols[col["state"]], dtype=np.int64)
+            port = np.asarray(cols[col["out_port"]], dtype=np.int64)
+            reward = np.array([float(x) if x else np.nan for x in cols[col["reward"]]], dtype=np.float64)
+            action = self._columns(kid, port)
+            self.rows_read += len(rows)
+            self.last_epsilon = float(cols[col["epsilon"]][-1])
+            self.last_step = max(self.last_step, int(cols[col["step"]][-1]))
+
+            n_keys = len(self.keys)
+            if len(carry_s) < n_keys:
+                pad = n_keys - len(carry_s)
+                carry_s = np.concatenate([carry_s, np.full(pad, -1, dtype=np.int64)])
+                carry_a = np.concatenate([carry_a, np.full(pad, -1, dtype=np.int64)])
+
+            order = np.argsort(kid, kind="stable")
+            k, s, a, r = kid[order], state[order], action[order], reward[order]
+            first = np.ones(len(k), dtype=bool)
+            first[1:] = k[1:] != k[:-1]
+            last = np.ones(len(k), dtype=bool)
+            last[:-1] = k[:-1] != k[1:]
+
+            prev_s = np.roll(s, 1)
+            prev_a = np.roll(a, 1)
+            prev_s[first] = carry_s[k[first]]
+            prev_a[first] = carry_a[k[first]]
+            carry_s[k[last]] = s[last]
+            carry_a[k[last]] = a[last]
+
+            ok = ~np.isnan(r) & (prev_s >= 0)
+            yield k[ok], prev_s[ok], prev_a[ok], r[ok], s[ok]
+
+    def _max_next(self, q, k, s_next):
+        return np.where(self.ports[k] >= 0, q[k, s_next], -np.inf).max(axis=1)
+
+    def _pad(self, arr: np.ndarray) -> np.ndarray:
+        """Zero-pad a table-shaped array after new keys or ports appeared."""
+        if arr.shape == self.q.shape:
+            return arr
+        out = np.zeros(self.q.shape, dtype=arr.dtype)
+        out[: arr.shape[0], :, : arr.shape[2]] = arr
+        return out
+
+    def epoch_fqi(self, paths) -> float:
+        """One fitted-Q sweep: Q(s,a) <- mean of r + gamma * max Q_old(s', .)."""
+        q_old = self.q.copy()
+        sums = np.zeros(self.q.shape, dtype=np.float64)
+        counts = np.zeros(self.q.shape, dtype=np.int64)
+        self.transitions = 0
+        for k, s, a, r, s_next in self.iter_transitions(paths):
+            q_old, sums, counts = self._pad(q_old), self._pad(sums), self._pad(counts)
+            if not len(k):
+                continue
+            target = r + self.gamma * self._max_next(q_old, k, s_next)
+            flat = np.ravel_multi_index((k, s, a), self.q.shape)
+            sums += np.bincount(flat, weights=target, minlength=self.q.size).reshape(self.q.shape)
+            counts += np.bincount(flat, minlength=self.q.size).reshape(self.q.shape)
+            self.transitions += len(k)
+
+        q_old = self._pad(q_old)
+        seen = counts > 0
+        self.q[seen] = sums[seen] / counts[seen]
+        return float(np.abs(self.q - q_old).max()) if self.q.size else 0.0
+
+    def epoch_td(self, paths) -> float:
+        """One pass of batched TD(0), one averaged step per chunk."""
+        q_old = self.q.copy()
+        self.transitions = 0
+        for k, s, a, r, s_next in self.iter_transitions(paths):
+            if not len(k):
+                continue
+            target = r + self.gamma * self._max_next(self.q, k, s_next)
+            delta = self.lr * (target - self.q[k, s, a])
+            flat = np.ravel_multi_index((k, s, a), self.q.shape)
+            uniq, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+            self.q.reshape(-1)[uniq] += np.bincount(inverse, weights=delta) / counts
+            self.transitions += len(k)
+        q_old = self._pad(q_old)
+        return float(np.abs(self.q - q_old).max()) if self.q.size else 0.0
+
+    def load_init(self, path: Path):
+        state = read_checkpoint(path)
+        keys = [str(k) for k in state["keys"]]
+        ports = np.asarray(state["ports"], dtype=np.int64)
+        q = np.asarray(state["q"], dtype=np.float64)
+        kid = self._key_ids([k.split(":", 1)[0] for k in keys], [k.split(":", 1)[1] for k in keys])
+        valid = ports >= 0
+        rows, cols = np.nonzero(valid)
+        if len(rows):
+            new_cols = self._columns(kid[rows], ports[rows, cols])
+            self.q[kid[rows][:, None], np.arange(N_STATES)[None, :], new_cols[:, None]] = q[rows, :, cols]
+        self.last_step = int(state["step"])
+        self.last_epsilon = float(state["epsilon"])
+
+    def export_state(self, epsilon: float, step: int) -> dict:
+        n = len(self.keys)
+        n_cols = self._n_cols[:n].astype(np.int32)
+        width = max(1, int(n_cols.max()) if n else 1)
+        return {
+            "keys": np.array(self.keys, dtype=str),
+            "ports": self.ports[:n, :width].copy(),
+            "n_actions": n_cols,
+            "q": self.q[:n, :, :width].astype(np.float32),
+            "step": np.int64(step),
+            "epsilon": np.float64(epsilon),
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("logs", nargs="+", type=Path, help="qlearning_agent_log.csv files")
+    ap.add_argument("--out", type=Path, default=Path("/shared/checkpoints/qlearning_offline.npz"))
+    ap.add_argument("--init", type=Path, default=None, help="checkpoint to start from")
+    ap.add_argument("--method", choices=["fqi", "td"], default="fqi")
+    ap.add_argument("--epochs", type=int, default=20)
+    ap.add_argument("--tol", type=float, default=1e-3, help="stop when max |dQ| per epoch drops below this")
+    ap.add_argument("--gamma", type=float, default=0.9)
+    ap.add_argument("--lr", type=float, default=0.1, help="TD step size (method=td)")
+    ap.add_argument("--chunk-rows", type=int, default=50_000)
+    ap.add_argument("--epsilon", type=float, default=None, help="epsilon to store; default: last logged value")
+    args = ap.parse_args()
+
+    trainer = OfflineTrainer(gamma=args.gamma, lr=args.lr, chunk_rows=args.chunk_rows)
+    if args.init is not None:
+        trainer.load_init(args.init)
+
+    epoch = trainer.epoch_fqi if args.method == "fqi" else trainer.epoch_td
+    with tempfile.TemporaryDirectory() as workdir:
+        logs = trainer.sort_by_step(args.logs, Path(workdir))
+        for i in range(max(1, args.epochs)):
+            t0 = time.time()
+            delta = epoch(logs)
+            print(
+                f"[OFFLINE] epoch {i + 1}: rows={trainer.rows_read} transitions={trainer.transitions} "
+                f"keys={len(trainer.keys)} max|dQ|={delta:.5f} ({time.time() - t0:.2f}s)"
+            )
+            if delta < args.tol:
+                break
+
+    eps = args.epsilon if args.epsilon is not None else (trainer.last_epsilon or 1.0)
+    write_checkpoint(args.out, trainer.export_state(epsilon=eps, step=trainer.last_step))
+    print(f"[OFFLINE] wrote {args.out} ({len(trainer.keys)} keys, epsilon={eps:.4f})")
+
+
+if __name__ == "__main__":
+    main()
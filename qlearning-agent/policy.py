@@ -0,0 +1,116 @@
+"""Versioned export of the agent's greedy policy.
+
+The controller keeps the latest policy locally and only asks the agent for
+a fraction of its decisions. A new version is published when at least
+``min_change`` of the (key, state) entries changed, or when anything changed
+and the current version is older than ``max_age_s``.
+
+The encoded policy lives in a byte buffer guarded by a sequence counter,
+written by the single thread running :meth:`PolicyPublisher.check`. With
+``shared=True`` the buffer is in a :class:`qlearning_core.shm.SharedArena`,
+so the publisher can run in the gunicorn master and every worker serves the
+same version.
+"""
+
+import json
+import time
+
+import numpy as np
+
+from qlearning_core import SharedArena
+
+
+class PolicyPublisher:
+    def __init__(self, agent, min_change: float = 0.01, max_age_s: float = 30.0, shared: bool = False,
+                 max_bytes: int = 8 << 20):
+        self.agent = agent
+        self.min_change = float(min_change)
+        self.max_age_s = float(max_age_s)
+        specs = {
+            # [sequence (odd while writing), version, encoded length]
+            "meta": ((3,), np.int64),
+            "blob": ((int(max_bytes),), np.uint8),
+        }
+        if shared:
+            self._arena = SharedArena(specs)
+            arrays = self._arena.arrays
+        else:
+            arrays = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in specs.items()}
+        self._meta = arrays["meta"]
+        self._blob = arrays["blob"]
+        # Publisher-side copy of the latest version; only check() uses it.
+        self._published = ({}, np.zeros((0, 0), dtype=np.int32))
+        self._published_at = 0.0
+        self.skipped = 0
+
+    @property
+    def version(self) -> int:
+        return int(self._meta[1])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._meta[2])
+
+    def _changed(self, keys: list, ports: np.ndarray) -> float:
+        """Fraction of (key, state) entries differing from the published policy."""
+        index, old = self._published
+        total = max(len(keys), len(index)) * ports.shape[1]
+        if not total:
+            return 0.0
+        rows = np.fromiter((index.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+        known = rows >= 0
+        changed = int(np.count_nonzero(old[rows[known]] != ports[known]))
+        changed += int(np.count_nonzero(~known)) * ports.shape[1]
+        changed += (len(index) - int(np.count_nonzero(known))) * ports.shape[1]
+        return changed / total
+
+    def check(self) -> bool:
+        """Publish a new version if the greedy policy changed enough."""
+        keys, ports = self.agent.greedy_policy()
+        now = time.time()
+        if self.version:
+            changed = self._changed(keys, ports)
+            if changed == 0.0:
+                return False
+            if changed < self.min_change and now - self._published_at < self.max_age_s:
+                return False
+
+        version = self.version + 1
+        blob = json.dumps(
+            {"version": version, "ts": now, "keys": keys, "ports": ports.tolist()},
+            separators=(",", ":"),
+        ).encode()
+        if len(blob) > len(self._blob):
+            self.skipped += 1
+            if self.skipped == 1:
+                print(f"[AGENT] policy v{version} is {len(blob)} bytes, over QL_POLICY_MAX_BYTES; not publishing")
+            return False
+
+        self._meta[0] += 1
+        self._blob[: len(blob)] = np.frombuffer(blob, dtype=np.uint8)
+        self._meta[2] = len(blob)
+        self._meta[1] = version
+        self._meta[0] += 1
+        self._published = (dict(zip(keys, range(len(keys)))), ports)
+        self._published_at = now
+        return True
+
+    def read(self) -> tuple[int, bytes]:
+        """Untorn copy of the current ``(version, encoded policy)``."""
+        while True:
+            seq = int(self._meta[0])
+            if seq & 1:
+                time.sleep(0.001)
+                continue
+            version, length = int(self._meta[1]), int(self._meta[2])
+            blob = self._blob[:length].tobytes()
+            if int(self._meta[0]) == seq:
+                return version, blob
+
+    def wait(self, since: int, timeout_s: float, poll_s: float = 0.05) -> int:
+        """Current version once it differs from ``since`` (a restarted agent
+        counts from 1 again) or ``timeout_s`` passed."""
+        deadline = time.monotonic() + timeout_s
+        while self.version == since and time.monotonic() < deadline:
+            time.sleep(poll_s)
+        return self.version
@@ -0,0 +1,216 @@
+"""Application QoS signals reported by the traffic generators.
+
+``iot_sensor.py`` and ``iot_server.py`` send one JSON datagram per traffic
+class and second to a Unix datagram socket (``QOS_FEED_SOCKET`` on their
+side, ``QL_QOS_FEED_SOCKET`` here). A path in the shared volume reaches the
+agent from every Mininet host, whatever network namespace it runs in.
+
+    {"src": "h1", "class": "critical", "prefixes": ["10.0.100", "10.0.1"],
+     "sent": 30, "received": 29, "rtt_ms_sum": 41.2}
+    {"src": "h1", "class": "bulk", "prefixes": ["10.0.100", "10.0.1"],
+     "bulk_mbps": 7.1, "target_mbps": 8.0}
+    {"src": "server", "class": "bulk", "prefixes": [""], "bulk_mbps": 7.9}
+
+Each datagram counts towards every listed destination prefix, "" being
+the catch-all. Per prefix the agent keeps exponentially decayed sums
+(time constant ``window_s``) of sent and lost UDP packets, critical RTT and
+bulk throughput (and the rate the sender aimed for, when it says). These
+are the quantities ``collect_metrics.py`` reports.
+Only the receiver thread writes, through per-slot seqlocks. With
+``shared=True`` the sums live in a :class:`qlearning_core.shm.SharedArena`,
+so a receiver in the gunicorn master serves every worker.
+"""
+
+import json
+import math
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from qlearning_core.shm import SharedArena, seq_begin, seq_end, seq_read
+
+# Decayed sums per prefix slot, after the time of their last update.
+TS, SENT, LOST, RTT_SUM, RTT_N, MBPS_SUM, MBPS_N, RATIO_SUM, RATIO_N = range(9)
+UDP_CLASSES = ("critical", "telemetry")
+
+
+class QoSSignals:
+    def __init__(self, window_s: float = 10.0, ttl_s: float = 30.0, capacity: int = 256, shared: bool = False):
+        self.window_s = max(1e-3, float(window_s))
+        self.ttl_s = float(ttl_s)
+        specs = {
+            "names": ((int(capacity),), "S32"),
+            "values": ((int(capacity), 9), np.float64),
+            "seq": ((int(capacity),), np.int64),
+            # [slots in use, datagrams applied, datagrams rejected]
+            "count": ((3,), np.int64),
+        }
+        if shared:
+            arrays = SharedArena(specs).arrays
+        else:
+            arrays = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in specs.items()}
+        self._names = arrays["names"]
+        self._values = arrays["values"]
+        self._seq = arrays["seq"]
+        self._count = arrays["count"]
+        self._slots = {}
+
+    @property
+    def applied(self) -> int:
+        return int(self._count[1])
+
+    @property
+    def rejected(self) -> int:
+        return int(self._count[2])
+
+    def reject(self):
+        self._count[2] += 1
+
+    def _slot(self, prefix: str, create: bool = False):
+        n = int(self._count[0])
+        if len(self._slots) != n:
+            self._slots = {name.decode(): i for i, name in enumerate(self._names[:n].tolist())}
+        slot = self._slots.get(prefix)
+        if slot is None and create and n < len(self._names):
+            slot = n
+            self._names[slot] = prefix.encode()[:32]
+            self._count[0] = n + 1
+            self._slots[prefix] = slot
+        return slot
+
+    def update(self, prefixes, sent: float = 0.0, lost: float = 0.0, rtt_sum: float = 0.0, rtt_n: float = 0.0,
+               mbps=None, target_mbps: float = 0.0, now: float = None):
+        """Add one report to each of ``prefixes`` (receiver thread only)."""
+        now = time.time() if now is None else float(now)
+        has_mbps = mbps is not None
+        has_target = has_mbps and target_mbps > 0
+        sample = np.array([
+            0.0, sent, lost, rtt_sum, rtt_n,
+            mbps if has_mbps else 0.0, float(has_mbps),
+            mbps / target_mbps if has_target else 0.0, float(has_target),
+        ])
+        for prefix in prefixes:
+            slot = self._slot(str(prefix), create=True)
+            if slot is None:
+                self.reject()
+                continue
+            row = self._values[slot]
+            decay = math.exp(-max(0.0, now - row[TS]) / self.window_s) if row[TS] > 0 else 0.0
+            seq_begin(self._seq, slot)
+            row[SENT:] = row[SENT:] * decay + sample[SENT:]
+            row[TS] = now
+            seq_end(self._seq, slot)
+
+    def _read(self, prefix: str, now: float):
+        slot = self._slot(prefix)
+        if slot is None:
+            return None
+        (row,) = seq_read(self._seq, [self._values], np.array([slot]))
+        row = row[0]
+        if row[TS] <= 0 or (self.ttl_s > 0 and now - row[TS] > self.ttl_s):
+            return None
+        return row
+
+    def get(self, prefix: str, now: float = None) -> dict:
+        """``{"rtt_ms", "loss", "bulk_mbps", "bulk_ratio"}`` for ``prefix``;
+        each missing signal falls back to the catch-all "" and is None if
+        that has none. ``bulk_ratio`` is the mean of achieved over target
+        throughput of the reports that gave a target."""
+        now = time.time() if now is None else float(now)
+        rows = [r for r in (self._read(str(prefix), now), self._read("", now) if prefix else None) if r is not None]
+        out = {"rtt_ms": None, "loss": None, "bulk_mbps": None, "bulk_ratio": None}
+        for row in rows:
+            if out["rtt_ms"] is None and row[RTT_N] > 0:
+                out["rtt_ms"] = float(row[RTT_SUM] / row[RTT_N])
+            if out["loss"] is None and row[SENT] > 0:
+                out["loss"] = float(min(1.0, row[LOST] / row[SENT]))
+            if out["bulk_mbps"] is None and row[MBPS_N] > 0:
+                out["bulk_mbps"] = float(row[MBPS_SUM] / row[MBPS_N])
+            if out["bulk_ratio"] is None and row[RATIO_N] > 0:
+                out["bulk_ratio"] = float(row[RATIO_SUM] / row[RATIO_N])
+        return out
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        n = int(self._count[0])
+        return {name.decode(): self.get(name.decode(), now) for name in self._names[:n].tolist()}
+
+    def apply(self, msg: dict):
+        """Fold one decoded datagram into the sums. The server's packet
+        counts per UDP class carry nothing the sensors do not measure
+        better, so they are accepted without being used."""
+        prefixes = msg.get("prefixes") or [""]
+        cls = msg.get("class")
+        if cls in UDP_CLASSES and "sent" in msg:
+            sent = float(msg["sent"])
+            received = float(msg.get("received", 0))
+            rtt_n = received if cls == "critical" else 0.0
+            self.update(
+                prefixes,
+                sent=sent,
+                lost=max(0.0, sent - received),
+                rtt_sum=float(msg.get("rtt_ms_sum", 0.0)) if rtt_n else 0.0,
+                rtt_n=rtt_n,
+            )
+        elif cls == "bulk" and msg.get("bulk_mbps") is not None:
+            self.update(prefixes, mbps=float(msg["bulk_mbps"]), target_mbps=float(msg.get("target_mbps") or 0.0))
+        elif cls not in UDP_CLASSES:
+            self.reject()
+            return
+        self._count[1] += 1
+
+
+def qos_reward(signals: dict, rtt_target_ms: float, loss_max: float):
+    """Reward on the switch reward's scale, from -50 (all signals at their
+    worst) to 20 (all on target), or None without any signal.
+
+    Critical RTT scores ``target / rtt`` (1 at or under target), UDP loss
+    ``1 - loss / loss_max`` and bulk throughput its ``bulk_ratio``, each
+    clipped to [0, 1]; they are weighted 0.4 / 0.4 / 0.2 over the signals
+    present. The server's own throughput figure says nothing about demand,
+    so it is reported but not scored.
+    """
+    scores = []
+    if signals.get("rtt_ms") is not None:
+        scores.append((0.4, min(1.0, rtt_target_ms / max(signals["rtt_ms"], 1e-6))))
+    if signals.get("loss") is not None:
+        scores.append((0.4, max(0.0, 1.0 - signals["loss"] / max(loss_max, 1e-9))))
+    if signals.get("bulk_ratio") is not None:
+        scores.append((0.2, min(1.0, max(0.0, signals["bulk_ratio"]))))
+    if not scores:
+        return None
+    score = sum(w * s for w, s in scores) / sum(w for w, _ in scores)
+    return -50.0 + 70.0 * score
+
+
+class QoSFeedReceiver(threading.Thread):
+    """Receives feed datagrams on a Unix socket into a :class:`QoSSignals`."""
+
+    def __init__(self, path: Path, signals: QoSSignals):
+        super().__init__(name="qos-feed", daemon=True)
+        self.path = Path(path)
+        self.signals = signals
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(str(self.path))
+        # The generators write from another container.
+        os.chmod(self.path, 0o666)
+
+    def run(self):
+        while True:
+            data = self._sock.recv(65536)
+            try:
+                msg = json.loads(data)
+                if not isinstance(msg, dict):
+                    raise ValueError("not an object")
+                self.signals.apply(msg)
+            except Exception:
+                self.signals.reject()
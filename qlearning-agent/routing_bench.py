@@ -0,0 +1,194 @@
+"""Routing benchmark for the tabular learners and the linear learner.
+
+Simulates ``--switches`` switches with ``--ports`` candidate ports of equal
+capacity (the congestion threshold). Each port carries background traffic
+around a per-port mean; the means are reshuffled every ``--shift-every``
+steps, so the congested port moves. ``--flows`` flow keys per switch, each
+with its own demand, are routed over the candidates, and every step a
+``--decide-share`` of them asks for a new decision with ``act_batch`` the
+way the controller's packet-ins do. State and reward are the app's, from
+the busiest port and total drops of the switch; the linear learner also
+gets the per-candidate features of ``QoSModel.get_features``.
+
+Traffic beyond a port's capacity is dropped in proportion to what each flow
+sends through it. For each learner and seed the benchmark reports the share
+of flow traffic lost, the share of switch-steps with drops, the mean reward
+and the time spent per decision (including building the features).
+``static`` always takes the first candidate, for reference.
+
+    python routing_bench.py --learners static,q,double,linear --seeds 1,2,3
+"""
+
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+from qlearning_core import QAgent, QoSModel, TileCoder
+
+FIELDS = [
+    "learner",
+    "exploration",
+    "seed",
+    "switches",
+    "flows",
+    "steps",
+    "loss",
+    "drop_steps",
+    "mean_reward",
+    "us_per_decision",
+]
+
+# Loads are in units of the congestion threshold, which is also the port
+# capacity; traffic over it counts this many drops per unit.
+MODEL = QoSModel(congestion_threshold=1.0)
+DROPS_PER_EXCESS = 100.0
+
+
+def features(max_load: np.ndarray, drops: np.ndarray, port_load: np.ndarray, port_drops: np.ndarray) -> np.ndarray:
+    """QoSModel.get_features of every switch, ``(switches, ports, 4)``, for
+    loads in units of the threshold."""
+    shape = port_load.shape
+    return np.stack([
+        np.broadcast_to(max_load[:, None], shape),
+        port_load,
+        np.broadcast_to(np.log1p(drops)[:, None], shape),
+        np.log1p(port_drops),
+    ], axis=2)
+
+
+def run(learner: str, exploration: str, seed: int, args) -> dict:
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    n_sw, n_ports, n_flows = args.switches, args.ports, args.flows
+    means = np.tile(np.linspace(0.1, args.background, n_ports), (n_sw, 1))
+    means = rng.permuted(means, axis=1)
+    background = means.copy()
+    demand = rng.uniform(0.5, 1.5, (n_sw, n_flows)) * args.demand / n_flows
+    assigned = np.zeros((n_sw, n_flows), dtype=np.int64)
+
+    agent = None
+    if learner != "static":
+        agent = QAgent(
+            lr=args.lr,
+            gamma=args.gamma,
+            epsilon=1.0,
+            epsilon_min=args.epsilon_min,
+            epsilon_decay=args.epsilon_decay,
+            initial_keys=n_sw * n_flows,
+            initial_actions=n_ports,
+            learner=learner,
+            exploration=exploration,
+            tile_coder=(
+                TileCoder(QoSModel.FEATURE_LOWS, QoSModel.FEATURE_HIGHS, QoSModel.FEATURE_BINS, tilings=args.tilings)
+                if learner == "linear"
+                else None
+            ),
+        )
+    keys = np.array([f"{s + 1}:{f}" for s in range(n_sw) for f in range(n_flows)])
+    ports = list(range(1, n_ports + 1))
+
+    port_load = background + np.zeros((n_sw, n_ports))
+    port_drops = np.zeros((n_sw, n_ports))
+    lost = offered = reward_sum = 0.0
+    drop_steps = decisions = 0
+    spent = 0.0
+    for step in range(1, args.steps + 1):
+        max_load = port_load.max(axis=1)
+        drops = port_drops.sum(axis=1)
+        states, rewards = MODEL.get_states(max_load, drops), MODEL.get_rewards(max_load, drops)
+
+        deciding = np.flatnonzero(rng.random(n_sw * n_flows) < args.decide_share)
+        sw = deciding // n_flows
+        t0 = time.perf_counter()
+        if agent is None:
+            chosen = np.zeros(len(deciding), dtype=np.int64)
+        else:
+            feats = None
+            if learner == "linear":
+                feats = features(max_load, drops, port_load, port_drops)[sw]
+            made = agent.act_batch(
+                keys[deciding].tolist(),
+                [ports] * len(deciding),
+                states[sw].tolist(),
+                rewards[sw].tolist(),
+                features=feats,
+            )
+            chosen = np.array([d.action for d in made], dtype=np.int64)
+        spent += time.perf_counter() - t0
+        decisions += len(deciding)
+        assigned.reshape(-1)[deciding] = chosen
+        reward_sum += float(rewards.sum())
+
+        if step % args.shift_every == 0:
+            means = rng.permuted(means, axis=1)
+        background = np.clip(
+            background + 0.2 * (means - background) + rng.normal(0.0, args.noise, background.shape), 0.0, None
+        )
+        flow_load = np.zeros((n_sw, n_ports))
+        np.add.at(flow_load, (np.repeat(np.arange(n_sw), n_flows), assigned.reshape(-1)), demand.reshape(-1))
+        port_load = background + flow_load
+        excess = np.maximum(port_load - 1.0, 0.0)
+        port_drops = np.round(excess * DROPS_PER_EXCESS)
+        lost += float((flow_load * excess / np.maximum(port_load, 1e-9)).sum())
+        offered += float(flow_load.sum())
+        drop_steps += int((port_drops.sum(axis=1) > 0).sum())
+
+    return {
+        "learner": learner,
+        "exploration": exploration,
+        "seed": seed,
+        "switches": n_sw,
+        "flows": n_flows,
+        "steps": args.steps,
+        "loss": round(lost / offered, 4),
+        "drop_steps": round(drop_steps / (args.steps * n_sw), 4),
+        "mean_reward": round(reward_sum / (args.steps * n_sw), 3),
+        "us_per_decision": round(1e6 * spent / max(decisions, 1), 2),
+    }
+
+
+def _list(cast):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--learners", type=_list(str), default=["static", "q", "linear"])
+    ap.add_argument("--explorations", type=_list(str), default=["epsilon"])
+    ap.add_argument("--seeds", type=_list(int), default=[1, 2, 3])
+    ap.add_argument("--switches", type=int, default=20)
+    ap.add_argument("--ports", type=int, default=3, help="candidate ports per switch")
+    ap.add_argument("--flows", type=int, default=30, help="flow keys per switch")
+    ap.add_argument("--steps", type=int, default=3000)
+    ap.add_argument("--decide-share", type=float, default=0.1, help="share of flows re-decided per step")
+    ap.add_argument("--demand", type=float, default=0.8, help="flow traffic per switch, in port capacities")
+    ap.add_argument("--background", type=float, default=0.8, help="highest background mean, in port capacities")
+    ap.add_argument("--noise", type=float, default=0.05, help="background noise per step (std)")
+    ap.add_argument("--shift-every", type=int, default=500, help="steps between background reshuffles")
+    ap.add_argument("--tilings", type=int, default=8)
+    ap.add_argument("--lr", type=float, default=0.1)
+    ap.add_argument("--gamma", type=float, default=0.9)
+    ap.add_argument("--epsilon-decay", type=float, default=0.995)
+    ap.add_argument("--epsilon-min", type=float, default=0.05)
+    ap.add_argument("--out", default="-", help="CSV path, '-' for stdout")
+    args = ap.parse_args()
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        w = csv.DictWriter(out, fieldnames=FIELDS)
+        w.writeheader()
+        for learner in args.learners:
+            for exploration in args.explorations if learner != "static" else ["-"]:
+                for seed in args.seeds:
+                    w.writerow(run(learner, exploration, seed, args))
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Shadow evaluation of candidate agent configurations.
+
+Each shadow is a separate in-process :class:`QAgent` (its own learner,
+exploration, hyper-parameters or congestion threshold) that sees the same
+decision stream as the primary agent but never answers a request. The
+request handlers only enqueue their decisions; a child process feeds the
+shadows in batches, so shadows add no work to the request path and events
+are dropped (and counted) when the queue is full.
+
+The network only ever follows the primary's action, so shadows learn
+off-policy from it: the TD update of a key uses the action the primary
+took, the shadow's own state and reward, and the shadow's own greedy
+estimate of the next state. The shadow's action is only recorded and
+compared.
+
+Counterfactual reward uses the logged outcomes: the reward observed after
+the primary chose ``port`` in switch state ``s`` for a flow key is averaged
+per ``(key, s, port)``, and a shadow decision is credited with that mean
+when the primary has tried the same port in the same situation (direct
+method estimate). ``coverage`` is the share of shadow decisions that could
+be scored that way; the primary's realized reward over the same decisions
+is reported next to it so the two means are comparable.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from qlearning_core import DecisionLog
+
+# QAgent keyword arguments a QL_SHADOWS entry may override; anything else
+# except "threshold" is rejected at startup.
+AGENT_OPTIONS = {
+    "lr": float,
+    "gamma": float,
+    "epsilon": float,
+    "epsilon_min": float,
+    "epsilon_decay": float,
+    "learner": str,
+    "sweep_steps": int,
+    "sweep_theta": float,
+    "exploration": str,
+    "ucb_c": float,
+    "temperature": float,
+    "temperature_min": float,
+    "temperature_decay": float,
+}
+
+LOG_HEADER = [
+    "ts",
+    "shadow",
+    "key",
+    "primary_state",
+    "shadow_state",
+    "primary_port",
+    "shadow_port",
+    "agree",
+    "explored",
+    "reward",
+    "counterfactual_reward",
+]
+
+
+def parse_shadows(spec: str) -> list:
+    """``name:opt=value,opt=value;name2:...`` -> ``[(name, {opt: value})]``.
+
+    ``opt`` is a QAgent option (``learner``, ``exploration``, ``lr``, ...)
+    or ``threshold`` (congestion threshold in bps for the shadow's state and
+    reward).
+    """
+    shadows = []
+    for entry in spec.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, opts = entry.partition(":")
+        name = name.strip()
+        if not name or any(name == n for n, _ in shadows):
+            raise ValueError(f"shadow names must be unique and non-empty: {entry!r}")
+        options = {}
+        for opt in opts.split(","):
+            if not opt.strip():
+                continue
+            k, sep, v = opt.partition("=")
+            k = k.strip()
+            if not sep:
+                raise ValueError(f"shadow {name}: expected option=value, got {opt!r}")
+            if k == "threshold":
+                options[k] = float(v)
+            elif k in AGENT_OPTIONS:
+                options[k] = AGENT_OPTIONS[k](v.strip())
+            else:
+                raise ValueError(f"shadow {name}: unknown option {k!r}")
+        shadows.append((name, options))
+    return shadows
+
+
+class Shadow:
+    def __init__(self, name: str, agent, model):
+        self.name = name
+        self.agent = agent
+        self.model = model
+        self.decisions = 0
+        self.agreed = 0
+        self.explored = 0
+        self.scored = 0
+        self.counterfactual_sum = 0.0
+        self.primary_scored_sum = 0.0
+
+    def report(self) -> dict:
+        return {
+            "learner": self.agent.learner,
+            "exploration": self.agent.exploration,
+            "threshold_bps": self.model.th,
+            "keys": len(self.agent),
+            "epsilon": self.agent.epsilon,
+            "decisions": self.decisions,
+            "agreement": (self.agreed / self.decisions) if self.decisions else None,
+            "explored": (self.explored / self.decisions) if self.decisions else None,
+            "coverage": (self.scored / self.decisions) if self.decisions else None,
+            "counterfactual_reward": (self.counterfactual_sum / self.scored) if self.scored else None,
+            "primary_reward_scored": (self.primary_scored_sum / self.scored) if self.scored else None,
+        }
+
+
+class ShadowRunner:
+    """Feeds primary decisions to the shadows in a child process.
+
+    An event is ``(key, candidates, max_load, total_drops, state, out_port,
+    reward)`` as seen by the primary: the switch aggregates behind the
+    decision, the primary's state and chosen port, and the reward the
+    primary credited to the key's previous decision.
+
+    Shadow updates are CPU-bound Python, so they run in a process forked by
+    :meth:`start` rather than a thread competing with request handlers for
+    the GIL; the caller's side of :meth:`submit` is a non-blocking queue put.
+    :meth:`report` asks the child for its counters over a pipe.
+    """
+
+    def __init__(self, shadows: list, log: DecisionLog = None, max_queue: int = 10000,
+                 batch_events: int = 1024, interval_s: float = 0.2, max_keys: int = 100000):
+        self.shadows = list(shadows)
+        self.log = log
+        self.batch_events = max(1, int(batch_events))
+        self.interval_s = max(0.0, float(interval_s))
+        self.max_keys = max(1, int(max_keys))
+        self.max_queue = max(1, int(max_queue))
+        self._mp = multiprocessing.get_context("fork")
+        self._queue = None
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._dropped_lock = threading.Lock()
+        self._child = None
+        self._cached = (0.0, None)
+        # Child-side state.
+        # key -> (primary state, primary port, candidates, {shadow: (state, port)})
+        self._pending = OrderedDict()
+        # (key, primary state, port) -> [reward sum, count]
+        self._outcomes = OrderedDict()
+        self.events = 0
+        self.dropped = 0
+        self.failed = 0
+        self.realized_sum = 0.0
+        self.realized = 0
+
+    def start(self):
+        """Fork the evaluating process; called once, from the agent's only
+        process."""
+        # One item per submit() call (a list of events).
+        self._queue = self._mp.Queue(maxsize=self.max_queue)
+        # Exiting must not wait for a lagging child to read what is queued.
+        self._queue.cancel_join_thread()
+        self._conn, child = self._mp.Pipe()
+        self._child = self._mp.Process(target=self._run, args=(child,), name="shadow", daemon=True)
+        self._child.start()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, events: list):
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += len(events)
+
+    def _drain(self) -> list:
+        try:
+            events = list(self._queue.get(timeout=1.0))
+        except queue.Empty:
+            return []
+        while len(events) < self.batch_events:
+            try:
+                events.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _bound(self, table: OrderedDict):
+        while len(table) > self.max_keys:
+            table.popitem(last=False)
+
+    def _score(self, key: str, prev: tuple, reward: float) -> dict:
+        """Credit ``reward`` to the primary's previous decision for ``key``
+        and score each shadow's previous decision against the outcomes;
+        returns ``{shadow: counterfactual reward or ""}``."""
+        p_state, p_port, _, shadow_prev = prev
+        outcome = self._outcomes.setdefault((key, p_state, p_port), [0.0, 0])
+        self._outcomes.move_to_end((key, p_state, p_port))
+        outcome[0] += reward
+        outcome[1] += 1
+        self.realized_sum += reward
+        self.realized += 1
+        scores = {}
+        for shadow in self.shadows:
+            known = self._outcomes.get((key, p_state, shadow_prev[shadow.name][1]))
+            if known is None:
+                scores[shadow.name] = ""
+                continue
+            cf = known[0] / known[1]
+            shadow.scored += 1
+            shadow.counterfactual_sum += cf
+            shadow.primary_scored_sum += reward
+            scores[shadow.name] = cf
+        return scores
+
+    def _learn(self, shadow: Shadow, batch: list, states: list, rewards: list):
+        """Off-policy TD update on the actions the primary actually took."""
+        for (key, candidates, _, _, _, _, _), s_next, r in zip(batch, states, rewards):
+            prev = self._pending.get(key)
+            if prev is None:
+                continue
+            _, p_port, p_candidates, shadow_prev = prev
+            if p_candidates != [int(c) for c in candidates]:
+                # The primary remaps the key and learns nothing from this
+                # transition; the shadows must not either.
+                continue
+            try:
+                shadow.agent.learn(key, shadow_prev[shadow.name][0], p_candidates.index(p_port), r, s_next)
+            except (KeyError, ValueError):
+                # Evicted under the shadow's key limit.
+                pass
+
+    def _process(self, events: list):
+        """One batch, in rounds so a key seen twice learns in order."""
+        rounds = []
+        seen = {}
+        for event in events:
+            n = seen.get(event[0], 0)
+            seen[event[0]] = n + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(event)
+
+        now = time.time()
+        log_rows = []
+        for batch in rounds:
+            scores = []
+            for key, _, _, _, _, _, reward in batch:
+                prev = self._pending.get(key)
+                scores.append(self._score(key, prev, float(reward)) if prev is not None else None)
+            self._bound(self._outcomes)
+
+            decided = [{} for _ in batch]
+            for shadow in self.shadows:
+                loads = [e[2] for e in batch]
+                drops = [e[3] for e in batch]
+                states = shadow.model.get_states(loads, drops)
+                rewards = shadow.model.get_rewards(loads, drops)
+                self._learn(shadow, batch, states, rewards)
+                decisions = shadow.agent.act_batch(
+                    [e[0] for e in batch], [e[1] for e in batch], states, rewards, learn=False
+                )
+                for i, d in enumerate(decisions):
+                    agree = d.out_port == int(batch[i][5])
+                    shadow.decisions += 1
+                    shadow.agreed += agree
+                    shadow.explored += d.explored
+                    decided[i][shadow.name] = (d.state, d.out_port, agree, d.explored)
+
+            for i, (key, candidates, _, _, p_state, p_port, reward) in enumerate(batch):
+                self._pending[key] = (
+                    int(p_state),
+                    int(p_port),
+                    [int(c) for c in candidates],
+                    {name: (s_state, s_port) for name, (s_state, s_port, _, _) in decided[i].items()},
+                )
+                self._pending.move_to_end(key)
+                for name, (s_state, s_port, agree, explored) in decided[i].items():
+                    log_rows.append([
+                        now, name, key, p_state, s_state, p_port, s_port, int(agree), int(explored),
+                        ("" if scores[i] is None else reward),
+                        ("" if scores[i] is None else scores[i][name]),
+                    ])
+            self._bound(self._pending)
+        self.events += len(events)
+        if self.log is not None:
+            self.log.submit(log_rows)
+
+    def _run(self, conn):
+        # Lowest CPU priority: on a busy host the shadows fall behind (and
+        # eventually drop events) instead of delaying the primary.
+        os.nice(19)
+        parent = os.getppid()
+        # A worker killed outright runs no exit handlers; stop with it.
+        while os.getppid() == parent:
+            # Waking up at most every interval_s lets events pile up into
+            # batches for act_batch.
+            time.sleep(self.interval_s)
+            events = self._drain()
+            if events:
+                try:
+                    self._process(events)
+                except Exception as e:
+                    self.failed += len(events)
+                    print(f"[AGENT] shadow evaluation failed: {e}")
+                if self.log is not None:
+                    self.log.flush()
+            while conn.poll():
+                conn.recv()
+                conn.send(self._report())
+
+    def _report(self) -> dict:
+        return {
+            "events": self.events,
+            "failed": self.failed,
+            "primary_reward": (self.realized_sum / self.realized) if self.realized else None,
+            "shadows": {s.name: s.report() for s in self.shadows},
+        }
+
+    def report(self, max_age_s: float = 1.0, timeout_s: float = 5.0) -> dict:
+        """Counters of the child process (reused for ``max_age_s``), plus
+        this process's queue depth and dropped events."""
+        with self._conn_lock:
+            at, report = self._cached
+            if (report is None or time.monotonic() - at > max_age_s) and self._conn is not None:
+                self._conn.send("report")
+                if self._conn.poll(timeout_s):
+                    report = self._conn.recv()
+                    self._cached = (time.monotonic(), report)
+        report = dict(report or {"events": 0, "failed": 0, "primary_reward": None, "shadows": {}})
+        report.update(dropped=self.dropped, queue_depth=self.depth())
+        return report
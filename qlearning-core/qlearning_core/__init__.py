@@ -0,0 +1,21 @@
+"""Q-learning core shared by the Ryu controller and the Q-learning agent."""
+
+from .agent import N_STATES, Decision, QAgent
+from .checkpoint import (
+    CHECKPOINT_VERSION,
+    dump_state,
+    load_checkpoint,
+    load_state,
+    read_checkpoint,
+    save_checkpoint,
+    write_checkpoint,
+)
+from .decision_log import LOG_HEADER, CsvSink, DecisionLog, NullSink, decision_row
+from .embedded import EmbeddedAgent, flow_key
+from .model import QoSModel
+from .replay import ReplayBuffer, ReplayTrainer
+from .shm import SharedArena
+from .spill import SpillStore
+from .tile_coding import TileCoder, key_hash
+
+__version__ = "0.1.0"
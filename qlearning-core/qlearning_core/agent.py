@@ -0,0 +1,1196 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from .shm import SharedArena, seq_begin, seq_end, seq_read
+from .tile_coding import key_hash
+
+N_STATES = 3
+
+
+@dataclass(frozen=True)
+class Decision:
+    key: str
+    state: int
+    action: int
+    out_port: int
+    reward: float | None
+    q_values: list | None
+    epsilon: float
+    step: int
+    explored: bool = False
+
+
+class QAgent:
+    """Tabular Q-learning over many flow keys.
+
+    All tables live in one ``(n_keys, N_STATES, max_actions)`` float32 tensor.
+    Each key owns a row; its candidate ports occupy the first columns of that
+    row and ``_mask`` marks which columns are valid. Rows and columns grow by
+    doubling, so views into ``_q`` must not be kept across calls.
+
+    With ``shared=True`` every per-row array, the counters and the key names
+    live in a :class:`shm.SharedArena` of fixed capacity and ``lock_factory``
+    must hand out process-shared locks. Processes forked afterwards act on
+    the same tables; each only keeps a local cache of the key index.
+    """
+
+    def __init__(
+        self,
+        lr: float = 0.1,
+        gamma: float = 0.9,
+        epsilon: float = 1.0,
+        epsilon_min: float = 0.05,
+        epsilon_decay: float = 0.995,
+        lock_stripes: int = 64,
+        initial_keys: int = 64,
+        initial_actions: int = 4,
+        lock_factory=None,
+        shared: bool = False,
+        max_key_bytes: int = 64,
+        max_keys: int = 0,
+        eviction: str = "lru",
+        spill=None,
+        learner: str = "q",
+        sweep_steps: int = 5,
+        sweep_theta: float = 1e-3,
+        exploration: str = "epsilon",
+        ucb_c: float = 10.0,
+        temperature: float = 10.0,
+        temperature_min: float = 0.1,
+        temperature_decay: float = 0.995,
+        tile_coder=None,
+    ):
+        self.lr = float(lr)
+        self.gamma = float(gamma)
+        self.epsilon_min = float(epsilon_min)
+        self.epsilon_decay = float(epsilon_decay)
+        # "q": one-step Q-learning. "double": Double Q-learning; ``_q`` holds
+        # the mean of the two estimates, which is what acting and every
+        # reader use, and ``_q_b`` the second one. "sweep": Q-learning plus
+        # prioritized sweeping over a learned model of each key's MDP: after
+        # every update, the keys involved get up to ``sweep_steps`` full
+        # backups of the (state, action) entries whose Bellman error exceeds
+        # ``sweep_theta``. "linear": semi-gradient Q-learning of one weight
+        # vector shared by all keys over ``tile_coder`` features of the
+        # continuous metrics each decision passes in; ``_q`` then holds the
+        # latest estimates for each key in each state, so readers of the
+        # tables keep working.
+        if learner not in ("q", "double", "sweep", "linear"):
+            raise ValueError(f"unknown learner {learner!r}")
+        if (learner == "linear") != (tile_coder is not None):
+            raise ValueError("the linear learner, and only it, needs a tile_coder")
+        self.learner = learner
+        self.tile_coder = tile_coder
+        self.sweep_steps = max(0, int(sweep_steps))
+        self.sweep_theta = float(sweep_theta)
+        # How actions are picked. "epsilon": epsilon-greedy with the global
+        # epsilon. "key_epsilon": epsilon-greedy with an epsilon that starts
+        # at ``epsilon`` and decays with the key's own decisions. "ucb": UCB1
+        # over per-(key, state, action) visit counts with exploration weight
+        # ``ucb_c``. "boltzmann": softmax over Q with a per-key temperature
+        # decaying from ``temperature`` to ``temperature_min``.
+        if exploration not in ("epsilon", "key_epsilon", "ucb", "boltzmann"):
+            raise ValueError(f"unknown exploration {exploration!r}")
+        self.exploration = exploration
+        self.epsilon_start = float(epsilon)
+        self.ucb_c = float(ucb_c)
+        self.temperature = float(temperature)
+        self.temperature_min = float(temperature_min)
+        self.temperature_decay = float(temperature_decay)
+
+        # Keys hash onto a fixed set of striped locks so decisions for
+        # different flows never wait on each other; step/epsilon have their
+        # own lock because every decision touches them. Forked workers inherit
+        # the hash seed, so a key maps to the same stripe in every process.
+        # ``lock_factory(name)`` lets the app substitute instrumented or
+        # process-shared locks.
+        make_lock = lock_factory or (lambda name: threading.Lock())
+        self._key_locks = [make_lock("key") for _ in range(max(1, int(lock_stripes)))]
+        self._counter_lock = make_lock("counter")
+        # Guards the key index and any reshaping of the tensor. Lock order is
+        # index lock first, then stripe locks.
+        self._index_lock = make_lock("index")
+        # The linear learner's weights are shared by every key.
+        self._weights_lock = make_lock("weights")
+
+        self.shared = bool(shared)
+        self.max_key_bytes = int(max_key_bytes)
+        # With ``max_keys`` > 0, adding a key beyond it first evicts the least
+        # recently used ("lru") or least visited ("lfu") keys. Evicted tables
+        # go to ``spill`` (a :class:`spill.SpillStore`) when one is given and
+        # are reloaded the next time their key is seen.
+        if eviction not in ("lru", "lfu"):
+            raise ValueError(f"unknown eviction policy {eviction!r}")
+        self.max_keys = max(0, int(max_keys))
+        self.eviction = eviction
+        self.spill = spill
+        specs = self._specs(max(1, int(initial_keys)), max(1, int(initial_actions)))
+        if self.shared:
+            self._arena = SharedArena(specs)
+            self._bind(self._arena.arrays)
+        else:
+            self._arena = None
+            self._bind(self._allocate(specs))
+        self.epsilon = epsilon
+
+        # Optional experience replay: when attached, decisions only enqueue
+        # transitions and learn_batch() applies them off the request path.
+        self.replay = None
+
+        # Process-local view of the key index; in shared mode other workers
+        # append rows too and _sync_keys() catches up from ``_key_names``.
+        # Removed keys leave ``None`` in ``_keys`` until their row is reused.
+        self._index = {}
+        self._keys = []
+        self._epoch = 0
+        # key -> (row generation, ports) last seen by this process.
+        self._actions = {}
+
+    def _specs(self, n_keys: int, n_actions: int) -> dict:
+        specs = {
+            "q": ((n_keys, N_STATES, n_actions), np.float32),
+            "mask": ((n_keys, n_actions), np.bool_),
+            "n_actions": ((n_keys,), np.int32),
+            "ports": ((n_keys, n_actions), np.int32),
+            # Bumped whenever a row's columns are remapped or the row changes
+            # owner, so queued transitions for the old layout can be discarded.
+            "row_gen": ((n_keys,), np.int64),
+            # Seqlock per row: odd while a writer is inside the row.
+            "row_seq": ((n_keys,), np.int64),
+            # Previous (state, action) of each key, -1 when there is none.
+            "last_s": ((n_keys,), np.int16),
+            "last_a": ((n_keys,), np.int32),
+            # time.time() of the key's latest decision.
+            "last_used": ((n_keys,), np.float64),
+            # Decisions made for the key, for least-visited eviction and the
+            # per-key exploration schedules, and per (state, action) for UCB.
+            "visits": ((n_keys,), np.int64),
+            "sa_visits": ((n_keys, N_STATES, n_actions), np.int32),
+            # Rows of removed keys, reused before the tensor grows.
+            "free_rows": ((n_keys,), np.int64),
+            # [step, rows in use or freed, free rows, index epoch, keys
+            # evicted, keys reloaded from spill] and [epsilon]. The epoch
+            # changes whenever a row changes owner, which tells other
+            # processes to rebuild their key index.
+            "counters": ((6,), np.int64),
+            "scalars": ((1,), np.float64),
+        }
+        if self.shared:
+            specs["key_names"] = ((n_keys,), f"S{self.max_key_bytes}")
+        if self.learner == "double":
+            specs["q_b"] = ((n_keys, N_STATES, n_actions), np.float32)
+        if self.learner == "sweep":
+            # Learned model: transition counts per (s, a, s') and reward sums
+            # per (s, a).
+            specs["model_n"] = ((n_keys, N_STATES, n_actions, N_STATES), np.float32)
+            specs["model_r"] = ((n_keys, N_STATES, n_actions), np.float32)
+        if self.learner == "linear":
+            specs["w"] = ((self.tile_coder.n_weights,), np.float64)
+            # Active features of each key's previous decision.
+            specs["last_phi"] = ((n_keys, self.tile_coder.n_active), np.int64)
+        return specs
+
+    @staticmethod
+    def _allocate(specs: dict) -> dict:
+        return {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in specs.items()}
+
+    def _bind(self, arrays: dict):
+        self._arrays = arrays
+        self._q = arrays["q"]
+        self._mask = arrays["mask"]
+        self._n_actions = arrays["n_actions"]
+        self._ports = arrays["ports"]
+        self._row_gen = arrays["row_gen"]
+        self._row_seq = arrays["row_seq"]
+        self._last_s = arrays["last_s"]
+        self._last_a = arrays["last_a"]
+        self._last_used = arrays["last_used"]
+        self._visits = arrays["visits"]
+        self._sa_visits = arrays["sa_visits"]
+        self._free_rows = arrays["free_rows"]
+        self._counters = arrays["counters"]
+        self._scalars = arrays["scalars"]
+        self._key_names = arrays.get("key_names")
+        self._q_b = arrays.get("q_b")
+        self._model_n = arrays.get("model_n")
+        self._model_r = arrays.get("model_r")
+        self._w = arrays.get("w")
+        self._last_phi = arrays.get("last_phi")
+
+    @property
+    def epsilon(self) -> float:
+        return float(self._scalars[0])
+
+    @epsilon.setter
+    def epsilon(self, value: float):
+        self._scalars[0] = float(value)
+
+    @property
+    def _step(self) -> int:
+        return int(self._counters[0])
+
+    def key_lock(self, key: str):
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def __len__(self) -> int:
+        return int(self._counters[1] - self._counters[2])
+
+    @property
+    def evicted(self) -> int:
+        return int(self._counters[4])
+
+    @property
+    def reloaded(self) -> int:
+        return int(self._counters[5])
+
+    @property
+    def capacity(self) -> tuple[int, int]:
+        return int(self._q.shape[0]), int(self._q.shape[2])
+
+    def _grow(self, min_keys: int, min_actions: int):
+        n_keys, n_actions = self.capacity
+        if min_keys <= n_keys and min_actions <= n_actions:
+            return
+        if self.shared:
+            raise RuntimeError(
+                f"shared Q-table full: capacity {self.capacity}, need {min_keys} keys x {min_actions} actions"
+            )
+        while n_keys < min_keys:
+            n_keys *= 2
+        while n_actions < min_actions:
+            n_actions *= 2
+
+        # Every writer holds a stripe lock, so taking all of them freezes the
+        # tensor while it is copied into the larger buffer. Step and epsilon
+        # change under the counter lock alone (taken after stripe locks, as
+        # act_batch does), so it is held too until the copies are bound.
+        for lk in self._key_locks:
+            lk.acquire()
+        self._counter_lock.acquire()
+        try:
+            rows, _, cols = self._q.shape
+            grown = self._allocate(self._specs(n_keys, n_actions))
+            grown["q"][:rows, :, :cols] = self._q
+            grown["mask"][:rows, :cols] = self._mask
+            grown["ports"][:rows, :cols] = self._ports
+            for name in ("n_actions", "row_gen", "row_seq", "last_s", "last_a", "last_used", "visits", "free_rows"):
+                grown[name][:rows] = getattr(self, "_" + name)
+            grown["sa_visits"][:rows, :, :cols] = self._sa_visits
+            if self._q_b is not None:
+                grown["q_b"][:rows, :, :cols] = self._q_b
+            if self._model_n is not None:
+                grown["model_n"][:rows, :, :cols] = self._model_n
+                grown["model_r"][:rows, :, :cols] = self._model_r
+            if self._w is not None:
+                grown["w"][:] = self._w
+                grown["last_phi"][:rows] = self._last_phi
+            grown["counters"][:] = self._counters
+            grown["scalars"][:] = self._scalars
+            self._bind(grown)
+        finally:
+            self._counter_lock.release()
+            for lk in reversed(self._key_locks):
+                lk.release()
+
+    def _set_row(self, row: int, ports: list, q: np.ndarray):
+        """Give ``row`` a new column layout; the caller holds its stripe lock."""
+        n = len(ports)
+        seq_begin(self._row_seq, row)
+        self._q[row] = 0.0
+        self._q[row, :, :n] = q
+        if self._q_b is not None:
+            self._q_b[row] = self._q[row]
+        if self._model_n is not None:
+            self._model_n[row] = 0.0
+            self._model_r[row] = 0.0
+        self._sa_visits[row] = 0
+        self._mask[row] = False
+        self._mask[row, :n] = True
+        self._ports[row] = -1
+        self._ports[row, :n] = ports
+        self._n_actions[row] = n
+        self._last_s[row] = -1
+        self._last_a[row] = -1
+        self._last_used[row] = 0.0
+        self._row_gen[row] += 1
+        seq_end(self._row_seq, row)
+
+    def _remap(self, row: int, new_ports: list):
+        old = self._ports[row, : self._n_actions[row]].astype(np.int64)
+        new = np.asarray(new_ports, dtype=np.int64)
+        match = new[:, None] == old[None, :]
+        keep = match.any(axis=1)
+        src = match.argmax(axis=1)
+
+        remapped = np.zeros((N_STATES, len(new)), dtype=np.float32)
+        remapped[:, keep] = self._q[row, :, src[keep]].T
+        self._set_row(row, new_ports, remapped)
+
+    def _sync_keys(self):
+        """Pick up rows claimed by other processes (shared mode only).
+
+        Appended rows are read incrementally; once a row has been freed or
+        reused anywhere the whole index is rebuilt. Callers hold the index
+        lock unless only appends can have happened.
+        """
+        n = int(self._counters[1])
+        epoch = int(self._counters[3])
+        if epoch != self._epoch:
+            names = [k.decode() for k in self._key_names[:n].tolist()]
+            self._keys = [k or None for k in names]
+            self._index = {k: row for row, k in enumerate(names) if k}
+            self._actions = {}
+            self._epoch = epoch
+            return
+        for row in range(len(self._keys), n):
+            key = self._key_names[row].decode()
+            self._keys.append(key)
+            self._index[key] = row
+
+    def _claim_row(self, n_ports: int) -> int:
+        """Reserve a row for a new key; the caller holds the index lock."""
+        if self._counters[2] > 0:
+            self._grow(0, n_ports)
+            self._counters[2] -= 1
+            self._counters[3] += 1
+            return int(self._free_rows[self._counters[2]])
+        row = int(self._counters[1])
+        self._grow(row + 1, n_ports)
+        return row
+
+    def _row_ports(self, row: int) -> list:
+        return self._ports[row, : self._n_actions[row]].tolist()
+
+    def _ensure_key(self, key: str, action_ports, keep=()) -> int:
+        ports = [int(p) for p in action_ports]
+        if self.shared and self._epoch != self._counters[3]:
+            with self._index_lock:
+                self._sync_keys()
+        row = self._index.get(key)
+        if row is not None:
+            if self.max_keys:
+                # Seen now, so an eviction before this decision lands picks
+                # other keys.
+                self._last_used[row] = time.time()
+            cached = self._actions.get(key)
+            gen = int(self._row_gen[row])
+            if cached is None or cached[0] != gen:
+                # Remapped, restored or handed to another key since we last
+                # looked, maybe by another worker: refresh the local copy.
+                if self.shared and self._key_names[row] != key.encode():
+                    cached = (gen, None)
+                else:
+                    cached = (gen, self._row_ports(row))
+                    self._actions[key] = cached
+            if cached[1] == ports:
+                return row
+
+        with self._index_lock:
+            if self.shared:
+                self._sync_keys()
+            row = self._index.get(key)
+            if row is None:
+                if self.shared and len(key.encode()) > self.max_key_bytes:
+                    raise ValueError(f"flow key longer than {self.max_key_bytes} bytes: {key!r}")
+                spilled = self.spill.pop(key) if self.spill is not None else None
+                try:
+                    if self.max_keys and len(self) >= self.max_keys:
+                        self._evict(len(self) - self.max_keys + max(1, self.max_keys // 64), keep)
+                    row = self._claim_row(max(len(ports), len(spilled[0]) if spilled else 0))
+                except Exception:
+                    # No row for it (a full shared table): keep the spilled
+                    # table for the next try instead of losing it.
+                    if spilled is not None:
+                        self.spill.put_many([(key,) + tuple(spilled)])
+                    raise
+                with self.key_lock(key):
+                    if spilled is None:
+                        self._set_row(row, ports, 0.0)
+                        self._visits[row] = 0
+                    else:
+                        self._set_row(row, spilled[0], spilled[1])
+                        self._visits[row] = spilled[2]
+                        if spilled[0] != ports:
+                            self._remap(row, ports)
+                        self._counters[5] += 1
+                    self._last_used[row] = time.time()
+                    if self.shared:
+                        self._key_names[row] = key.encode()
+                    if row < len(self._keys):
+                        self._keys[row] = key
+                    else:
+                        self._keys.append(key)
+                    self._index[key] = row
+                    self._counters[1] = max(int(self._counters[1]), row + 1)
+                    if self.shared:
+                        self._epoch = int(self._counters[3])
+            elif self._row_ports(row) != ports:
+                self._grow(0, len(ports))
+                with self.key_lock(key):
+                    self._remap(row, ports)
+            self._actions[key] = (int(self._row_gen[row]), ports)
+            return row
+
+    def row(self, key: str) -> int | None:
+        if self.shared:
+            with self._index_lock:
+                self._sync_keys()
+        return self._index.get(key)
+
+    def keys(self) -> list:
+        if self.shared:
+            with self._index_lock:
+                self._sync_keys()
+        return [k for k in self._keys[: int(self._counters[1])] if k is not None]
+
+    def remove_keys(self, keys) -> int:
+        """Drop the tables of ``keys``; returns how many existed.
+
+        Freed rows get a new generation, so queued replay transitions for
+        them are discarded, and are handed to the next new keys.
+        """
+        with self._index_lock:
+            if self.shared:
+                self._sync_keys()
+            return self._drop(keys)
+
+    def _drop(self, keys, spilled: list | None = None) -> int:
+        """Free the rows of ``keys``, appending ``(key, ports, q, visits)``
+        of each to ``spilled`` if given; the caller holds the index lock."""
+        removed = 0
+        for key in keys:
+            row = self._index.pop(key, None)
+            if row is None:
+                continue
+            with self.key_lock(key):
+                if spilled is not None:
+                    n = int(self._n_actions[row])
+                    spilled.append((key, self._row_ports(row), self._q[row, :, :n].copy(), int(self._visits[row])))
+                self._set_row(row, [], 0.0)
+                if self.shared:
+                    self._key_names[row] = b""
+            self._keys[row] = None
+            self._actions.pop(key, None)
+            self._free_rows[self._counters[2]] = row
+            self._counters[2] += 1
+            removed += 1
+        if removed:
+            self._counters[3] += 1
+            self._epoch = int(self._counters[3])
+        return removed
+
+    def _evict(self, count: int, keep=()):
+        """Drop ``count`` keys other than the rows in ``keep``, least recently
+        used (or least visited, then least recently used) first, spilling
+        their tables if a spill store is set; the caller holds the index lock
+        and has synced the key index."""
+        n = int(self._counters[1])
+        rows = np.flatnonzero(self._n_actions[:n] > 0)
+        if len(keep):
+            rows = rows[~np.isin(rows, list(keep))]
+        count = min(int(count), len(rows))
+        if count <= 0:
+            return
+        if self.eviction == "lfu":
+            # Keys seen within the last second have had no chance to collect
+            # visits yet; leave them alone unless nothing else is left.
+            order = np.lexsort((self._last_used[rows], self._visits[rows]))
+            fresh = self._last_used[rows[order]] >= time.time() - 1.0
+            victims = rows[np.concatenate([order[~fresh], order[fresh]])[:count]]
+        elif count < len(rows):
+            victims = rows[np.argpartition(self._last_used[rows], count - 1)[:count]]
+        else:
+            victims = rows
+        keys = [self._keys[r] for r in victims.tolist() if self._keys[r] is not None]
+        spilled = [] if self.spill is not None else None
+        self._counters[4] += self._drop(keys, spilled)
+        if spilled:
+            self.spill.put_many(spilled)
+
+    def merge_state(self, state: dict) -> int:
+        """Insert or overwrite the keys in ``state`` (an :meth:`export_state`
+        dict); other keys, step, epsilon and the linear learner's shared
+        weights are left alone."""
+        keys = [str(k) for k in state["keys"]]
+        q = np.asarray(state["q"], dtype=np.float32)
+        ports = np.asarray(state["ports"], dtype=np.int64)
+        n_actions = np.asarray(state["n_actions"], dtype=np.int64)
+        for i, key in enumerate(keys):
+            m = int(n_actions[i])
+            row = self._ensure_key(key, ports[i, :m].tolist())
+            with self.key_lock(key):
+                seq_begin(self._row_seq, row)
+                self._q[row, :, :m] = q[i, :, :m]
+                if self._q_b is not None:
+                    self._q_b[row, :, :m] = q[i, :, :m]
+                if "visits" in state:
+                    self._visits[row] = state["visits"][i]
+                    self._sa_visits[row, :, :m] = state["sa_visits"][i, :, :m]
+                seq_end(self._row_seq, row)
+        return len(keys)
+
+    def q_table(self, key: str) -> np.ndarray:
+        """View of the ``(N_STATES, n_actions)`` table of ``key``."""
+        row = self._index[key]
+        return self._q[row, :, : self._n_actions[row]]
+
+    def _decay_epsilon(self, n: int = 1):
+        with self._counter_lock:
+            eps = float(self._scalars[0])
+            for _ in range(int(n)):
+                if eps <= self.epsilon_min:
+                    break
+                eps *= self.epsilon_decay
+            self._scalars[0] = eps
+
+    def _next_step(self, n: int = 1) -> tuple[int, float]:
+        """Reserve ``n`` consecutive steps; returns the last one and epsilon."""
+        with self._counter_lock:
+            self._counters[0] += int(n)
+            return int(self._counters[0]), float(self._scalars[0])
+
+    def choose_action(self, key: str, state: int) -> int:
+        return self._choose(self._index[key], state)[0]
+
+    def _choose(self, row: int, state: int) -> tuple[int, bool, float | None]:
+        """(action, whether it differs from the greedy one, per-key epsilon
+        or None) for one row."""
+        if self.exploration != "epsilon":
+            chosen, explored, eps = self._select(np.array([row]), np.array([state]))
+            return int(chosen[0]), bool(explored[0]), (None if eps is None else float(eps[0]))
+        n = int(self._n_actions[row])
+        greedy = int(np.argmax(self._q[row, state, :n]))
+        if np.random.random() < self.epsilon:
+            action = int(np.random.randint(0, n))
+            return action, action != greedy, None
+        return greedy, False, None
+
+    def _select(self, rows, states) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+        """Vectorized action choice for distinct ``rows``: (actions, explored
+        flags, per-key epsilons or None)."""
+        mask = self._mask[rows]
+        n_act = self._n_actions[rows]
+        q_now = np.where(mask, self._q[rows, states], -np.inf)
+        greedy = q_now.argmax(axis=1)
+        eps = None
+        if self.exploration == "ucb":
+            n_sa = self._sa_visits[rows, states].astype(np.float64)
+            n_s = np.maximum(n_sa.sum(axis=1, keepdims=True), 1.0)
+            # Untried actions have an infinite bonus, so each is tried once.
+            bonus = np.where(n_sa > 0, self.ucb_c * np.sqrt(np.log(n_s) / np.maximum(n_sa, 1.0)), np.inf)
+            chosen = np.where(mask, self._q[rows, states] + bonus, -np.inf).argmax(axis=1)
+        elif self.exploration == "boltzmann":
+            temp = np.maximum(
+                self.temperature * self.temperature_decay ** self._visits[rows].astype(np.float64),
+                self.temperature_min,
+            )
+            weights = np.exp((q_now - q_now.max(axis=1, keepdims=True)) / temp[:, None])
+            cdf = weights.cumsum(axis=1)
+            u = np.random.random(len(rows))[:, None] * cdf[:, -1:]
+            chosen = np.minimum((u > cdf).sum(axis=1), n_act - 1)
+        else:
+            if self.exploration == "key_epsilon":
+                eps = np.maximum(
+                    self.epsilon_start * self.epsilon_decay ** self._visits[rows].astype(np.float64),
+                    self.epsilon_min,
+                )
+            else:
+                eps = np.full(len(rows), self.epsilon)
+            explore = np.random.random(len(rows)) < eps
+            randomized = (np.random.random(len(rows)) * n_act).astype(np.int64)
+            chosen = np.where(explore, randomized, greedy)
+            if self.exploration == "epsilon":
+                eps = None
+        return chosen, chosen != greedy, eps
+
+    def learn(self, key: str, s: int, a: int, r: float, s_next: int):
+        if self.learner == "linear":
+            raise ValueError("the linear learner only learns from decisions with features")
+        row = self._index[key]
+        if self.learner != "q":
+            self._apply_td(np.array([row]), np.array([s]), np.array([a]), np.array([float(r)]), np.array([s_next]))
+            self._decay_epsilon()
+            return
+        n = int(self._n_actions[row])
+        predict = float(self._q[row, s, a])
+        target = float(r) + self.gamma * float(np.max(self._q[row, s_next, :n]))
+        seq_begin(self._row_seq, row)
+        self._q[row, s, a] = predict + self.lr * (target - predict)
+        seq_end(self._row_seq, row)
+
+        self._decay_epsilon()
+
+    def learn_batch(self, rows, gens, s, a, r, s_next) -> int:
+        """Minibatch TD update over tensor rows; returns the number applied.
+
+        Transitions recorded against an older row generation are skipped.
+        Repeated (row, s, a) entries in one batch share the mean of their TD
+        steps instead of compounding them. The stripe locks of the rows'
+        keys are held across the generation check and the update, so a
+        decision remapping one of them waits for the step.
+        """
+        if self.learner == "linear":
+            raise ValueError("the linear learner only learns from decisions with features")
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return 0
+        with self._index_lock:
+            if self.shared:
+                self._sync_keys()
+            # Rows only change hands under the index lock, so their keys
+            # (and stripes) hold until it is released.
+            keys = [self._keys[row] if row < len(self._keys) else None for row in np.unique(rows).tolist()]
+            locks = [self._key_locks[i] for i in sorted({hash(k) % len(self._key_locks) for k in keys if k})]
+            for lk in locks:
+                lk.acquire()
+            try:
+                live = np.asarray(gens, dtype=np.int64) == self._row_gen[rows]
+                if not live.any():
+                    return 0
+                self._apply_td(
+                    rows[live],
+                    np.asarray(s, dtype=np.int64)[live],
+                    np.asarray(a, dtype=np.int64)[live],
+                    np.asarray(r, dtype=np.float64)[live],
+                    np.asarray(s_next, dtype=np.int64)[live],
+                )
+                return int(live.sum())
+            finally:
+                for lk in reversed(locks):
+                    lk.release()
+
+    def _mean_steps(self, rows, s, a, delta) -> tuple[np.ndarray, np.ndarray]:
+        """Flat ``_q`` indices of the distinct (row, s, a) entries and the
+        mean of their steps in ``delta``."""
+        flat = np.ravel_multi_index((rows, s, a), self._q.shape)
+        uniq, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        return uniq, (np.bincount(inverse, weights=delta) / counts).astype(np.float32)
+
+    def _apply_td(self, rows, s, a, r, s_next):
+        if self.learner == "double":
+            self._apply_double_td(rows, s, a, r, s_next)
+            return
+        q_next = np.where(self._mask[rows], self._q[rows, s_next], -np.inf).max(axis=1)
+        target = r + self.gamma * q_next
+        delta = self.lr * (target - self._q[rows, s, a])
+
+        uniq, step = self._mean_steps(rows, s, a, delta)
+        touched = np.unique(rows)
+        seq_begin(self._row_seq, touched)
+        self._q.reshape(-1)[uniq] += step
+        if self.learner == "sweep":
+            np.add.at(self._model_n, (rows, s, a, s_next), 1.0)
+            np.add.at(self._model_r, (rows, s, a), r)
+            self._sweep(touched)
+        seq_end(self._row_seq, touched)
+
+    def _apply_double_td(self, rows, s, a, r, s_next):
+        """Double Q-learning: each transition updates one estimate, picked at
+        random, towards the other's value of the updated estimate's greedy
+        next action. ``_q`` (the mean) moves by half of each step."""
+        n = np.arange(len(rows))
+        update_a = np.random.random(len(rows)) < 0.5
+        qb_next = self._q_b[rows, s_next]
+        qa_next = 2.0 * self._q[rows, s_next] - qb_next
+        own = np.where(update_a[:, None], qa_next, qb_next)
+        other = np.where(update_a[:, None], qb_next, qa_next)
+        best = np.where(self._mask[rows], own, -np.inf).argmax(axis=1)
+        target = r + self.gamma * other[n, best]
+        qb_sa = self._q_b[rows, s, a]
+        delta = self.lr * (target - np.where(update_a, 2.0 * self._q[rows, s, a] - qb_sa, qb_sa))
+
+        touched = np.unique(rows)
+        seq_begin(self._row_seq, touched)
+        for side, is_b in ((update_a, False), (~update_a, True)):
+            if not side.any():
+                continue
+            uniq, step = self._mean_steps(rows[side], s[side], a[side], delta[side])
+            self._q.reshape(-1)[uniq] += 0.5 * step
+            if is_b:
+                self._q_b.reshape(-1)[uniq] += step
+        seq_end(self._row_seq, touched)
+
+    def _phi(self, keys, features, width: int) -> np.ndarray:
+        """Active weight indices ``(len(keys), width, n_active)`` of each
+        key's candidates; ``features[i]`` has one row of continuous inputs
+        per candidate of ``keys[i]`` (a 3-d array when all have as many
+        candidates). Padding columns index weight 0 and
+        are masked by every reader."""
+        counts = np.fromiter((len(f) for f in features), dtype=np.int64, count=len(features))
+        x = np.concatenate(features).astype(np.float64, copy=False)
+        slots = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        hashes = np.repeat(np.fromiter((key_hash(k) for k in keys), dtype=np.int64, count=len(keys)), counts)
+        phi = np.zeros((len(keys), width, self.tile_coder.n_active), dtype=np.int64)
+        phi[np.repeat(np.arange(len(keys)), counts), slots] = self.tile_coder.active(x, slots, hashes)
+        return phi
+
+    def _linear_values(self, rows, states, phi) -> np.ndarray:
+        """Estimates of every candidate of distinct ``rows`` from their
+        features ``phi``, also stored in ``_q`` at ``states``."""
+        q = np.where(self._mask[rows], self._w[phi].sum(axis=2), 0.0).astype(np.float32)
+        seq_begin(self._row_seq, rows)
+        self._q[rows, states] = q
+        seq_end(self._row_seq, rows)
+        return q
+
+    def _apply_linear_td(self, rows, r, q_next):
+        """Semi-gradient Q-learning step on the shared weights: the previous
+        decision of each row (its features in ``_last_phi``) moves towards
+        ``r + gamma * q_next``. All TD errors of a batch are taken against
+        the same weights and their gradients summed."""
+        phi = self._last_phi[rows]
+        with self._weights_lock:
+            delta = r + self.gamma * q_next - self._w[phi].sum(axis=1)
+            step = np.repeat(self.lr / phi.shape[1] * delta, phi.shape[1])
+            np.add.at(self._w, phi.ravel(), step)
+
+    def _sweep(self, rows):
+        """Prioritized sweeping over the learned models of ``rows`` (unique).
+
+        Each pass backs up, from the model, every visited (s, a) whose
+        Bellman error exceeds ``sweep_theta``; passes stop early once none
+        does. A key's model has only N_STATES x n_actions entries, so all its
+        predecessors are rechecked every pass instead of being queued.
+        """
+        counts = self._model_n[rows]
+        n_sa = counts.sum(axis=3)
+        seen = n_sa > 0
+        p = counts / np.maximum(n_sa, 1.0)[..., None]
+        r_hat = self._model_r[rows] / np.maximum(n_sa, 1.0)
+        valid = self._mask[rows][:, None, :]
+        q = self._q[rows]
+        for _ in range(self.sweep_steps):
+            v = np.where(valid, q, -np.inf).max(axis=2)
+            backup = r_hat + self.gamma * np.einsum("ksat,kt->ksa", p, v)
+            hot = seen & (np.abs(backup - q) > self.sweep_theta)
+            if not hot.any():
+                break
+            q = np.where(hot, backup, q).astype(np.float32)
+        self._q[rows] = q
+
+    def active_rows(self, since: float) -> tuple[np.ndarray, np.ndarray, list]:
+        """Rows, their generations and keys with a decision at or after ``since``."""
+        if self.shared:
+            with self._index_lock:
+                self._sync_keys()
+        n = int(self._counters[1])
+        rows = np.flatnonzero((self._last_used[:n] >= since) & (self._last_s[:n] >= 0))
+        keys = [self._keys[r] for r in rows.tolist()]
+        keep = [i for i, k in enumerate(keys) if k is not None]
+        rows = rows[keep]
+        return rows, self._row_gen[rows].copy(), [keys[i] for i in keep]
+
+    def learn_tick(self, rows, gens, s_next, r) -> int:
+        """One TD step per row for the interval that just ended.
+
+        Each row's (last state, action in effect) is credited with ``r`` and
+        moved to ``s_next``, which becomes the start state of the next
+        interval. Rows remapped or reassigned since ``gens`` was read are
+        skipped. Epsilon decays once per tick. Decisions wait only for the
+        vectorized update itself.
+        """
+        if self.learner == "linear":
+            raise ValueError("the linear learner only learns from decisions with features")
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return 0
+        s_next = np.asarray(s_next, dtype=np.int64)
+        r = np.asarray(r, dtype=np.float64)
+        with self._index_lock:
+            for lk in self._key_locks:
+                lk.acquire()
+            try:
+                s = self._last_s[rows].astype(np.int64)
+                live = (s >= 0) & (np.asarray(gens, dtype=np.int64) == self._row_gen[rows])
+                rows, s, s_next, r = rows[live], s[live], s_next[live], r[live]
+                self._apply_td(rows, s, self._last_a[rows].astype(np.int64), r, s_next)
+                self._last_s[rows] = s_next
+            finally:
+                for lk in reversed(self._key_locks):
+                    lk.release()
+        self._decay_epsilon()
+        return int(len(rows))
+
+    def _owns(self, key: str, row: int) -> bool:
+        if self.shared:
+            return self._key_names[row] == key.encode()
+        return self._index.get(key) == row
+
+    def _holds(self, key: str, row: int, ports: list) -> bool:
+        """Whether ``row`` still belongs to ``key`` with ``ports`` as its
+        columns; the caller holds the key's stripe lock.
+
+        Another caller may have remapped the row to its own candidates
+        between ``_ensure_key`` and the lock; the row is then remapped back
+        in place when the columns fit, and reported lost otherwise.
+        """
+        if not self._owns(key, row):
+            return False
+        if self._row_ports(row) != ports:
+            if len(ports) > self._q.shape[2]:
+                return False
+            self._remap(row, ports)
+            self._actions[key] = (int(self._row_gen[row]), ports)
+        return True
+
+    def _lock_rows(self, keys, candidates, attempts: int = 3) -> tuple[np.ndarray, list]:
+        """Rows of ``keys`` with their stripe locks held (in stripe order).
+
+        Rows found earlier in the same call are never evicted to make room
+        for later keys, but another thread can still evict a key between
+        finding its row and locking it (the lookup is then retried, up to
+        ``attempts`` times) or remap it to other candidates (see
+        :meth:`_holds`).
+        """
+        ports = [[int(p) for p in c] for c in candidates]
+        for _ in range(attempts):
+            ensured = []
+            for k, c in zip(keys, ports):
+                ensured.append(self._ensure_key(k, c, keep=ensured))
+            rows = np.array(ensured, dtype=np.int64)
+            locks = [self._key_locks[i] for i in sorted({hash(k) % len(self._key_locks) for k in keys})]
+            for lk in locks:
+                lk.acquire()
+            if all(self._holds(k, r, c) for k, r, c in zip(keys, rows.tolist(), ports)):
+                return rows, locks
+            for lk in reversed(locks):
+                lk.release()
+        raise RuntimeError("flow keys evicted while being decided; raise the key limit")
+
+    def act(self, key: str, candidates, state: int, reward: float, learn: bool = True, features=None) -> Decision:
+        """Choose an action for ``key`` and learn from its previous decision.
+
+        ``reward`` is credited to the previous (state, action) of the key, if
+        any. Only the key's stripe lock is held, so flows hashing onto other
+        stripes proceed concurrently. With ``learn=False`` the decision only
+        records the (state, action) now in effect, for :meth:`learn_tick`.
+        The linear learner needs ``features``: one row of continuous inputs
+        for the tile coder per candidate.
+        """
+        if self.learner == "linear" and (features is None or len(features) != len(candidates)):
+            raise ValueError("the linear learner needs one feature row per candidate")
+        ports = [int(p) for p in candidates]
+        for _ in range(3):
+            row = self._ensure_key(key, ports)
+            lock = self.key_lock(key)
+            lock.acquire()
+            if self._holds(key, row, ports):
+                break
+            lock.release()
+        else:
+            raise RuntimeError(f"flow key {key!r} evicted while being decided; raise the key limit")
+
+        learned = None
+        try:
+            if self.learner == "linear":
+                # One key: no padding, and its active features are distinct,
+                # so plain fancy indexing replaces the batch path's add.at.
+                n = len(candidates)
+                phi = self.tile_coder.active(features, np.arange(n), np.full(n, key_hash(key)))
+                q_lin = self._w[phi].sum(axis=1)
+                seq_begin(self._row_seq, row)
+                self._q[row, state, :n] = q_lin
+                seq_end(self._row_seq, row)
+            action_idx, explored, key_eps = self._choose(row, state)
+            out_port = int(self._ports[row, action_idx])
+
+            s_prev = int(self._last_s[row])
+            if learn and s_prev >= 0:
+                a_prev = int(self._last_a[row])
+                if self.learner == "linear":
+                    prev = self._last_phi[row]
+                    with self._weights_lock:
+                        delta = float(reward) + self.gamma * float(q_lin.max()) - float(self._w[prev].sum())
+                        self._w[prev] += self.lr / len(prev) * delta
+                    self._decay_epsilon()
+                elif self.replay is not None:
+                    self.replay.push(row, self._row_gen[row], s_prev, a_prev, reward, state)
+                    self._decay_epsilon()
+                else:
+                    self.learn(key, s=s_prev, a=a_prev, r=reward, s_next=state)
+                learned = float(reward)
+
+            self._last_s[row] = state
+            self._last_a[row] = action_idx
+            if self.learner == "linear":
+                self._last_phi[row] = phi[action_idx]
+            self._last_used[row] = time.time()
+            self._visits[row] += 1
+            self._sa_visits[row, state, action_idx] += 1
+
+            try:
+                q_snapshot = self.q_table(key)[state].tolist()
+            except Exception:
+                q_snapshot = None
+        finally:
+            lock.release()
+
+        step, eps = self._next_step()
+        return Decision(
+            key=key,
+            state=int(state),
+            action=action_idx,
+            out_port=out_port,
+            reward=learned,
+            q_values=q_snapshot,
+            epsilon=float(eps if key_eps is None else key_eps),
+            step=step,
+            explored=explored,
+        )
+
+    def act_batch(self, keys, candidates, states, rewards, learn: bool = True, features=None) -> list[Decision]:
+        """Vectorized :meth:`act` over many keys.
+
+        Items are processed in rounds so that a key appearing several times is
+        decided in order, each occurrence learning from the previous one just
+        like consecutive ``act`` calls. Within a round every key is distinct
+        and selection plus TD update run as array operations. Rows are found
+        and locked per round, so an occurrence with other candidates than the
+        previous one remaps the row (and skips learning) as ``act`` would.
+        """
+        n_items = len(keys)
+        if n_items == 0:
+            return []
+        if self.learner == "linear" and (
+            features is None or any(len(f) != len(c) for f, c in zip(features, candidates))
+        ):
+            raise ValueError("the linear learner needs one feature row per candidate")
+        states = np.asarray(states, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.float64)
+
+        seen = {}
+        occurrence = np.empty(n_items, dtype=np.int64)
+        for i, k in enumerate(keys):
+            occurrence[i] = seen.get(k, 0)
+            seen[k] = occurrence[i] + 1
+
+        actions = np.empty(n_items, dtype=np.int64)
+        out_ports = np.empty(n_items, dtype=np.int64)
+        learned = np.zeros(n_items, dtype=bool)
+        explored = np.zeros(n_items, dtype=bool)
+        epsilons = np.empty(n_items, dtype=np.float64)
+        q_values = [None] * n_items
+
+        for rnd in range(int(occurrence.max()) + 1):
+            idx = np.flatnonzero(occurrence == rnd)
+            r_rows, locks = self._lock_rows([keys[i] for i in idx], [candidates[i] for i in idx])
+            try:
+                r_states = states[idx]
+                n_act = self._n_actions[r_rows]
+                if self.learner == "linear":
+                    phi = self._phi([keys[i] for i in idx], [features[i] for i in idx], self._q.shape[2])
+                    q_lin = self._linear_values(r_rows, r_states, phi)
+                chosen, explored[idx], key_eps = self._select(r_rows, r_states)
+
+                s_prev = self._last_s[r_rows].astype(np.int64)
+                has_prev = (s_prev >= 0) & learn
+                if has_prev.any():
+                    p_rows = r_rows[has_prev]
+                    s_prev = s_prev[has_prev]
+                    a_prev = self._last_a[p_rows].astype(np.int64)
+                    if self.learner == "linear":
+                        q_next = np.where(self._mask[p_rows], q_lin[has_prev], -np.inf).max(axis=1)
+                        self._apply_linear_td(p_rows, rewards[idx][has_prev], q_next)
+                    elif self.replay is not None:
+                        self.replay.push_many(
+                            p_rows,
+                            self._row_gen[p_rows],
+                            s_prev,
+                            a_prev,
+                            rewards[idx][has_prev],
+                            r_states[has_prev],
+                        )
+                    else:
+                        self._apply_td(p_rows, s_prev, a_prev, rewards[idx][has_prev], r_states[has_prev])
+                    learned[idx[has_prev]] = True
+                    self._decay_epsilon(int(has_prev.sum()))
+
+                self._last_s[r_rows] = r_states
+                self._last_a[r_rows] = chosen
+                if self.learner == "linear":
+                    self._last_phi[r_rows] = phi[np.arange(len(idx)), chosen]
+                self._last_used[r_rows] = time.time()
+                self._visits[r_rows] += 1
+                self._sa_visits[r_rows, r_states, chosen] += 1
+                epsilons[idx] = self.epsilon if key_eps is None else key_eps
+                actions[idx] = chosen
+                out_ports[idx] = self._ports[r_rows, chosen]
+                for j, i in enumerate(idx):
+                    q_values[i] = self._q[r_rows[j], r_states[j], : n_act[j]].tolist()
+            finally:
+                for lk in reversed(locks):
+                    lk.release()
+
+        last_step, _ = self._next_step(n_items)
+        first_step = last_step - n_items + 1
+        return [
+            Decision(
+                key=key,
+                state=int(states[i]),
+                action=int(actions[i]),
+                out_port=int(out_ports[i]),
+                reward=(float(rewards[i]) if learned[i] else None),
+                q_values=q_values[i],
+                epsilon=float(epsilons[i]),
+                step=first_step + i,
+                explored=bool(explored[i]),
+            )
+            for i, key in enumerate(keys)
+        ]
+
+    def _read_rows(self, only=None, extra=()) -> tuple:
+        """Untorn copy of every live row, or of the keys in ``only`` (in that
+        order), read through the seqlocks without taking the stripe locks:
+        ``(keys, q, n_actions, ports, *extra arrays)``."""
+        if self.shared:
+            with self._index_lock:
+                self._sync_keys()
+        arrays = [self._q, self._n_actions, self._ports] + [getattr(self, "_" + name) for name in extra]
+        if only is not None:
+            index = self._index
+            keys = [k for k in only if k in index]
+            rows = np.fromiter((index[k] for k in keys), dtype=np.int64, count=len(keys))
+            return (keys, *seq_read(self._row_seq, arrays, rows))
+        keys = self._keys[: int(self._counters[1])]
+        copies = seq_read(self._row_seq, arrays, len(keys))
+        live = [i for i, k in enumerate(keys) if k is not None]
+        if len(live) != len(keys):
+            keys = [keys[i] for i in live]
+            copies = [c[live] for c in copies]
+        return (keys, *copies)
+
+    def export_state(self, keys=None) -> dict:
+        """Copy of all tables (or those of ``keys``) as flat arrays, suitable
+        for ``np.savez``."""
+        keys, q, n_actions, ports, visits, sa_visits = self._read_rows(keys, extra=("visits", "sa_visits"))
+        state = {
+            "keys": np.array(keys, dtype=str),
+            "ports": ports,
+            "n_actions": n_actions,
+            "q": q,
+            "visits": visits,
+            "sa_visits": sa_visits,
+            "step": np.int64(self._step),
+            "epsilon": np.float64(self.epsilon),
+        }
+        if self._w is not None:
+            with self._weights_lock:
+                state["w"] = self._w.copy()
+        return state
+
+    def import_state(self, state: dict):
+        """Replace all tables with arrays produced by :meth:`export_state`."""
+        keys = [str(k) for k in state["keys"]]
+        q = np.asarray(state["q"], dtype=np.float32)
+        ports = np.asarray(state["ports"], dtype=np.int32)
+        n_actions = np.asarray(state["n_actions"], dtype=np.int32)
+        n = len(keys)
+        width = q.shape[2] if n else 1
+        if self._w is not None and "w" in state and np.shape(state["w"]) != self._w.shape:
+            raise ValueError(f"checkpoint weights have shape {np.shape(state['w'])}, the tile coder {self._w.shape}")
+
+        with self._index_lock:
+            self._grow(max(n, 1), width)
+            if self.shared and n and max(len(k.encode()) for k in keys) > self.max_key_bytes:
+                raise ValueError(f"checkpoint has flow keys longer than {self.max_key_bytes} bytes")
+            for lk in self._key_locks:
+                lk.acquire()
+            try:
+                rows = np.arange(self.capacity[0])
+                seq_begin(self._row_seq, rows)
+                self._q[:] = 0.0
+                self._q[:n, :, :width] = q
+                if self._q_b is not None:
+                    self._q_b[:] = self._q
+                if self._model_n is not None:
+                    self._model_n[:] = 0.0
+                    self._model_r[:] = 0.0
+                if self._w is not None:
+                    self._w[:] = state["w"] if "w" in state else 0.0
+                self._mask[:] = False
+                self._mask[:n, :width] = ports >= 0
+                self._ports[:] = -1
+                self._ports[:n, :width] = ports
+                self._n_actions[:] = 0
+                self._n_actions[:n] = n_actions
+                self._last_s[:] = -1
+                self._last_a[:] = -1
+                self._last_used[:] = 0.0
+                # Visit counts drive eviction and the per-key exploration
+                # schedules; checkpoints without them start from zero.
+                self._visits[:] = 0
+                self._sa_visits[:] = 0
+                if n and "visits" in state:
+                    self._visits[:n] = state["visits"]
+                    self._sa_visits[:n, :, :width] = state["sa_visits"]
+                self._row_gen += 1
+                if self.shared:
+                    self._key_names[:] = b""
+                    self._key_names[:n] = [k.encode() for k in keys]
+                seq_end(self._row_seq, rows)
+                self._keys = keys
+                self._index = dict(zip(keys, range(n)))
+                self._actions = {}
+                with self._counter_lock:
+                    self._counters[0] = int(state["step"])
+                    self._counters[1] = n
+                    self._counters[2] = 0
+                    self._counters[3] += 1
+                    self._epoch = int(self._counters[3])
+                    self._scalars[0] = float(state["epsilon"])
+            finally:
+                for lk in reversed(self._key_locks):
+                    lk.release()
+
+    def snapshot(self, keys=None) -> tuple[dict, int, float]:
+        """Lock-free read of all tables (or those of ``keys``, in that order)
+        as ``{key: (actions, q)}``, step, epsilon."""
+        keys, q, n_actions, ports = self._read_rows(keys)
+        tables = {
+            k: (tuple(ports[i, :m].tolist()), q[i, :, :m])
+            for i, (k, m) in enumerate(zip(keys, n_actions.tolist()))
+        }
+        return tables, self._step, self.epsilon
+
+    def greedy_policy(self, keys=None) -> tuple[list, np.ndarray]:
+        """Lock-free read of the greedy out_port of every key (or of ``keys``)
+        in every state: ``(keys, ports)`` with ``ports`` shaped
+        ``(len(keys), N_STATES)``. Ties go to the first candidate, as in
+        :meth:`choose_action`."""
+        keys, q, n_actions, ports = self._read_rows(keys)
+        valid = np.arange(q.shape[2]) < n_actions[:, None]
+        best = np.where(valid[:, None, :], q, -np.inf).argmax(axis=2)
+        greedy = np.take_along_axis(ports, best, axis=1)
+        greedy[n_actions == 0] = -1
+        return keys, greedy
+
+    def greedy_ports(self, keys, states, candidates) -> list:
+        """Greedy out_port of each ``(key, state)`` without taking any lock,
+        or None where the key has no table in this process's index or was
+        built for other candidates. Nothing is learned or counted; this
+        answers requests the agent has no capacity to decide."""
+        found = []
+        for i, key in enumerate(keys):
+            row = self._index.get(key)
+            if row is not None and self._owns(key, row):
+                found.append((i, row))
+        out = [None] * len(keys)
+        if not found:
+            return out
+        q, n_actions, ports = seq_read(
+            self._row_seq, [self._q, self._n_actions, self._ports], np.array([row for _, row in found])
+        )
+        for j, (i, _) in enumerate(found):
+            m = int(n_actions[j])
+            if m == 0 or ports[j, :m].tolist() != [int(c) for c in candidates[i]]:
+                continue
+            out[i] = int(ports[j, int(np.argmax(q[j, int(states[i]), :m]))])
+        return out
+
+    def nbytes(self) -> int:
+        return int(sum(arr.nbytes for arr in self._arrays.values()))
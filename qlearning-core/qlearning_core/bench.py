@@ -0,0 +1,230 @@
+"""Decision-path benchmark of the embedded and the service deployment.
+
+``embedded`` decides in-process through :class:`EmbeddedAgent`, as the
+controller does with ``QLEARNING_EMBEDDED=1``: one ``decide`` per packet-in
+(``--batch 1``) or ``decide_batch`` over ``--batch`` flows. ``--logs``
+picks the decision log: ``buffered`` (a :class:`DecisionLog` whose thread
+appends to a CSV file), ``sync`` (one CSV append per call on the decision
+path, as the controller's former agent reopened its log for every update)
+or ``none``.
+
+``service`` sends the same decisions to a running agent at ``--url``:
+``/act`` one request at a time, as the controller's hub thread does, or
+``/act_batch`` with ``--batch`` flows, over one keep-alive connection. The
+agent's own decision log is whatever it is configured with.
+
+``--dpids`` switches with ``--prefixes`` destination prefixes each and
+``--candidates`` ports per flow are decided at random. Switch loads and
+drops are redrawn every ``--refresh`` decisions (and pushed with
+``/observe`` for the service, untimed). Each run reports the time per
+decision and the p50 / p99 time per call.
+
+    python -m qlearning_core.bench --batch 1,64 --logs buffered,sync,none
+    python -m qlearning_core.bench --deployments embedded,service --url http://localhost:5000
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .decision_log import LOG_HEADER, CsvSink, DecisionLog
+from .embedded import EmbeddedAgent
+
+FIELDS = [
+    "deployment",
+    "batch",
+    "log",
+    "decisions",
+    "us_per_decision",
+    "p50_us",
+    "p99_us",
+]
+
+
+class _SyncLog:
+    """Writes each submission on the calling thread."""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def submit(self, rows: list):
+        self.sink.write(rows)
+
+
+class Workload:
+    def __init__(self, args):
+        self.rng = np.random.default_rng(args.seed)
+        self.args = args
+        self.prefixes = [f"10.{i // 256}.{i % 256}" for i in range(args.prefixes)]
+        self.candidates = list(range(1, args.candidates + 1))
+        self.max_load = np.zeros(args.dpids)
+        self.drops = np.zeros(args.dpids, dtype=np.int64)
+        self.redraw()
+
+    def redraw(self):
+        """New busiest load (up to twice the threshold) and drops per switch."""
+        self.max_load = self.rng.uniform(0.0, 2.0 * self.args.threshold, self.args.dpids)
+        self.drops = np.where(self.rng.random(self.args.dpids) < 0.2, self.rng.integers(1, 50, self.args.dpids), 0)
+
+    def calls(self, batch: int):
+        """Lists of ``batch`` (dpid, dst_prefix) flows, ``--decisions`` in
+        all, redrawing the switches every ``--refresh`` decisions."""
+        done = 0
+        while done < self.args.decisions:
+            n = min(batch, self.args.decisions - done)
+            dpids = self.rng.integers(1, self.args.dpids + 1, n)
+            prefixes = self.rng.integers(0, len(self.prefixes), n)
+            yield [(int(d), self.prefixes[p]) for d, p in zip(dpids, prefixes)]
+            if (done + n) // self.args.refresh != done // self.args.refresh:
+                self.redraw()
+                yield None
+            done += n
+
+
+def _summary(deployment: str, batch: int, log: str, decisions: int, spent: list) -> dict:
+    spent = np.asarray(spent)
+    return {
+        "deployment": deployment,
+        "batch": batch,
+        "log": log,
+        "decisions": decisions,
+        "us_per_decision": round(1e6 * float(spent.sum()) / max(decisions, 1), 2),
+        "p50_us": round(1e6 * float(np.percentile(spent, 50)), 1),
+        "p99_us": round(1e6 * float(np.percentile(spent, 99)), 1),
+    }
+
+
+def run_embedded(batch: int, log: str, args, workdir: Path) -> dict:
+    np.random.seed(args.seed)
+    path = workdir / f"embedded_{batch}_{log}.csv"
+    sink = CsvSink(path, LOG_HEADER)
+    writer = None
+    if log == "buffered":
+        writer = DecisionLog(sink=sink)
+        writer.start()
+    elif log == "sync":
+        writer = _SyncLog(sink)
+    embedded = EmbeddedAgent(args.threshold, log=writer)
+
+    work = Workload(args)
+    spent = []
+    decisions = 0
+    for flows in work.calls(batch):
+        if flows is None:
+            continue
+        dpids = [d for d, _ in flows]
+        idx = np.asarray(dpids) - 1
+        t0 = time.perf_counter()
+        if batch == 1:
+            (dpid, prefix), i = flows[0], dpids[0] - 1
+            embedded.decide(dpid, prefix, work.candidates, float(work.max_load[i]), int(work.drops[i]))
+        else:
+            embedded.decide_batch(
+                dpids,
+                [p for _, p in flows],
+                [work.candidates] * len(flows),
+                work.max_load[idx].tolist(),
+                work.drops[idx].tolist(),
+            )
+        spent.append(time.perf_counter() - t0)
+        decisions += len(flows)
+    if isinstance(writer, DecisionLog):
+        writer.flush()
+    return _summary("embedded", batch, log, decisions, spent)
+
+
+def run_service(batch: int, args) -> dict:
+    url = urlparse(args.url)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=args.timeout)
+    headers = {"Content-Type": "application/json"}
+
+    def post(path: str, body) -> int:
+        conn.request("POST", path, body=json.dumps(body), headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+
+    work = Workload(args)
+
+    def observe():
+        for i in range(args.dpids):
+            # One port carries the switch's busiest load and all its drops.
+            post("/observe", {"dpid": i + 1, "port": 1, "load_bps": float(work.max_load[i]),
+                              "drops": int(work.drops[i])})
+
+    observe()
+    spent = []
+    decisions = failed = 0
+    for flows in work.calls(batch):
+        if flows is None:
+            observe()
+            continue
+        t0 = time.perf_counter()
+        if batch == 1:
+            (dpid, prefix), = flows
+            status = post("/act", {"dpid": dpid, "dst_prefix": prefix, "candidates": work.candidates})
+        else:
+            status = post("/act_batch", {"items": [[d, p, work.candidates] for d, p in flows]})
+        spent.append(time.perf_counter() - t0)
+        decisions += len(flows)
+        failed += status != 200
+    conn.close()
+    if failed:
+        print(f"[BENCH] {failed} of {len(spent)} service calls failed", file=sys.stderr)
+    return _summary("service", batch, "-", decisions, spent)
+
+
+def _list(cast):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--deployments", type=_list(str), default=["embedded"])
+    ap.add_argument("--batch", type=_list(int), default=[1, 64], help="flows per call")
+    ap.add_argument("--logs", type=_list(str), default=["buffered", "sync", "none"], help="embedded decision logs")
+    ap.add_argument("--url", default="", help="running agent, for the service deployment")
+    ap.add_argument("--timeout", type=float, default=5.0)
+    ap.add_argument("--decisions", type=int, default=20000)
+    ap.add_argument("--dpids", type=int, default=3)
+    ap.add_argument("--prefixes", type=int, default=100, help="destination prefixes per switch")
+    ap.add_argument("--candidates", type=int, default=2)
+    ap.add_argument("--refresh", type=int, default=100, help="decisions between switch metric redraws")
+    ap.add_argument("--threshold", type=float, default=200000.0, help="congestion threshold, bytes/s")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="-", help="CSV path, '-' for stdout")
+    args = ap.parse_args()
+    if "service" in args.deployments and not args.url:
+        ap.error("the service deployment needs --url")
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        w = csv.DictWriter(out, fieldnames=FIELDS)
+        w.writeheader()
+        with tempfile.TemporaryDirectory() as workdir:
+            for deployment in args.deployments:
+                for batch in args.batch:
+                    if deployment == "embedded":
+                        for log in args.logs:
+                            w.writerow(run_embedded(batch, log, args, Path(workdir)))
+                            out.flush()
+                    elif deployment == "service":
+                        w.writerow(run_service(batch, args))
+                        out.flush()
+                    else:
+                        ap.error(f"unknown deployment {deployment!r}")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
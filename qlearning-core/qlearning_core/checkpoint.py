@@ -0,0 +1,67 @@
+import io
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Bump when the array layout written by save_checkpoint changes.
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(agent, path: Path) -> Path:
+    """Atomically write the agent tables to ``path`` as an uncompressed npz."""
+    return write_checkpoint(path, agent.export_state())
+
+
+def write_checkpoint(path: Path, state: dict) -> Path:
+    """Write arrays shaped like ``QAgent.export_state()`` to ``path``.
+
+    The file is written next to its destination and renamed into place, so a
+    reader (or a restart) only ever sees a complete checkpoint.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        np.savez(
+            f,
+            version=np.int64(CHECKPOINT_VERSION),
+            saved_at=np.float64(time.time()),
+            **state,
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def dump_state(state: dict) -> bytes:
+    """Serialize arrays shaped like ``QAgent.export_state()`` in checkpoint format."""
+    buf = io.BytesIO()
+    np.savez(buf, version=np.int64(CHECKPOINT_VERSION), saved_at=np.float64(time.time()), **state)
+    return buf.getvalue()
+
+
+def _read(source) -> dict:
+    with np.load(source, allow_pickle=False) as data:
+        version = int(data["version"])
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"unsupported checkpoint version {version} (expected {CHECKPOINT_VERSION})")
+        return {k: data[k] for k in data.files}
+
+
+def read_checkpoint(path: Path) -> dict:
+    return _read(Path(path))
+
+
+def load_state(blob: bytes) -> dict:
+    """Inverse of :func:`dump_state`."""
+    return _read(io.BytesIO(blob))
+
+
+def load_checkpoint(agent, path: Path) -> int:
+    """Restore ``agent`` from ``path``; returns the number of keys loaded."""
+    state = read_checkpoint(path)
+    agent.import_state(state)
+    return len(state["keys"])
@@ -0,0 +1,150 @@
+"""Buffered decision logging.
+
+:class:`DecisionLog` queues rows from the decision path and hands them to
+a sink in batches from a background thread. A sink is any object with a
+``write(rows)`` method; :class:`CsvSink` appends to a CSV file and
+:class:`NullSink` discards rows (benchmarks, or logging switched off).
+"""
+
+import csv
+import io
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+# Columns of the decision log written by the agent service and by the
+# controller's embedded agent; see decision_row().
+LOG_HEADER = [
+    "ts",
+    "step",
+    "dpid",
+    "dst_prefix",
+    "state",
+    "action",
+    "out_port",
+    "epsilon",
+    "max_load_bps",
+    "total_drops",
+    "reward",
+    "q_values",
+]
+
+
+def decision_row(decision, dpid: int, dst_prefix: str, max_load: float, total_drops: int) -> list:
+    """A :data:`LOG_HEADER` row for one ``QAgent`` decision."""
+    return [
+        float(time.time()),
+        int(decision.step),
+        int(dpid),
+        str(dst_prefix),
+        int(decision.state),
+        int(decision.action),
+        int(decision.out_port),
+        float(decision.epsilon),
+        float(max_load),
+        int(total_drops),
+        ("" if decision.reward is None else float(decision.reward)),
+        ("" if decision.q_values is None else json.dumps(decision.q_values)),
+    ]
+
+
+class CsvSink:
+    """Appends rows to a CSV file, writing ``header`` first when it is empty."""
+
+    def __init__(self, path: Path, header: list):
+        self.path = Path(path)
+        self.header = list(header)
+
+    def write(self, rows: list):
+        buf = io.StringIO(newline="")
+        w = csv.writer(buf)
+        # One O_APPEND write per batch keeps lines whole when several
+        # worker processes share the file.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size == 0:
+                w.writerow(self.header)
+            w.writerows(rows)
+            os.write(fd, buf.getvalue().encode())
+        finally:
+            os.close(fd)
+
+
+class NullSink:
+    def write(self, rows: list):
+        pass
+
+
+class DecisionLog(threading.Thread):
+    """Rows fed through a bounded queue to ``sink``.
+
+    Request handlers only enqueue rows; a background thread passes them to
+    the sink in batches. When the queue is full rows are dropped and counted
+    rather than making a decision wait on disk I/O. After the first row of a
+    batch the thread waits ``linger_s`` for more, so a busy decision path
+    pays one sink write per batch instead of one per row. ``path`` and
+    ``header`` build the default :class:`CsvSink`.
+    """
+
+    def __init__(self, path: Path = None, header: list = None, max_queue: int = 10000, batch_rows: int = 512,
+                 sink=None, linger_s: float = 0.05):
+        super().__init__(name="decision-log", daemon=True)
+        if sink is None:
+            if path is None or header is None:
+                raise ValueError("DecisionLog needs a sink, or a path and header for a CSV sink")
+            sink = CsvSink(path, header)
+        self.sink = sink
+        self.batch_rows = max(1, int(batch_rows))
+        self.linger_s = max(0.0, float(linger_s))
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.dropped = 0
+        self.written = 0
+        self._dropped_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, rows: list):
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                with self._dropped_lock:
+                    self.dropped += 1
+
+    def _write(self, rows: list):
+        try:
+            with self._write_lock:
+                self.sink.write(rows)
+                self.written += len(rows)
+        except Exception as e:
+            with self._dropped_lock:
+                self.dropped += len(rows)
+            print(f"[AGENT] decision log write failed: {e}")
+
+    def _drain(self, rows: list) -> list:
+        while len(rows) < self.batch_rows:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        while True:
+            rows = self._drain([])
+            if not rows:
+                return
+            self._write(rows)
+
+    def run(self):
+        while True:
+            rows = [self._queue.get()]
+            if self.linger_s > 0 and self._queue.qsize() < self.batch_rows:
+                time.sleep(self.linger_s)
+            self._write(self._drain(rows))
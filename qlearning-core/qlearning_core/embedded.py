@@ -0,0 +1,60 @@
+"""In-process decisions for the controller.
+
+:class:`EmbeddedAgent` wires a :class:`QAgent`, the :class:`QoSModel` and a
+:class:`DecisionLog` together the way the agent service does behind
+``/act`` and ``/act_batch``: same flow keys, same state and reward, same
+log rows and checkpoint format. A checkpoint written by either deployment
+restores into the other.
+"""
+
+from pathlib import Path
+
+from .agent import QAgent
+from .checkpoint import load_checkpoint, save_checkpoint
+from .decision_log import decision_row
+from .model import QoSModel
+
+
+def flow_key(dpid: int, dst_prefix: str) -> str:
+    return f"{int(dpid)}:{dst_prefix}"
+
+
+class EmbeddedAgent:
+    """``learning`` is passed on to :class:`QAgent`; ``log``, when given,
+    receives one :data:`decision_log.LOG_HEADER` row per decision."""
+
+    def __init__(self, congestion_threshold: float, log=None, **learning):
+        self.model = QoSModel(congestion_threshold)
+        self.agent = QAgent(**learning)
+        self.log = log
+
+    def decide(self, dpid: int, dst_prefix: str, candidates, max_load: float, drops: int):
+        """Decide (and learn from the previous decision of) one flow from
+        the busiest load and total drops of its switch."""
+        state = self.model.get_state(load_bps=max_load, drops=drops)
+        reward = self.model.get_reward(load_bps=max_load, drops=drops)
+        decision = self.agent.act(flow_key(dpid, dst_prefix), candidates, state, reward)
+        if self.log is not None:
+            self.log.submit([decision_row(decision, dpid, dst_prefix, max_load, drops)])
+        return decision
+
+    def decide_batch(self, dpids, dst_prefixes, candidates, max_loads, drops) -> list:
+        """:meth:`decide` for many flows at once: one array pass for states
+        and rewards, one ``act_batch`` and one log submission."""
+        states = self.model.get_states(max_loads, drops)
+        rewards = self.model.get_rewards(max_loads, drops)
+        keys = [flow_key(d, p) for d, p in zip(dpids, dst_prefixes)]
+        decisions = self.agent.act_batch(keys, candidates, states.tolist(), rewards.tolist())
+        if self.log is not None:
+            self.log.submit([
+                decision_row(dec, d, p, load, n)
+                for dec, d, p, load, n in zip(decisions, dpids, dst_prefixes, max_loads, drops)
+            ])
+        return decisions
+
+    def save(self, path: Path) -> Path:
+        return save_checkpoint(self.agent, path)
+
+    def restore(self, path: Path) -> int:
+        """Load a checkpoint of either deployment; returns the number of keys."""
+        return load_checkpoint(self.agent, path)
@@ -0,0 +1,134 @@
+"""The MDP shared by the controller and the agent: switch state, reward and
+linear-learner features from the switch's busiest observation and its
+drops."""
+
+import numpy as np
+
+
+def _as_float_array(values):
+    """``values`` as float64, converting each like ``float(x)`` with 0.0 on
+    failure."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biuf":
+        return arr.astype(np.float64)
+    out = np.empty(arr.shape, dtype=np.float64)
+    for i, x in np.ndenumerate(arr):
+        try:
+            out[i] = float(x)
+        except Exception:
+            out[i] = 0.0
+    return out
+
+
+def _has_drops(values):
+    """``int(x) > 0`` for each element, 0 on failure: ``int`` truncates, so
+    a finite float counts from 1.0 and NaN or infinity not at all."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biu":
+        return arr > 0
+    if arr.dtype.kind == "f":
+        return np.isfinite(arr) & (arr >= 1.0)
+    out = np.zeros(arr.shape, dtype=bool)
+    for i, x in np.ndenumerate(arr):
+        try:
+            out[i] = int(x) > 0
+        except Exception:
+            pass
+    return out
+
+
+def _as_flags(values):
+    """Truthiness of each element, as ``if x:`` tests it."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biufc":
+        return arr != 0
+    out = np.zeros(arr.shape, dtype=bool)
+    for i, x in np.ndenumerate(arr):
+        out[i] = bool(x)
+    return out
+
+
+class QoSModel:
+    def __init__(self, congestion_threshold: float):
+        self.th = float(congestion_threshold)
+
+    def get_state(self, load_bps: float, drops: int) -> int:
+        try:
+            load = float(load_bps)
+        except Exception:
+            load = 0.0
+        try:
+            d = int(drops)
+        except Exception:
+            d = 0
+        if d > 0:
+            return 2
+        if load < 0.5 * self.th:
+            return 0
+        if load < 1.0 * self.th:
+            return 1
+        return 2
+
+    def get_reward(self, load_bps: float, drops: int, stable_bonus: bool = False,
+                   backup_penalty: bool = False) -> float:
+        """-50 with drops, else 20 / 10 / -5 by load; ``stable_bonus`` (same
+        action as before) adds 5 and ``backup_penalty`` (backup path taken
+        needlessly) takes 3 off, for the controller's shaping."""
+        try:
+            load = float(load_bps)
+        except Exception:
+            load = 0.0
+        try:
+            d = int(drops)
+        except Exception:
+            d = 0
+
+        if d > 0:
+            r = -50.0
+        elif load < 0.5 * self.th:
+            r = 20.0
+        elif load < 1.0 * self.th:
+            r = 10.0
+        else:
+            r = -5.0
+        if stable_bonus:
+            r += 5.0
+        if backup_penalty:
+            r -= 3.0
+        return r
+
+    def get_states(self, load_bps, drops) -> np.ndarray:
+        """Array version of get_state: elementwise over broadcast ``load_bps``
+        and ``drops``, with the same conversions and thresholds."""
+        load = _as_float_array(load_bps)
+        state = np.where(load < 0.5 * self.th, 0, np.where(load < 1.0 * self.th, 1, 2))
+        return np.where(_has_drops(drops), 2, state).astype(np.int64)
+
+    def get_rewards(self, load_bps, drops, stable_bonus=False, backup_penalty=False) -> np.ndarray:
+        """Array version of get_reward; ``stable_bonus`` and
+        ``backup_penalty`` may be scalars or arrays broadcast against the
+        metrics."""
+        load = _as_float_array(load_bps)
+        r = np.where(load < 0.5 * self.th, 20.0, np.where(load < 1.0 * self.th, 10.0, -5.0))
+        r = np.where(_has_drops(drops), -50.0, r)
+        r = r + np.where(_as_flags(stable_bonus), 5.0, 0.0)
+        r = r - np.where(_as_flags(backup_penalty), 3.0, 0.0)
+        return r.astype(np.float64)
+
+    # Box the linear learner tiles get_features() over: utilisation up to
+    # twice the threshold, drops up to ~1000 per sample on a log scale.
+    FEATURE_LOWS = (0.0, 0.0, 0.0, 0.0)
+    FEATURE_HIGHS = (2.0, 2.0, 7.0, 7.0)
+    FEATURE_BINS = (8, 8, 4, 4)
+
+    def get_features(self, load_bps: float, drops: int, port_load_bps, port_drops) -> np.ndarray:
+        """One row per candidate port: switch and port utilisation (load over
+        the threshold) and log1p of switch and port drops."""
+        port_load = np.asarray(port_load_bps, dtype=np.float64)
+        n = len(port_load)
+        return np.column_stack([
+            np.full(n, float(load_bps) / self.th),
+            port_load / self.th,
+            np.full(n, np.log1p(max(0, int(drops)))),
+            np.log1p(np.maximum(np.asarray(port_drops, dtype=np.float64), 0.0)),
+        ])
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """Bounded ring of (row, gen, s, a, r, s') transitions in flat arrays.
+
+    ``row`` is the agent tensor row of the flow key and ``gen`` the row
+    generation at the time of the decision; the learner drops transitions
+    whose row has since been remapped or reassigned.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self._lock = threading.Lock()
+        self._row = np.zeros(self.capacity, dtype=np.int64)
+        self._gen = np.zeros(self.capacity, dtype=np.int64)
+        self._s = np.zeros(self.capacity, dtype=np.int64)
+        self._a = np.zeros(self.capacity, dtype=np.int64)
+        self._r = np.zeros(self.capacity, dtype=np.float32)
+        self._s_next = np.zeros(self.capacity, dtype=np.int64)
+        self._head = 0
+        self._size = 0
+        self.pushed = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, row: int, gen: int, s: int, a: int, r: float, s_next: int):
+        with self._lock:
+            i = self._head
+            self._row[i] = row
+            self._gen[i] = gen
+            self._s[i] = s
+            self._a[i] = a
+            self._r[i] = r
+            self._s_next[i] = s_next
+            self._head = (i + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+            self.pushed += 1
+
+    def push_many(self, row, gen, s, a, r, s_next):
+        n = len(row)
+        if n == 0:
+            return
+        if n > self.capacity:
+            row, gen, s, a, r, s_next = (x[-self.capacity :] for x in (row, gen, s, a, r, s_next))
+            n = self.capacity
+        with self._lock:
+            idx = (self._head + np.arange(n)) % self.capacity
+            self._row[idx] = row
+            self._gen[idx] = gen
+            self._s[idx] = s
+            self._a[idx] = a
+            self._r[idx] = r
+            self._s_next[idx] = s_next
+            self._head = int((self._head + n) % self.capacity)
+            self._size = min(self._size + n, self.capacity)
+            self.pushed += n
+
+    def sample(self, batch_size: int, rng: np.random.Generator) -> tuple:
+        with self._lock:
+            idx = rng.integers(0, self._size, size=min(int(batch_size), self._size))
+            return (
+                self._row[idx],
+                self._gen[idx],
+                self._s[idx],
+                self._a[idx],
+                self._r[idx],
+                self._s_next[idx],
+            )
+
+
+class ReplayTrainer(threading.Thread):
+    """Runs ``agent.learn_batch`` on replay minibatches at a fixed rate."""
+
+    def __init__(self, agent, buffer: ReplayBuffer, batch_size: int = 64, rate_hz: float = 20.0, seed=None):
+        super().__init__(name="replay-trainer", daemon=True)
+        self.agent = agent
+        self.buffer = buffer
+        self.batch_size = max(1, int(batch_size))
+        self.interval = 1.0 / max(1e-3, float(rate_hz))
+        self.updates = 0
+        self._rng = np.random.default_rng(seed)
+        self._stop_event = threading.Event()
+
+    def train_once(self) -> int:
+        if len(self.buffer) == 0:
+            return 0
+        n = self.agent.learn_batch(*self.buffer.sample(self.batch_size, self._rng))
+        self.updates += n
+        return n
+
+    def run(self):
+        next_at = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                self.train_once()
+            except Exception as e:
+                print(f"[AGENT] replay training failed: {e}")
+            next_at += self.interval
+            self._stop_event.wait(max(0.0, next_at - time.monotonic()))
+            next_at = max(next_at, time.monotonic() - self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,71 @@
+"""Shared-memory building blocks for the multi-process agent.
+
+Arrays are carved out of one anonymous ``MAP_SHARED`` mapping. Processes
+forked after the mapping exists (gunicorn workers of a preloaded app) see
+the same physical pages, so a write in one worker is visible to all.
+
+Readers that do not take the writer's lock use per-row sequence counters
+(seqlocks): a writer makes the counter odd before touching a row and even
+again afterwards; a reader copies the row and retries if the counter was
+odd or changed meanwhile. This relies on stores becoming visible in
+program order, which holds on x86-64 (the deployment target).
+"""
+
+import mmap
+
+import numpy as np
+
+ALIGN = 64
+
+
+class SharedArena:
+    """Fixed set of named NumPy arrays backed by one shared mapping."""
+
+    def __init__(self, specs: dict):
+        offsets = {}
+        size = 0
+        for name, (shape, dtype) in specs.items():
+            size = -(-size // ALIGN) * ALIGN
+            offsets[name] = size
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.nbytes = size
+        self._mm = mmap.mmap(-1, max(size, 1), flags=mmap.MAP_SHARED)
+        self.arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=self._mm, offset=offsets[name])
+            for name, (shape, dtype) in specs.items()
+        }
+
+
+def seq_begin(seq: np.ndarray, rows):
+    """Mark ``rows`` (unique indices) as being written."""
+    seq[rows] += 1
+
+
+def seq_end(seq: np.ndarray, rows):
+    seq[rows] += 1
+
+
+def seq_read(seq: np.ndarray, arrays: list, rows, max_spins: int = 1000) -> list:
+    """Copy ``rows`` of ``arrays`` without tearing any row.
+
+    ``rows`` is either a count of leading rows or an array of row indices.
+    """
+    if np.isscalar(rows):
+        idx = np.arange(int(rows))
+        sel = slice(0, int(rows))
+    else:
+        idx = sel = np.asarray(rows, dtype=np.int64)
+    before = seq[sel].copy()
+    out = [a[sel].copy() for a in arrays]
+    after = seq[sel]
+    pending = np.flatnonzero((before != after) | (before & 1).astype(bool))
+    spins = 0
+    while len(pending) and spins < max_spins:
+        src_rows = idx[pending]
+        before = seq[src_rows].copy()
+        for dst, src in zip(out, arrays):
+            dst[pending] = src[src_rows]
+        after = seq[src_rows]
+        pending = pending[(before != after) | (before & 1).astype(bool)]
+        spins += 1
+    return out
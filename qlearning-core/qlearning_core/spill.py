@@ -0,0 +1,66 @@
+"""On-disk store for Q-tables evicted from memory.
+
+Each evicted key keeps one SQLite row: its candidate ports and its
+``(N_STATES, n_actions)`` table as raw int32/float32 bytes, plus its visit
+count. The agent pops a key back into memory the next time it is seen.
+
+Connections are opened lazily per process, so a store created before
+gunicorn forks is safe to use from every worker; the agent's index lock
+already serializes writers.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+
+class SpillStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = None
+        self._pid = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tables "
+                "(key TEXT PRIMARY KEY, ports BLOB NOT NULL, q BLOB NOT NULL, visits INTEGER NOT NULL)"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def put_many(self, items):
+        """Store ``(key, ports, q, visits)`` tuples, replacing older copies."""
+        rows = [
+            (key, np.asarray(ports, dtype=np.int32).tobytes(), np.asarray(q, dtype=np.float32).tobytes(), int(visits))
+            for key, ports, q, visits in items
+        ]
+        if not rows:
+            return
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            db.executemany("INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?)", rows)
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def pop(self, key: str):
+        """Remove ``key`` and return ``(ports, q, visits)``, or None."""
+        db = self._db()
+        row = db.execute("DELETE FROM tables WHERE key = ? RETURNING ports, q, visits", (key,)).fetchone()
+        if row is None:
+            return None
+        ports = np.frombuffer(row[0], dtype=np.int32).tolist()
+        q = np.frombuffer(row[1], dtype=np.float32).reshape(-1, len(ports)) if ports else None
+        return ports, q, int(row[2])
+
+    def __len__(self) -> int:
+        return int(self._db().execute("SELECT COUNT(*) FROM tables").fetchone()[0])
@@ -0,0 +1,66 @@
+"""Tile coding of continuous switch metrics for the linear learner."""
+
+import zlib
+
+import numpy as np
+
+
+def key_hash(key: str) -> int:
+    """Stable across processes and restarts, unlike ``hash()``."""
+    return zlib.crc32(key.encode())
+
+
+class TileCoder:
+    """Sparse binary features over a box of continuous inputs.
+
+    ``tilings`` grids of ``bins[d]`` intervals cover ``[lows[d], highs[d]]``
+    in each dimension ``d``; grid ``t`` is shifted by ``t * (2d + 1) /
+    tilings`` of an interval along ``d``, so the grids do not line up along
+    the diagonal. Inputs outside the box are clipped to it. An input
+    activates one tile per tiling, one weight for its candidate slot and one
+    hashed weight for (flow key, slot), which carries per-flow preferences
+    the metrics do not explain. Indices are into one flat weight vector of
+    ``n_weights`` entries, ``n_active`` of them per input.
+    """
+
+    def __init__(self, lows, highs, bins, tilings: int = 8, slots: int = 64, key_buckets: int = 1 << 14):
+        self.lows = np.asarray(lows, dtype=np.float64)
+        self.highs = np.asarray(highs, dtype=np.float64)
+        self.bins = np.asarray(bins, dtype=np.int64)
+        if not (self.lows.shape == self.highs.shape == self.bins.shape) or np.any(self.highs <= self.lows):
+            raise ValueError("tile coder needs lows < highs and one bin count per dimension")
+        self.tilings = max(1, int(tilings))
+        self.slots = max(1, int(slots))
+        self.key_buckets = max(1, int(key_buckets))
+
+        dims = len(self.bins)
+        self._scale = self.bins / (self.highs - self.lows)
+        self._top = self.bins.astype(np.float64)
+        # Offsets in units of one interval, in [0, 1).
+        t = np.arange(self.tilings)[:, None]
+        d = np.arange(dims)[None, :]
+        self._offsets = ((t * (2 * d + 1)) % self.tilings) / self.tilings
+        # A shifted grid needs one more tile per dimension.
+        per_dim = self.bins + 1
+        # Float, so the ravel is one BLAS product; indices stay far below 2**53.
+        self._strides = np.concatenate([np.cumprod(per_dim[::-1])[::-1][1:], [1]]).astype(np.float64)
+        self._per_tiling = int(np.prod(per_dim))
+        self._tiling_base = np.arange(self.tilings) * self._per_tiling
+        self._slot_base = self.tilings * self._per_tiling
+        self._key_base = self._slot_base + self.slots
+        self.n_weights = self._key_base + self.key_buckets
+        self.n_active = self.tilings + 2
+
+    def active(self, x, slots, key_hashes) -> np.ndarray:
+        """Active weight indices ``(n, n_active)`` for inputs ``x`` of shape
+        ``(n, dims)``, the candidate slot of each and its flow key's
+        :func:`key_hash`."""
+        x = np.asarray(x, dtype=np.float64).reshape(-1, len(self.bins))
+        scaled = np.minimum(np.maximum((x - self.lows) * self._scale, 0.0), self._top)
+        out = np.empty((len(x), self.n_active), dtype=np.int64)
+        out[:, :-2] = np.floor(scaled[:, None, :] + self._offsets) @ self._strides
+        out[:, :-2] += self._tiling_base
+        slots = np.asarray(slots, dtype=np.int64)
+        out[:, -2] = np.minimum(slots, self.slots - 1) + self._slot_base
+        out[:, -1] = (np.asarray(key_hashes, dtype=np.int64) + slots * 2654435761) % self.key_buckets + self._key_base
+        return out
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pytest
+
+from qlearning_core import N_STATES, QAgent, SpillStore
+
+
+def test_row_remapped_by_another_caller_is_taken_back():
+    agent = QAgent(epsilon=0.0)
+    row = agent._ensure_key("k", [1, 2])
+    # A concurrent decision for the same key with other candidates.
+    agent._ensure_key("k", [3, 4])
+    with agent.key_lock("k"):
+        assert agent._holds("k", row, [1, 2])
+        assert agent._row_ports(row) == [1, 2]
+
+
+def test_concurrent_acts_with_different_candidates_stay_in_their_candidates():
+    np.random.seed(0)
+    agent = QAgent(epsilon=0.5)
+    bad = []
+
+    def run(candidates):
+        for _ in range(2000):
+            d = agent.act("k", candidates, 0, 1.0)
+            if d.out_port not in candidates:
+                bad.append((candidates, d.out_port))
+
+    threads = [threading.Thread(target=run, args=(c,)) for c in ([1, 2], [3, 4], [5, 6, 7])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not bad
+
+
+
+def test_grow_waits_for_step_and_epsilon_updates():
+    agent = QAgent(initial_keys=1)
+    agent._counter_lock.acquire()
+    grower = threading.Thread(target=agent._grow, args=(8, 1))
+    grower.start()
+    grower.join(0.2)
+    # A step reserved now must not be lost to the copy being bound.
+    assert grower.is_alive()
+    agent._counters[0] += 1
+    agent._counter_lock.release()
+    grower.join()
+    assert agent.capacity[0] == 8
+    assert agent._step == 1
+
+
+def test_learn_batch_waits_for_a_remap_and_skips_the_stale_row():
+    agent = QAgent(epsilon=0.0)
+    row = agent._ensure_key("k", [1, 2])
+    gen = int(agent._row_gen[row])
+    lock = agent.key_lock("k")
+    lock.acquire()
+    applied = []
+    learner = threading.Thread(target=lambda: applied.append(agent.learn_batch([row], [gen], [0], [0], [10.0], [0])))
+    learner.start()
+    learner.join(0.2)
+    assert learner.is_alive()
+    # A decision holding the stripe lock remaps the row meanwhile.
+    agent._remap(row, [3, 4])
+    lock.release()
+    learner.join()
+    assert applied == [0]
+    assert not agent._q[row].any()
+    assert int(agent._row_seq[row]) % 2 == 0
+
+
+def test_act_batch_repeating_a_key_with_other_candidates():
+    decisions = QAgent(epsilon=0.0).act_batch(["k", "k"], [[1, 2], [3, 4]], [0, 0], [0.0, 0.0])
+    assert decisions[0].out_port in (1, 2)
+    assert decisions[1].out_port in (3, 4)
+
+    decisions = QAgent(epsilon=0.0).act_batch(["k"] * 3, [[1, 2], [3, 4], [1, 2]], [0, 0, 0], [5.0, 5.0, 5.0])
+    assert [d.out_port in c for d, c in zip(decisions, ([1, 2], [3, 4], [1, 2]))] == [True] * 3
+    # Each change of candidates is a remap: nothing to learn from.
+    assert [d.reward for d in decisions] == [None, None, None]
+
+
+def test_act_batch_matches_consecutive_acts():
+    keys = ["a", "b", "a", "a", "b", "a"]
+    candidates = [[1, 2], [1, 2], [1, 2], [2, 3], [1, 2], [2, 3]]
+    states = [0, 1, 2, 0, 1, 2]
+    rewards = [1.0, -5.0, 10.0, 20.0, -50.0, 3.0]
+    batch = QAgent(epsilon=0.0).act_batch(keys, candidates, states, rewards)
+    single = QAgent(epsilon=0.0)
+    one_by_one = [single.act(k, c, s, r) for k, c, s, r in zip(keys, candidates, states, rewards)]
+    assert [(d.out_port, d.reward, d.q_values) for d in batch] == [
+        (d.out_port, d.reward, d.q_values) for d in one_by_one
+    ]
+
+
+def test_spilled_table_survives_a_full_shared_table(tmp_path):
+    spill = SpillStore(tmp_path / "spill.db")
+    agent = QAgent(epsilon=0.0, shared=True, initial_keys=1, spill=spill)
+    agent.act("a", [1, 2], 0, None)
+    q = np.arange(2 * N_STATES, dtype=np.float32).reshape(N_STATES, 2)
+    spill.put_many([("b", [3, 4], q, 7)])
+
+    with pytest.raises(RuntimeError):
+        agent.act("b", [3, 4], 0, None)
+
+    ports, kept, visits = spill.pop("b")
+    assert list(ports) == [3, 4]
+    assert np.array_equal(kept, q)
+    assert visits == 7
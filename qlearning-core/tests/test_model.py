@@ -0,0 +1,130 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from qlearning_core import QoSModel
+
+TH = 200000.0
+
+EDGE_LOADS = [
+    0.0,
+    -1.0,
+    0.5 * TH,
+    np.nextafter(0.5 * TH, 0),
+    np.nextafter(0.5 * TH, TH),
+    TH,
+    np.nextafter(TH, 0),
+    np.nextafter(TH, 2 * TH),
+    1e300,
+    -1e300,
+    math.inf,
+    -math.inf,
+    math.nan,
+]
+EDGE_DROPS = [0, 1, -1, 0.5, 0.999999, 1.0, 1.5, -0.5, -1.5, 1e20, -1e20, math.inf, -math.inf, math.nan]
+ODD_VALUES = [None, "abc", "3", "3.5", "", "nan", "1e9", b"7", [1], object()]
+FLAGS = [True, False, 0, 1, 0.0, 2.5, math.nan, "", "x", None, np.bool_(True), np.int64(0)]
+
+
+def _objects(values) -> np.ndarray:
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _assert_matches_scalar(model, loads, drops, stable_bonus=False, backup_penalty=False):
+    states = model.get_states(loads, drops)
+    rewards = model.get_rewards(loads, drops, stable_bonus, backup_penalty)
+    assert states.shape == rewards.shape == (len(loads),)
+    for i in range(len(loads)):
+        bonus = stable_bonus[i] if isinstance(stable_bonus, np.ndarray) else stable_bonus
+        penalty = backup_penalty[i] if isinstance(backup_penalty, np.ndarray) else backup_penalty
+        assert states[i] == model.get_state(loads[i], drops[i]), (loads[i], drops[i])
+        assert rewards[i] == model.get_reward(loads[i], drops[i], bonus, penalty), (loads[i], drops[i], bonus, penalty)
+
+
+@pytest.mark.parametrize("load", EDGE_LOADS)
+def test_threshold_boundaries_and_non_finite_loads(load):
+    model = QoSModel(TH)
+    loads = np.array([load, load])
+    _assert_matches_scalar(model, loads, np.array([0, 1]))
+
+
+def test_boundaries_fall_on_the_upper_state():
+    model = QoSModel(TH)
+    loads = np.array([np.nextafter(0.5 * TH, 0), 0.5 * TH, np.nextafter(TH, 0), TH, math.nan])
+    assert model.get_states(loads, np.zeros(5)).tolist() == [0, 1, 1, 2, 2]
+    assert model.get_rewards(loads, np.zeros(5)).tolist() == [20.0, 10.0, 10.0, -5.0, -5.0]
+
+
+@pytest.mark.parametrize("drops", EDGE_DROPS)
+def test_fractional_negative_and_non_finite_drops(drops):
+    model = QoSModel(TH)
+    _assert_matches_scalar(model, np.array([0.0, 1.5 * TH]), np.array([drops, drops], dtype=np.float64))
+
+
+def test_fractional_drops_count_from_one():
+    model = QoSModel(TH)
+    drops = np.array([0.5, 0.999, 1.0, 1.5, -2.0, math.nan, math.inf])
+    assert model.get_states(np.zeros(7), drops).tolist() == [0, 0, 2, 2, 0, 0, 0]
+
+
+@pytest.mark.parametrize("value", ODD_VALUES)
+def test_none_and_str_inputs(value):
+    model = QoSModel(TH)
+    _assert_matches_scalar(model, _objects([value, 0.75 * TH]), _objects([0, value]))
+
+
+def test_array_flags_match_scalar_truthiness():
+    model = QoSModel(TH)
+    n = len(FLAGS)
+    loads = np.linspace(0, 2 * TH, n)
+    drops = np.zeros(n)
+    _assert_matches_scalar(model, loads, drops, stable_bonus=_objects(FLAGS), backup_penalty=_objects(FLAGS[::-1]))
+    _assert_matches_scalar(model, loads, drops, stable_bonus=np.array([True, False] * (n // 2)), backup_penalty=True)
+
+
+def test_random_mixes_match_scalar():
+    rng = random.Random(1)
+    model = QoSModel(TH)
+
+    def load():
+        c = rng.random()
+        if c < 0.3:
+            return rng.choice(EDGE_LOADS)
+        if c < 0.9:
+            return rng.uniform(-0.2, 2.5) * TH
+        return rng.choice(ODD_VALUES)
+
+    def drops():
+        c = rng.random()
+        if c < 0.4:
+            return rng.choice(EDGE_DROPS)
+        if c < 0.9:
+            return rng.choice([rng.randint(-3, 5), rng.uniform(-2, 3)])
+        return rng.choice(ODD_VALUES)
+
+    for _ in range(300):
+        n = rng.randint(0, 30)
+        kind = rng.random()
+        if kind < 0.3:
+            loads = np.array([rng.uniform(-0.2, 2.5) * TH for _ in range(n)])
+            drop = np.array([rng.uniform(-2, 3) for _ in range(n)])
+        elif kind < 0.5:
+            loads = np.array([rng.randint(-10, 3 * int(TH)) for _ in range(n)], dtype=np.int64)
+            drop = np.array([rng.randint(-3, 3) for _ in range(n)], dtype=np.int64)
+        else:
+            loads = _objects([load() for _ in range(n)])
+            drop = _objects([drops() for _ in range(n)])
+        flags = _objects([rng.choice(FLAGS) for _ in range(n)])
+        _assert_matches_scalar(model, loads, drop, stable_bonus=flags, backup_penalty=rng.choice(FLAGS))
+
+
+def test_broadcasting_and_scalars():
+    model = QoSModel(TH)
+    loads = np.linspace(0, 2.5 * TH, 7)[:, None]
+    drops = np.array([0, 1, 0.5])[None, :]
+    assert model.get_states(loads, drops).shape == (7, 3)
+    assert model.get_rewards(150000.0, 0, True, True) == model.get_reward(150000.0, 0, True, True)
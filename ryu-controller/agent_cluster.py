@@ -0,0 +1,119 @@
+# ryu-controller/agent_cluster.py
+import bisect
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+
+def _hash(value) -> int:
+    # Stable across processes and restarts, unlike hash().
+    return int.from_bytes(hashlib.md5(str(value).encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping dpids to agent URLs.
+    Each node owns `vnodes` points, so adding or removing one agent only
+    moves the dpids that hash next to its points.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(int(vnodes)))
+        self._hashes = [h for h, _ in points]
+        self._owners = [n for _, n in points]
+
+    def node_for(self, key) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class AgentCluster:
+    """
+    Dpid-sharded set of Q-learning agents.
+
+    /observe and /act for a switch always go to the agent owning its dpid on
+    the ring of live agents. check() probes every agent; when one joins or
+    leaves, the Q-tables of the dpids that change owner are copied from the
+    old owner (if it is still reachable) to the new one and dropped from the
+    old one before traffic is switched over.
+    """
+
+    def __init__(self, urls: List[str], session=None, vnodes: int = 64,
+                 health_timeout_s: float = 1.0, migrate_timeout_s: float = 10.0,
+                 fail_after: int = 2, logger=None):
+        self.urls = [u.rstrip("/") for u in urls if u.strip()]
+        self.session = session or requests.Session()
+        self.vnodes = int(vnodes)
+        self.health_timeout_s = float(health_timeout_s)
+        self.migrate_timeout_s = float(migrate_timeout_s)
+        self.fail_after = max(1, int(fail_after))
+        self.logger = logger
+        self.failures = {u: 0 for u in self.urls}
+        self.ring = HashRing(self.urls, self.vnodes)
+        self.migrations = 0
+
+    def url_for(self, dpid: int) -> Optional[str]:
+        return self.ring.node_for(int(dpid))
+
+    def owners(self, dpids: Iterable[int]) -> Dict[int, Optional[str]]:
+        return {int(d): self.url_for(d) for d in dpids}
+
+    def _log(self, msg: str):
+        if self.logger is not None:
+            self.logger.info(msg)
+
+    def _alive(self, url: str) -> bool:
+        try:
+            return self.session.get(f"{url}/health", timeout=self.health_timeout_s).status_code == 200
+        except Exception:
+            return False
+
+    def check(self, dpids: Iterable[int]) -> bool:
+        """Probe all agents and rebalance `dpids` if membership changed."""
+        for url in self.urls:
+            self.failures[url] = 0 if self._alive(url) else self.failures[url] + 1
+        live = [u for u in self.urls if self.failures[u] < self.fail_after]
+        if sorted(live) == self.ring.nodes:
+            return False
+
+        new_ring = HashRing(live, self.vnodes)
+        joined = sorted(set(live) - set(self.ring.nodes))
+        left = sorted(set(self.ring.nodes) - set(live))
+        self._log(f"[AGENTS] membership changed: joined={joined} left={left}")
+
+        moves = {}
+        for dpid in dpids:
+            src, dst = self.ring.node_for(int(dpid)), new_ring.node_for(int(dpid))
+            if src != dst and dst is not None:
+                moves.setdefault((src, dst), []).append(int(dpid))
+        for (src, dst), moved in sorted(moves.items(), key=lambda kv: str(kv[0])):
+            if src is None or src in left:
+                self._log(f"[AGENTS] dpids {moved} -> {dst} (previous owner gone, starting cold)")
+                continue
+            self._migrate(src, dst, moved)
+
+        self.ring = new_ring
+        return True
+
+    def _migrate(self, src: str, dst: str, dpids: List[int]):
+        try:
+            resp = self.session.get(
+                f"{src}/shard/export", params={"dpid": dpids}, timeout=self.migrate_timeout_s
+            )
+            resp.raise_for_status()
+            imported = self.session.post(
+                f"{dst}/shard/import",
+                data=resp.content,
+                headers={"Content-Type": "application/octet-stream"},
+                timeout=self.migrate_timeout_s,
+            )
+            imported.raise_for_status()
+            self.session.post(f"{src}/shard/drop", json={"dpids": dpids}, timeout=self.migrate_timeout_s)
+            self.migrations += 1
+            self._log(f"[AGENTS] moved dpids {dpids}: {src} -> {dst} ({imported.json().get('imported')} tables)")
+        except Exception as e:
+            self._log(f"[AGENTS] migration of dpids {dpids} {src} -> {dst} failed: {e}")
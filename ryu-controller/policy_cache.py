@@ -0,0 +1,69 @@
+# ryu-controller/policy_cache.py
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+
+
+class PolicyCache:
+    """
+    Local copy of each agent's greedy policy (GET /policy).
+
+    poll(url) long-polls one agent and replaces its table when a new version
+    arrives. lookup() answers from the table of the agent owning the dpid;
+    it returns None when that policy is missing, older than `max_age_s`, or
+    has no entry for the flow, so the caller asks the live agent instead.
+    """
+
+    def __init__(self, session=None, wait_s: float = 20.0, max_age_s: float = 60.0, logger=None):
+        self.session = session or requests.Session()
+        self.wait_s = float(wait_s)
+        self.max_age_s = float(max_age_s)
+        self.logger = logger
+        # url -> (version, fetched_at, {(dpid, dst_prefix): [port per state]})
+        self.policies: Dict[str, Tuple[int, float, Dict[Tuple[int, str], list]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _parse(data: dict) -> Dict[Tuple[int, str], list]:
+        table = {}
+        for key, ports in zip(data.get("keys", []), data.get("ports", [])):
+            dpid, _, dst_prefix = str(key).partition(":")
+            table[(int(dpid), dst_prefix)] = [int(p) for p in ports]
+        return table
+
+    def poll(self, url: str) -> bool:
+        """One long-poll of `url`; True when a new version was loaded."""
+        current = self.policies.get(url)
+        params = {"wait": self.wait_s}
+        if current is not None:
+            params["since"] = current[0]
+        resp = self.session.get(f"{url}/policy", params=params, timeout=self.wait_s + 5.0)
+        if resp.status_code == 304:
+            self.policies[url] = (current[0], time.time(), current[2])
+            return False
+        resp.raise_for_status()
+        data = resp.json()
+        self.policies[url] = (int(data["version"]), time.time(), self._parse(data))
+        if self.logger is not None:
+            self.logger.info(f"[POLICY] {url} v{data['version']}: {len(data.get('keys', []))} flows")
+        return True
+
+    def lookup(self, url: Optional[str], dpid: int, dst_prefix: str, state: int,
+               candidates: Iterable[int]) -> Optional[int]:
+        entry = self.policies.get(url) if url is not None else None
+        port = None
+        if entry is not None and time.time() - entry[1] <= self.max_age_s:
+            ports = entry[2].get((int(dpid), str(dst_prefix)))
+            if ports is not None and 0 <= state < len(ports):
+                port = ports[state]
+        # A table built for other candidates (routes changed) is not used.
+        if port is None or port not in {int(p) for p in candidates}:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return port
+
+    def versions(self) -> Dict[str, int]:
+        return {url: v for url, (v, _, _) in self.policies.items()}
@@ -1,3 +1,4 @@
+import atexit
 import json
 import time
 import pprint
@@ -18,6 +19,11 @@ import csv
 import os
 import requests
 
+from qlearning_core import LOG_HEADER, DecisionLog, EmbeddedAgent, QoSModel
+
+from agent_cluster import AgentCluster
+from policy_cache import PolicyCache
+
 # --- CONFIGURATION ---
 CONGESTION_THRESHOLD = 200000 
 MONITOR_INTERVAL = 2            # Monitor every 2 seconds
@@ -74,12 +80,47 @@ class AntiLoopController(app_manager.RyuApp):
         self.q_drops = {}          # Lưu drops cho Q-Learning
 
         self.agent_url = os.environ.get("QLEARNING_AGENT_URL", "http://qlearning-agent:5000").rstrip("/")
+        # QLEARNING_AGENT_URLS (comma-separated) shards switches across several
+        # agents by consistent hashing of the dpid.
+        agent_urls = os.environ.get("QLEARNING_AGENT_URLS", "").split(",")
+        agent_urls = [u.strip() for u in agent_urls if u.strip()] or [self.agent_url]
         self.agent_timeout_s = float(os.environ.get("QLEARNING_AGENT_TIMEOUT_S", "0.3"))
+        self.agent_health_interval_s = float(os.environ.get("QLEARNING_AGENT_HEALTH_INTERVAL_S", "5"))
         self.flow_idle_timeout = int(os.environ.get("FLOW_IDLE_TIMEOUT", "20"))
         self.flow_hard_timeout = int(os.environ.get("FLOW_HARD_TIMEOUT", "0"))
         self._agent_session = requests.Session()
+        self.agents = AgentCluster(agent_urls, session=self._agent_session, logger=self.logger)
+
+        # QLEARNING_POLICY_SYNC=1 keeps each agent's greedy policy locally
+        # (long-polling GET /policy) and answers from it; a
+        # QLEARNING_POLICY_EXPLORE fraction of decisions, and every flow the
+        # policy does not cover, still go to the live agent's /act.
+        self.policy_sync = os.environ.get("QLEARNING_POLICY_SYNC", "0") == "1"
+        self.policy_explore = float(os.environ.get("QLEARNING_POLICY_EXPLORE", "0.1"))
+        self.qos_model = QoSModel(CONGESTION_THRESHOLD)
+        self.policies = PolicyCache(
+            session=requests.Session(),
+            wait_s=float(os.environ.get("QLEARNING_POLICY_WAIT_S", "20")),
+            max_age_s=float(os.environ.get("QLEARNING_POLICY_MAX_AGE_S", "60")),
+            logger=self.logger,
+        )
+
+        # QLEARNING_EMBEDDED=1 decides in this process with the shared
+        # qlearning_core agent instead of asking the agent service: same flow
+        # keys, state, reward, decision log rows and checkpoint format, without
+        # the HTTP round trip. Learning settings are the agent's QL_* ones.
+        # Rows go to QLEARNING_LOG_PATH through a buffered writer; tables are
+        # saved to QLEARNING_CHECKPOINT_PATH every
+        # QLEARNING_CHECKPOINT_INTERVAL_S and restored from
+        # QLEARNING_RESTORE_FROM, a checkpoint of either deployment.
+        self.embedded = None
+        if os.environ.get("QLEARNING_EMBEDDED", "0") == "1":
+            self.embedded = self._embedded_agent()
 
         self.last_agent_choice = {}
+        # Answers from a saturated agent (admission control): its greedy port
+        # ("greedy") or a 429 telling us to use the static port ("default").
+        self.agent_shed = {"greedy": 0, "default": 0}
 
         self.static_arp_table = {
             "10.0.100.2": self.CLOUD_MAC,
@@ -111,11 +152,91 @@ class AntiLoopController(app_manager.RyuApp):
         self.print_routing_table_pretty()
 
         self.monitor_thread = hub.spawn(self._monitor)
+        if len(self.agents.urls) > 1:
+            self.agent_health_thread = hub.spawn(self._agent_health)
+        if self.policy_sync:
+            self.policy_threads = [hub.spawn(self._policy_sync, u) for u in self.agents.urls]
+        if self.embedded is not None and self.embedded_checkpoint_interval_s > 0:
+            self.embedded_checkpoint_thread = hub.spawn(self._embedded_checkpoint)
+
+    def _embedded_agent(self) -> EmbeddedAgent:
+        log_path = os.environ.get("QLEARNING_LOG_PATH", "/shared/raw/qlearning_agent_log.csv")
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        log = DecisionLog(log_path, LOG_HEADER)
+        log.start()
+        atexit.register(log.flush)
+        embedded = EmbeddedAgent(
+            CONGESTION_THRESHOLD,
+            log=log,
+            lr=float(os.environ.get("QL_LR", "0.1")),
+            gamma=float(os.environ.get("QL_GAMMA", "0.9")),
+            epsilon=float(os.environ.get("QL_EPSILON", "1.0")),
+            epsilon_min=float(os.environ.get("QL_EPSILON_MIN", "0.05")),
+            epsilon_decay=float(os.environ.get("QL_EPSILON_DECAY", "0.995")),
+            learner=os.environ.get("QL_LEARNER", "q"),
+            exploration=os.environ.get("QL_EXPLORATION", "epsilon"),
+        )
+        self.embedded_checkpoint_path = os.environ.get(
+            "QLEARNING_CHECKPOINT_PATH", "/shared/checkpoints/qlearning_embedded.npz"
+        )
+        self.embedded_checkpoint_interval_s = float(os.environ.get("QLEARNING_CHECKPOINT_INTERVAL_S", "30"))
+        restore_from = os.environ.get("QLEARNING_RESTORE_FROM", "")
+        if restore_from:
+            try:
+                n = embedded.restore(restore_from)
+                self.logger.info(f"[EMBEDDED] restored {n} keys from {restore_from}")
+            except FileNotFoundError:
+                self.logger.info(f"[EMBEDDED] no checkpoint at {restore_from}; starting cold")
+            except Exception as e:
+                self.logger.info(f"[EMBEDDED] failed to restore {restore_from}: {e}; starting cold")
+        self.logger.info(f"[EMBEDDED] deciding in-process, logging to {log_path}")
+        return embedded
+
+    def _embedded_checkpoint(self):
+        while True:
+            hub.sleep(self.embedded_checkpoint_interval_s)
+            try:
+                self.embedded.save(self.embedded_checkpoint_path)
+            except Exception as e:
+                self.logger.info(f"[EMBEDDED] checkpoint failed: {e}")
+
+    def _policy_sync(self, agent_url: str):
+        while True:
+            try:
+                self.policies.poll(agent_url)
+            except Exception as e:
+                self.logger.info(f"[POLICY] {agent_url} unavailable: {e}")
+                hub.sleep(self.agent_health_interval_s)
+
+    def _switch_metrics(self, dpid: int):
+        # Same aggregation as the agent: worst port/queue load and total drops.
+        loads = [v for k, v in self.q_port_load.items() if k[0] == dpid]
+        if not loads:
+            return None
+        drops = sum(v for k, v in self.q_drops.items() if k[0] == dpid)
+        return max(loads), drops
+
+    def _switch_state(self, dpid: int) -> int:
+        metrics = self._switch_metrics(dpid)
+        if metrics is None:
+            return 0
+        return self.qos_model.get_state(load_bps=metrics[0], drops=metrics[1])
+
+    def _agent_health(self):
+        while True:
+            try:
+                self.agents.check(set(self.datapaths) | set(self.routing_table))
+            except Exception:
+                self.logger.exception("[AGENTS] health check failed")
+            hub.sleep(self.agent_health_interval_s)
 
     def _agent_observe(self, dpid: int, port: int, load_bps: float, drops: int, qid: Optional[int] = None):
+        agent_url = self.agents.url_for(dpid)
+        if agent_url is None:
+            return
         try:
             self._agent_session.post(
-                f"{self.agent_url}/observe",
+                f"{agent_url}/observe",
                 json={
                     "dpid": int(dpid),
                     "port": int(port),
@@ -128,17 +249,73 @@ class AntiLoopController(app_manager.RyuApp):
         except Exception:
             return
 
+    def _policy_out_port(self, agent_url: str, dpid: int, dst_prefix: str, candidates):
+        state = self._switch_state(dpid)
+        out_port = self.policies.lookup(agent_url, dpid, dst_prefix, state, candidates)
+        if out_port is not None:
+            self.last_agent_choice[f"{int(dpid)}:{dst_prefix}"] = {
+                "ts": time.time(),
+                "dpid": int(dpid),
+                "dst_prefix": str(dst_prefix),
+                "candidates": [int(p) for p in list(candidates)],
+                "out_port": out_port,
+                "state": state,
+                "policy_version": self.policies.policies[agent_url][0],
+            }
+        return out_port
+
+    def _embedded_out_port(self, dpid: int, dst_prefix: str, candidates):
+        max_load, drops = self._switch_metrics(dpid) or (0.0, 0)
+        try:
+            decision = self.embedded.decide(dpid, dst_prefix, candidates, max_load, drops)
+        except Exception as e:
+            self.logger.info(f"[EMBEDDED] decision failed: {e}")
+            return None
+        self.last_agent_choice[f"{int(dpid)}:{dst_prefix}"] = {
+            "ts": time.time(),
+            "dpid": int(dpid),
+            "dst_prefix": str(dst_prefix),
+            "candidates": [int(p) for p in list(candidates)],
+            "out_port": int(decision.out_port),
+            "state": decision.state,
+            "action": decision.action,
+            "epsilon": float(decision.epsilon),
+            "step": decision.step,
+            "embedded": True,
+        }
+        return int(decision.out_port)
+
     def _agent_choose_out_port(self, dpid: int, dst_prefix: str, candidates):
+        if self.embedded is not None:
+            return self._embedded_out_port(dpid, dst_prefix, candidates)
+        agent_url = self.agents.url_for(dpid)
+        if agent_url is None:
+            return None
+        if self.policy_sync and random.random() >= self.policy_explore:
+            out_port = self._policy_out_port(agent_url, dpid, dst_prefix, candidates)
+            if out_port is not None:
+                return out_port
         try:
             resp = self._agent_session.post(
-                f"{self.agent_url}/act",
+                f"{agent_url}/act",
                 json={"dpid": int(dpid), "dst_prefix": str(dst_prefix), "candidates": list(candidates)},
+                # Lets the agent shed a request that queued too long there.
+                headers={"X-Request-Sent": repr(time.time())},
                 timeout=self.agent_timeout_s,
             )
+            if resp.status_code == 429:
+                # Saturated agent with no greedy port for this flow: fall back
+                # now (to the local policy if synced, else the static port).
+                self.agent_shed["default"] += 1
+                if self.policy_sync:
+                    return self._policy_out_port(agent_url, dpid, dst_prefix, candidates)
+                return None
             if resp.status_code != 200:
                 return None
             data = resp.json() if resp.content else {}
             out_port = data.get("out_port")
+            if data.get("admitted") is False:
+                self.agent_shed["greedy"] += 1
             try:
                 self.last_agent_choice[f"{int(dpid)}:{dst_prefix}"] = {
                     "ts": time.time(),
@@ -150,6 +327,7 @@ class AntiLoopController(app_manager.RyuApp):
                     "action": data.get("action"),
                     "epsilon": data.get("epsilon"),
                     "step": data.get("step"),
+                    "admitted": data.get("admitted", True),
                 }
             except Exception:
                 pass
@@ -610,6 +788,26 @@ class RestRouterController(ControllerBase):
         body = json.dumps(self.app.last_agent_choice)
         return Response(content_type='application/json', body=body.encode('utf-8'))
 
+    @route('qos', '/qos/agents', methods=['GET'])
+    def get_agent_shards(self, req, **kwargs):
+        agents = self.app.agents
+        dpids = sorted(set(self.app.datapaths) | set(self.app.routing_table))
+        body = json.dumps({
+            "agents": agents.urls,
+            "live": agents.ring.nodes,
+            "owners": {str(d): u for d, u in agents.owners(dpids).items()},
+            "migrations": agents.migrations,
+            "policy": {
+                "enabled": self.app.policy_sync,
+                "explore": self.app.policy_explore,
+                "versions": self.app.policies.versions(),
+                "hits": self.app.policies.hits,
+                "misses": self.app.policies.misses,
+            },
+            "shed": self.app.agent_shed,
+        })
+        return Response(content_type='application/json', body=body.encode('utf-8'))
+
     @route('qos', '/qos/snapshot', methods=['GET'])
     def get_snapshot(self, req, **kwargs):
         port_load = {f"{k[0]}:{k[1]}": float(v) for k, v in self.app.q_port_load.items() if isinstance(k, tuple) and len(k) == 2}